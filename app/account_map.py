@@ -0,0 +1,163 @@
+"""
+备用号 / 捡漏账号 -> 主账号 映射缓存
+几乎每条消息和按钮都要把发送者解析为主账号，这里把 members.backup_account 与
+fallback_accounts.main_account_id 一次性加载到内存，解析时只查字典
+1. 本进程内 link_account 等修改直接增量更新
+2. 后台修改捡漏账号 / 删除会员时递增 system_config 中的版本号，其他进程检测到后重新加载
+"""
+import time
+
+# 跨进程版本号检查间隔（秒）
+VERSION_CHECK_INTERVAL = 5
+
+CACHE_NAME = 'account_map'
+
+
+def _backup_key(value):
+    """backup_account 字段的统一格式：数字ID 转 int，用户名转小写且去掉 @"""
+    text = str(value or '').strip()
+    if not text:
+        return None
+    if text.isdigit():
+        return int(text)
+    return text.lstrip('@').lower() or None
+
+
+class AccountMap:
+    """双向映射：备用账号 -> 主账号，主账号 -> 备用账号集合"""
+
+    def __init__(self):
+        self._backup_to_main = {}    # 备用号ID / 用户名 -> 主账号ID（members.backup_account）
+        self._fallback_to_main = {}  # 捡漏账号ID -> 主账号ID（fallback_accounts）
+        self._main_to_backups = {}   # 主账号ID -> set(备用号ID / 用户名 / 捡漏账号ID)
+        self._loaded = False
+        self._version = None
+        self._version_checked = 0
+
+    # ---------- 查询 ----------
+
+    def resolve(self, telegram_id, username=None):
+        """返回主账号ID；不是任何人的备用号时原样返回"""
+        self._ensure_loaded()
+        main_id = self._backup_to_main.get(telegram_id)
+        if main_id is None and username:
+            main_id = self._backup_to_main.get(_backup_key(username))
+        if main_id is None:
+            main_id = self._fallback_to_main.get(telegram_id)
+        return telegram_id if main_id is None else main_id
+
+    def backups_of(self, main_id):
+        self._ensure_loaded()
+        return set(self._main_to_backups.get(main_id, ()))
+
+    # ---------- 增量更新 ----------
+
+    def set_backup(self, main_id, backup_value, propagate=True):
+        """members.backup_account 更新后调用（同一主账号只有一个备用号）"""
+        self._ensure_loaded()
+        for key in list(self._main_to_backups.get(main_id, ())):
+            if self._backup_to_main.get(key) == main_id:
+                self._unlink(key, self._backup_to_main)
+        key = _backup_key(backup_value)
+        if key is not None:
+            self._backup_to_main.setdefault(key, main_id)
+            self._main_to_backups.setdefault(main_id, set()).add(key)
+        if propagate:
+            self._publish()
+
+    def set_fallback(self, telegram_id, main_id, propagate=True):
+        """fallback_accounts.main_account_id 更新后调用（main_id 为 None 表示解除）"""
+        self._ensure_loaded()
+        self._unlink(telegram_id, self._fallback_to_main)
+        if main_id:
+            self._fallback_to_main[telegram_id] = main_id
+            self._main_to_backups.setdefault(main_id, set()).add(telegram_id)
+        if propagate:
+            self._publish()
+
+    def _unlink(self, key, mapping):
+        main_id = mapping.pop(key, None)
+        if main_id is None:
+            return
+        if main_id in (self._backup_to_main.get(key), self._fallback_to_main.get(key)):
+            return  # 另一种关联方式仍指向该主账号
+        backups = self._main_to_backups.get(main_id)
+        if backups:
+            backups.discard(key)
+            if not backups:
+                del self._main_to_backups[main_id]
+
+    def _publish(self):
+        """
+        本进程已增量更新：递增版本号通知其他进程，自身不重新加载
+        期间其他进程也有修改（版本号不是紧接着的下一个）时保留旧版本号，下次查询时重新加载
+        """
+        try:
+            from .database import bump_cache_version
+            version = bump_cache_version(CACHE_NAME)
+        except Exception as e:
+            print(f'[账号映射] 更新版本号失败: {e}')
+            return
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+        else:
+            self._version_checked = 0
+
+    # ---------- 加载与失效 ----------
+
+    def invalidate(self, propagate=False):
+        """
+        下次查询时从数据库重新加载
+        propagate=True 时同时递增数据库版本号，通知其他进程
+        """
+        self._loaded = False
+        if propagate:
+            self._publish()
+
+    def _ensure_loaded(self):
+        self._sync_version()
+        if not self._loaded:
+            self._load()
+
+    def _load(self):
+        from .database import get_db_conn
+        backup_to_main, fallback_to_main, main_to_backups = {}, {}, {}
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT telegram_id, backup_account FROM members "
+                      "WHERE backup_account IS NOT NULL AND backup_account != '' ORDER BY rowid")
+            for main_id, backup_account in c.fetchall():
+                key = _backup_key(backup_account)
+                if key is not None and key not in backup_to_main:
+                    backup_to_main[key] = main_id
+                    main_to_backups.setdefault(main_id, set()).add(key)
+            c.execute('SELECT telegram_id, main_account_id FROM fallback_accounts '
+                      'WHERE main_account_id IS NOT NULL')
+            for telegram_id, main_id in c.fetchall():
+                if telegram_id and main_id:
+                    fallback_to_main[telegram_id] = main_id
+                    main_to_backups.setdefault(main_id, set()).add(telegram_id)
+        finally:
+            conn.close()
+        self._backup_to_main = backup_to_main
+        self._fallback_to_main = fallback_to_main
+        self._main_to_backups = main_to_backups
+        self._loaded = True
+
+    def _sync_version(self):
+        now = time.time()
+        if now - self._version_checked < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        try:
+            from .database import get_cache_version
+            version = get_cache_version(CACHE_NAME)
+        except Exception:
+            return
+        if self._version is not None and version != self._version:
+            self._loaded = False
+        self._version = version
+
+
+account_map = AccountMap()
@@ -0,0 +1,136 @@
+"""
+后台操作队列 - Web 后台需要机器人执行的操作（充值到账后续处理、手动开通VIP）写入 bot_actions 表
+1. Web 进程只调用 database.enqueue_bot_action 写一行，不依赖本进程是否运行机器人
+2. worker 角色的进程领取记录（租约），按 action 调用注册的处理函数
+3. 这些操作会发放余额 / 分红，只执行一次：领取后进程退出、租约过期的记录标记为 failed，不自动重试
+"""
+import asyncio
+import json
+import time
+
+from .database import get_db_conn, get_cn_time
+from .broadcast_queue import make_worker_id
+
+# 租约时长（秒）：需覆盖一次操作（开通VIP + 分红 + 通知）的最长耗时
+LEASE_SECONDS = 600
+POLL_INTERVAL = 2
+FETCH_BATCH = 20
+
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+class BotActionRunner:
+    """领取 bot_actions 记录并逐条执行"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self._loop = None
+        self._wake = None
+        self.stats = {'done': 0, 'failed': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self, handlers):
+        """
+        handlers: {action: async handler(**payload)}，返回值写入 result
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                self._expire_stale()
+                for action_id, action, payload in self._claim(FETCH_BATCH):
+                    await self._execute(handlers, action_id, action, payload)
+            except Exception as e:
+                print(f'[后台操作] 轮询失败: {e}')
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _execute(self, handlers, action_id, action, payload):
+        handler = handlers.get(action)
+        if handler is None:
+            self._finish(action_id, STATUS_FAILED, f'未知操作: {action}')
+            self.stats['failed'] += 1
+            return
+        try:
+            result = await handler(**json.loads(payload or '{}'))
+        except Exception as e:
+            print(f'[后台操作] #{action_id} {action} 失败: {e}')
+            self._finish(action_id, STATUS_FAILED, f'{type(e).__name__}: {e}'[:500])
+            self.stats['failed'] += 1
+            return
+        self._finish(action_id, STATUS_DONE, str(result)[:500])
+        self.stats['done'] += 1
+
+    # ---------- 租约 ----------
+
+    def _claim(self, limit):
+        """原子领取最多 limit 条待执行记录，返回 [(id, action, payload)]"""
+        now = time.time()
+        conn = get_db_conn()
+        try:
+            conn.isolation_level = None
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                c.execute('SELECT id, action, payload FROM bot_actions WHERE status = ? ORDER BY id LIMIT ?',
+                          (STATUS_PENDING, limit))
+                rows = c.fetchall()
+                if rows:
+                    placeholders = ','.join('?' for _ in rows)
+                    c.execute(
+                        f'UPDATE bot_actions SET status = ?, claimed_by = ?, lease_until = ? '
+                        f'WHERE id IN ({placeholders})',
+                        [STATUS_RUNNING, self.worker_id, now + LEASE_SECONDS] + [row[0] for row in rows])
+                c.execute('COMMIT')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+            return rows
+        finally:
+            conn.close()
+
+    def _expire_stale(self):
+        """领取后进程退出、租约已过期的记录：不知道是否已执行，标记失败，由管理员核对"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE bot_actions SET status = ?, result = ?, finish_time = ? '
+                      'WHERE status = ? AND lease_until < ?',
+                      (STATUS_FAILED, '执行中进程退出，未确认是否完成', get_cn_time(),
+                       STATUS_RUNNING, time.time()))
+            conn.commit()
+            if c.rowcount:
+                print(f'[后台操作] {c.rowcount} 条操作执行中断，已标记失败')
+        finally:
+            conn.close()
+
+    def _finish(self, action_id, status, result):
+        conn = get_db_conn()
+        try:
+            conn.execute('UPDATE bot_actions SET status = ?, result = ?, finish_time = ?, lease_until = NULL '
+                         'WHERE id = ? AND claimed_by = ?',
+                         (status, result, get_cn_time(), action_id, self.worker_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+bot_action_runner = BotActionRunner()
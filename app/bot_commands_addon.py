@@ -6,6 +6,8 @@
 
 from telethon import events, Button
 from .core_functions import check_bot_is_admin, check_any_bot_in_group, get_upline_chain, get_downline_tree, check_user_conditions
+from .bot_registry import bot_registry
+from .required_groups import required_groups_cache
 import sqlite3
 
 
@@ -54,7 +56,7 @@ async def handle_group_link_message(event, bot, DB, clients=None):
         is_admin = admin_bot_id is not None
     else:
         # 回退到单机器人逻辑
-        bot_id = (await bot.get_me()).id
+        bot_id = await bot_registry.resolve_id(bot)
         is_admin = await check_bot_is_admin(bot, bot_id, group_link)
 
     # 更新数据库
@@ -67,6 +69,7 @@ async def handle_group_link_message(event, bot, DB, clients=None):
     ''', (group_link, 1 if is_admin else 0, telegram_id))
     conn.commit()
     conn.close()
+    required_groups_cache.invalidate_upline(telegram_id)
 
     if is_admin:
         await event.respond(
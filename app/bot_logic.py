@@ -9,8 +9,9 @@ import sqlite3
 import time
 import os
 from urllib.parse import quote  # 【新增】用于URL编码推广文案
+from functools import wraps
 from datetime import datetime, timedelta, timezone
-from telethon import TelegramClient, events, Button
+from telethon import events, Button, errors
 from telethon.sessions import MemorySession
 from telethon.tl.types import (
     ChannelParticipantsAdmins,
@@ -24,13 +25,44 @@ import socks
 
 from .config import (
     API_ID, API_HASH, ADMIN_IDS, USE_PROXY,
-    PROXY_TYPE, PROXY_HOST, PROXY_PORT, DATA_DIR
+    PROXY_TYPE, PROXY_HOST, PROXY_PORT, DATA_DIR,
+    HEALTH_CHECK_BUDGET_PER_BOT, HEALTH_CHECK_MIN_INTERVAL, HEALTH_CHECK_MAX_INTERVAL,
+    CONVERSATION_TTL, CONVERSATION_MAX_ENTRIES, CONVERSATION_PERSIST,
+    BOT_START_CONCURRENCY, BOT_START_TIMEOUT, BOT_RETRY_MAX_DELAY, METRICS_ENABLED,
+    NOTIFY_WORKERS, NOTIFY_MAX_ATTEMPTS, BROADCAST_QUEUE_WORKERS,
+    DM_CAMPAIGN_CHUNK, DM_CAMPAIGN_RATE_PER_BOT
+)
+from .database import (
+    DB, get_cn_time, get_system_config, get_db_conn, get_cache_version,
+    get_member_group_titles, get_stale_group_titles,
+    save_member_group_title, save_fallback_group_titles
+)
+from .bot_registry import bot_registry
+from .required_groups import required_groups_cache
+from .group_health import GroupHealthScheduler
+from .send_dispatcher import SendDispatcher
+from .update_router import UpdateRouter
+from .metrics import registry as metrics_registry, timed_handler, observe_route, \
+    updates_dropped, telegram_client_class
+from .account_map import account_map
+from .notify_outbox import notify_outbox
+from .dm_campaign import dm_campaign_runner
+from .bot_actions import bot_action_runner
+from .pinned_campaign import pinned_campaign_runner
+from .broadcast_scheduler import broadcast_scheduler
+from .broadcast_queue import broadcast_queue_consumer
+from .broadcast_payload import broadcast_payloads
+from .group_affinity import group_affinity
+from .group_peers import group_peers
+from .rate_limiter import button_rate_limiter
+from .conversation_state import (
+    ConversationStore, STATE_GROUP_LINK, STATE_BACKUP, STATE_RECHARGE_AMOUNT,
+    STATE_WITHDRAW_AMOUNT, STATE_WITHDRAW_ADDRESS, ADMIN_STATE_PREFIX
 )
-from .database import DB, get_cn_time, get_system_config, get_db_conn
 from .core_functions import (
     get_upline_chain, check_user_conditions, update_level_path,
     distribute_vip_rewards, check_user_in_group, check_bot_is_admin,
-    verify_group_link, check_any_bot_in_group
+    verify_group_link, check_any_bot_in_group, check_user_in_groups
 )
 from .bot_commands_addon import (
     handle_bind_group, handle_join_upline, handle_group_link_message,
@@ -107,19 +139,12 @@ async def send_vip_required_prompt(event_or_id, reply_method='respond'):
         if isinstance(event_or_id, int):
             telegram_id = event_or_id
             member = DB.get_member(telegram_id)
-            client = bot  # 默认使用主bot发送主动消息
+            client = send_dispatcher  # 主动消息由发送调度选择机器人
         else:
             original = event_or_id
             client = original.client  # 使用触发事件的那个机器人实例
-            try:
-                original_sender_id = original.sender_id
-                original.sender_id = get_main_account_id(
-                    original_sender_id, getattr(
-                        original.sender, 'username', None))
-            except Exception:
-                pass
-            member = DB.get_member(original.sender_id)
-            telegram_id = original.sender_id
+            telegram_id = resolve_event_account(original)
+            member = DB.get_member(telegram_id)
 
         config = get_system_config()
         # 优先从配置计算VIP总价，确保和层级设置一致
@@ -185,24 +210,28 @@ def get_active_bot_tokens():
         return []
 
 
-# 初始化客户端列表
+def load_bot_tokens():
+    """数据库中的活跃机器人，没有配置时使用配置文件中的默认Token"""
+    tokens = get_active_bot_tokens()
+    if not tokens:
+        from .config import BOT_TOKEN
+        if BOT_TOKEN:
+            print("[机器人初始化] 数据库无配置，使用默认配置文件Token")
+            tokens.append((0, BOT_TOKEN))
+        else:
+            print("[机器人初始化] ❌ 错误：没有找到任何机器人配置！")
+    return tokens
+
+
+# 初始化客户端列表（run_bot 启动后由各机器人的守护任务填充）
 clients = []
-active_tokens = get_active_bot_tokens()
+active_tokens = []
 
 registered_handlers = []
 
 # 权限检查控制变量
 permission_check_triggered = False
 
-# 如果数据库没配置，尝试读取环境变量配置作为默认
-if not active_tokens:
-    from .config import BOT_TOKEN
-    if BOT_TOKEN:
-        print("[机器人初始化] 数据库无配置，使用默认配置文件Token")
-        active_tokens.append((0, BOT_TOKEN))
-    else:
-        print("[机器人初始化] ❌ 错误：没有找到任何机器人配置！")
-
 # 代理设置
 proxy = None
 if USE_PROXY:
@@ -215,206 +244,117 @@ if USE_PROXY:
     else:
         proxy = (socks.SOCKS5, PROXY_HOST, PROXY_PORT)
 
-# 确保 session 目录存在
-os.makedirs(SESSION_DIR, exist_ok=True)
-
-# 创建所有机器人客户端
-for db_id, token in active_tokens:
-    try:
-        # 【关键修复】使用独立的 Session 文件名，防止冲突
-        # 使用数据库ID作为区分，ID为0的是配置文件默认Bot
-        session_name = f'bot_{db_id}'
-        session_path = os.path.join(SESSION_DIR, session_name)
-
-        print(f"[机器人初始化] 正在启动 Bot ID {db_id} (Session: {session_name})...")
-
-        # 【新增】添加重试机制，解决网络连接问题
-        max_retries = 3
-        for attempt in range(max_retries):
-            try:
-                client = TelegramClient(
-                    session_path, API_ID, API_HASH, proxy=proxy)
-                # 启动客户端，设置较长的超时时间
-                client.start(bot_token=token)
-                clients.append(client)
-                print(
-                    f"[机器人初始化] ✅ 成功启动: {token[:10]}... (尝试 {attempt + 1}/{max_retries})")
-                break  # 成功启动，跳出重试循环
-            except Exception as retry_e:
-                print(f"[机器人初始化] 尝试 {attempt + 1}/{max_retries} 失败: {retry_e}")
-                if attempt == max_retries - 1:
-                    raise retry_e  # 最后一次尝试失败，抛出异常
-                import time
-                time.sleep(2)  # 等待2秒后重试
-
-    except Exception as e:
-        print(f"[机器人初始化] ❌ 启动失败 (ID: {db_id}): {e}")
-        print(f"[机器人初始化] 🔄 将跳过此机器人，继续启动其他机器人...")
-
-if not clients:
-    print("[机器人初始化] ❌ 严重错误：无法启动任何机器人")
-    print("[机器人初始化] 💡 Web管理后台仍可正常使用，请检查机器人Token配置")
-    bot = None
-else:
-    # 定义 bot 为第一个客户端 (主要用于后台任务的主动发送)
-    bot = clients[0]
-    print(f"[机器人初始化] 🎉 成功启动 {len(clients)} 个机器人客户端")
+# 机器人在 run_bot 中并发启动，登录成功后才加入 clients
+bot = None
+# db_id -> 该机器人的守护任务
+_bot_supervisors = {}
+# 是否接收 Telegram 更新（仅跑后台任务的 worker 进程为 False）
+_receive_updates = True
+# 检查后台是否新增机器人的间隔（秒）
+BOT_CONFIG_CHECK_INTERVAL = 5
 
 # 自定义装饰器：注册事件到所有机器人
 
 
 def multi_bot_on(event_builder):
     def decorator(handler):
-        registered_handlers.append((handler, event_builder))
+        timed = timed_handler()(handler)
+        registered_handlers.append((timed, event_builder))
         for client in clients:
-            client.add_event_handler(handler, event_builder)
+            client.add_event_handler(timed, event_builder)
         return handler
     return decorator
 
 
-print(f"[机器人初始化] ✅ 全部启动完成，共 {len(clients)} 个机器人在线")
+# 多机器人发送调度：后台主动发送的消息统一经由它分配机器人
+send_dispatcher = SendDispatcher(lambda: clients, bot_registry, peer_store=group_peers)
+# 处理器中顺带发出的通知：不因限速 / FloodWait 阻塞处理器，发不出去的转入通知发件箱
+interactive_sender = send_dispatcher.interactive()
 
-# 全局队列
-pending_broadcasts = []
-notify_queue = []
-process_recharge_queue = []
-waiting_for_group_link = {}
-waiting_for_backup = {}
-waiting_for_recharge_amount = {}
-waiting_for_withdraw_amount = {}
-waiting_for_withdraw_address = {}
-withdraw_temp_data = {}
-admin_waiting = {}
 
-# 全局通知防重缓存 { "user_group_reason": timestamp }
-notification_history = {}
+def _prepare_update(event):
+    """每条消息 / 每次按钮点击在分发前执行一次"""
+    # 记录用户私聊 / 点击的是哪个机器人，主动发送时优先使用该机器人
+    if isinstance(event, events.CallbackQuery.Event) or event.is_private:
+        send_dispatcher.note_peer(event.sender_id, event.client)
+    resolve_event_account(event)
 
-# 按钮点击频率限制缓存 { user_id: [timestamp1, timestamp2, ...] }
-button_click_history = {}
 
-# 【新增】用户惩罚状态缓存 { user_id: expire_timestamp }
-# 用于记录被封禁用户的解封时间，确保即便是由"1分钟20次"触发的"5分钟惩罚"，
-# 在1分钟历史记录清除后，依然能持续生效直到5分钟结束。
-user_restrictions = {}
+def _message_fast_path(event):
+    """
+    没有命中命令 / 菜单按钮的消息在进入 message_handler 前的快速过滤
+    message_handler 只处理进行中的输入流程和私聊 /cancel，其余消息（主要是群聊）直接丢弃
+    返回丢弃原因，None 表示交给 message_handler；不访问 Telegram
+    先按聊天类型 / 命令前缀丢弃（输入流程只在私聊中进行），只有私聊普通文本才解析账号、检查对话状态
+    （账号映射 / 对话状态镜像每隔几秒最多检查一次版本号）
+    """
+    text = event.raw_text
+    if not text:
+        return 'no_text'
+    if not event.is_private:
+        return 'group_idle'
+    text = text.strip()
+    if text == '/cancel':
+        return None
+    if text.startswith('/'):
+        return 'unknown_command'
+    if conversation_store.has_active(resolve_event_account(event)):
+        return None
+    return 'private_idle'
 
-# 导入支付模块
 
-# ==================== 按钮频率限制逻辑 ====================
+# 消息与按钮统一经由路由分发：每个更新只调用一个处理器
+update_router = UpdateRouter(prepare=_prepare_update, fallback_filter=_message_fast_path)
+if METRICS_ENABLED:
+    update_router.add_hook(observe_route)
+multi_bot_on(events.NewMessage())(update_router.dispatch_message)
+multi_bot_on(events.CallbackQuery())(update_router.dispatch_callback)
 
 
-def check_button_rate_limit(user_id, event=None):
-    """
-    检查按钮点击频率限制 (带强制惩罚机制)
+def _collect_dropped_updates():
+    """输出 /metrics 前同步路由快速过滤的丢弃计数"""
+    for reason, count in list(update_router.dropped.items()):
+        updates_dropped.set_total(reason, value=count)
 
-    规则:
-    - 5秒内点3次 -> 封1分钟
-    - 1分钟内点20次 -> 封5分钟
 
-    返回值:
-    - None: 允许点击
-    - (剩余秒数, 提示消息): 被限制
-    """
-    import time
-    current_time = time.time()
-
-    # --- 第一步：检查是否在惩罚期内 ---
-
-    if user_id in user_restrictions:
-        expire_time = user_restrictions[user_id]
-        if current_time < expire_time:
-            # 仍在惩罚期，计算剩余时间
-            remaining = int(expire_time - current_time)
-
-            # 根据剩余时间生成文案
-            if remaining > 60:
-                mins = int(remaining / 60)
-                secs = remaining % 60
-                msg = f"🚫 操作频率过高！\n系统限制中，需等待 {mins}分{secs}秒 后解除"
-            else:
-                msg = f"⏰ 操作太快了\n请休息 {remaining} 秒后再试"
+if METRICS_ENABLED:
+    metrics_registry.add_collector(_collect_dropped_updates)
 
-            return (remaining, msg)
-        else:
-            # 惩罚时间已过，移除惩罚并清空历史，给用户重新开始的机会
-            del user_restrictions[user_id]
-            if user_id in button_click_history:
-                button_click_history[user_id] = []
-
-    # --- 第二步：记录与判定 ---
-
-    # 初始化
-    if user_id not in button_click_history:
-        button_click_history[user_id] = []
-
-    # 清理60秒前的旧记录 (只保留最近60秒的数据用于计算频率)
-    button_click_history[user_id] = [
-        ts for ts in button_click_history[user_id]
-        if current_time - ts < 60
-    ]
-
-    user_clicks = button_click_history[user_id]
-
-    # 规则A：5秒内点击 >= 3次 (检测短时爆发)
-    # 逻辑：如果过去5秒内已经有2次点击，加上这一次就是3次，触发限制
-    recent_clicks_count = len([ts for ts in user_clicks if current_time - ts <= 5])
-    if recent_clicks_count >= 2:
-        # 触发 1分钟 惩罚
-        restriction_time = 60
-        user_restrictions[user_id] = current_time + restriction_time
-        return (restriction_time, "⏰ 点击太快了！\n检测到5秒内连续操作\n系统限制 1分钟 后解除")
-
-    # 规则B：1分钟内点击 >= 20次 (检测长时刷屏)
-    # 逻辑：如果过去60秒内已经有19次点击，加上这一次就是20次，触发限制
-    if len(user_clicks) >= 19:
-        # 触发 5分钟 惩罚
-        restriction_time = 300
-        user_restrictions[user_id] = current_time + restriction_time
-        return (restriction_time, "🚫 操作频率过高！\n1分钟内操作超20次\n系统限制 5分钟 后解除")
-
-    # --- 第三步：通过检查，记录本次点击 ---
-
-    user_clicks.append(current_time)
+# 用户输入流程状态（群链接 / 备用号 / 充值 / 提现 / 管理员设置）
+conversation_store = ConversationStore(
+    CONVERSATION_TTL, CONVERSATION_MAX_ENTRIES, CONVERSATION_PERSIST)
 
-    return None
+# 群组健康检测调度器（事件驱动 + 自适应轮询）
+group_health = GroupHealthScheduler(
+    HEALTH_CHECK_BUDGET_PER_BOT, HEALTH_CHECK_MIN_INTERVAL, HEALTH_CHECK_MAX_INTERVAL)
+
+# 全局通知防重缓存 { "user_group_reason": timestamp }
+notification_history = {}
+
+# 导入支付模块
+
+# ==================== 按钮频率限制逻辑 ====================
 
 
 def rate_limit_callback(func):
-    """按钮频率限制装饰器"""
+    """按钮频率限制装饰器（规则见 ButtonRateLimiter）"""
+    @wraps(func)
     async def wrapper(event, *args, **kwargs):
         # 获取用户ID（考虑账号关联）
         original_sender_id = event.sender_id
         try:
-            mapped_id = get_main_account_id(
-                original_sender_id, getattr(event.sender, 'username', None))
+            mapped_id = resolve_event_account(event)
             user_id = mapped_id if mapped_id != original_sender_id else original_sender_id
         except:
             user_id = original_sender_id
 
         # 检查频率限制
-        limit_result = check_button_rate_limit(user_id)
+        limit_result = button_rate_limiter.check(user_id)
         if limit_result:
             limit_seconds, message = limit_result
-            print(f'[频率限制] 🚫 用户 {user_id} 被限制 {limit_seconds}秒: {message}')
-            print(f'[频率限制] 📊 当前点击历史: {button_click_history.get(user_id, [])}')
-            print(f'[频率限制] 🔒 当前惩罚状态: {user_restrictions.get(user_id, "无")}')
             await event.answer(message, alert=True)
-
-            # 清理过期记录（防止内存泄漏）
-            import time
-            current_time = time.time()
-            for uid in list(button_click_history.keys()):
-                button_click_history[uid] = [
-                    ts for ts in button_click_history[uid]
-                    if current_time - ts < 3600  # 1小时后清理
-                ]
-                if not button_click_history[uid]:
-                    del button_click_history[uid]
-
             return
 
-        # 正常执行
-        click_count = len(button_click_history.get(user_id, []))
-        print(f'[频率限制] ✅ 用户 {user_id} 点击正常，已记录 (当前{click_count}次)')
         return await func(event, *args, **kwargs)
 
     return wrapper
@@ -423,51 +363,24 @@ def rate_limit_callback(func):
 
 
 def get_main_account_id(telegram_id, username=None):
-    """获取主账号ID（精准ID匹配版）"""
+    """获取主账号ID（备用号 / 捡漏账号 -> 主账号，查内存映射）"""
     try:
-        target_id_str = str(telegram_id).strip()
-        clean_username = (username or '').strip().lstrip('@')
-        
-        conn = get_db_conn()
-        c = conn.cursor()
-        
-        # 核心查询：查找是否有人的 backup_account 字段等于当前访问者的 ID
-        query = "SELECT telegram_id FROM members WHERE backup_account = ?"
-        c.execute(query, (target_id_str,))
-        row = c.fetchone()
-        
-        # 如果ID没查到，再尝试查用户名
-        if not row and clean_username:
-            c.execute(
-                'SELECT telegram_id FROM members WHERE backup_account = ? OR backup_account = ?',
-                (clean_username, f"@{clean_username}")
-            )
-            row = c.fetchone()
-            
-        # 捡漏账号逻辑 - 优先查询 fallback_accounts
-        if not row:
-            c.execute(
-                'SELECT main_account_id FROM fallback_accounts '
-                'WHERE telegram_id = ? AND main_account_id IS NOT NULL LIMIT 1',
-                (telegram_id,)
-            )
-            fallback_result = c.fetchone()
-            if fallback_result and fallback_result[0]:
-                conn.close()
-                print(f"✅ [账号映射] {target_id_str} -> 主账号 {fallback_result[0]} (fallback_accounts)")
-                return fallback_result[0]
-        
-        conn.close()
-        
-        if row:
-            print(f"✅ [账号映射] {target_id_str} -> 主账号 {row[0]}")
-            return int(row[0])  # 确保返回整数
-        
-        return telegram_id
+        return account_map.resolve(telegram_id, username)
     except Exception as e:
         print(f"[关联查询出错] {e}")
         return telegram_id
 
+
+def resolve_event_account(event):
+    """解析事件发送者的主账号ID，同一事件只解析一次（结果缓存在事件对象上）"""
+    resolved_id = getattr(event, '_resolved_sender_id', None)
+    if resolved_id is None:
+        original_id = event.sender_id
+        resolved_id = get_main_account_id(original_id, getattr(event.sender, 'username', None))
+        event._original_sender_id = original_id
+        event._resolved_sender_id = resolved_id
+    return resolved_id
+
     
 def format_backup_account_display(backup_account, main_account_id=None):
     """格式化备用号显示"""
@@ -518,31 +431,20 @@ def format_backup_account_display(backup_account, main_account_id=None):
 
 def resolve_sender_id(event):
     """解析发送者ID，支持备用号映射"""
-    original_id = event.sender_id
-    main_id = get_main_account_id(
-        original_id, getattr(
-            event.sender, 'username', None))
-
-    # 如果映射成功，返回主号ID；否则返回原始ID
-    return main_id if main_id != original_id else original_id
+    return resolve_event_account(event)
 
 
 def get_resolved_sender_info(event):
     """获取解析后的发送者信息，返回 (original_id, resolved_id)"""
-    original_id = event.sender_id
-    resolved_id = resolve_sender_id(event)
-    return original_id, resolved_id
+    resolved_id = resolve_event_account(event)
+    return event._original_sender_id, resolved_id
 
 
 def with_account_resolution(func):
     """装饰器：自动处理账号解析"""
     async def wrapper(event, *args, **kwargs):
-        # 为事件对象添加解析后的ID属性
-        original_id, resolved_id = get_resolved_sender_info(event)
-        event._original_sender_id = original_id
-        event._resolved_sender_id = resolved_id
-        # 保持向后兼容
-        event.sender_id = resolved_id
+        # 为事件对象添加解析后的ID属性（_original_sender_id / _resolved_sender_id）
+        get_resolved_sender_info(event)
         return await func(event, *args, **kwargs)
     return wrapper
 
@@ -573,6 +475,7 @@ async def check_user_group_binding_status(user_id, clients):
                 (user_id,
                  ))
             conn.commit()
+            required_groups_cache.invalidate_upline(user_id)
             conn.close()
             return False
         elif admin_bot_id is None:
@@ -585,10 +488,12 @@ async def check_user_group_binding_status(user_id, clients):
                 'UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (user_id,))
             conn.commit()
             conn.close()
+            required_groups_cache.invalidate_upline(user_id)
             return True  # 绑定仍然有效，只是管理员权限失效
 
         # 绑定完全有效
         print(f'[群组检测] 用户 {user_id} 的群组绑定完全有效')
+        group_affinity.set_owner(admin_bot_id, group_link)
         return True
 
     except Exception as e:
@@ -693,6 +598,7 @@ async def notify_group_binding_invalid(
 
                         user_conn.commit()
                         user_conn.close()
+                        required_groups_cache.invalidate_upline(user_id)
                         break  # 成功后跳出重试循环
 
                     except Exception as db_err:
@@ -729,34 +635,13 @@ async def notify_group_binding_invalid(
 请重新设置群组绑定以继续获得分红收益。
                 '''.strip()
 
-                # 使用指定的机器人发送通知，如果没有指定则使用全局bot
-                notification_sent = False
-                if notify_bot:
-                    try:
-                        bot_info = await notify_bot.get_me()
-                        bot_name = bot_info.username or str(bot_info.id)
-                        await notify_bot.send_message(user_id, notification_msg)
-                        print(
-                            f'[通知] ✅ 使用指定机器人({bot_name}) 已通知用户 {user_id} ({username}) 群组绑定失效')
-                        notification_sent = True
-                    except Exception as e:
-                        print(f'[通知] ❌ 使用指定机器人向用户 {user_id} 发送通知失败: {e}')
-
-                if not notification_sent:
-                    # 回退到使用所有活跃的机器人发送通知
-                    for client in clients:
-                        try:
-                            await client.send_message(user_id, notification_msg)
-                            print(
-                                f'[通知] ✅ 使用机器人已通知用户 {user_id} ({username}) 群组绑定失效')
-                            notification_sent = True
-                            break
-                        except Exception as e:
-                            print(f'[通知] ❌ 使用机器人向用户 {user_id} 发送通知失败: {e}')
-                            continue
-
-                if not notification_sent:
-                    print(f'[通知] ❌ 所有机器人向用户 {user_id} ({username}) 发送通知都失败了')
+                # 优先使用指定的机器人发送通知，失败时由发送调度换其他机器人
+                try:
+                    await send_dispatcher.send_message(user_id, notification_msg, prefer=notify_bot)
+                    print(
+                        f'[通知] ✅ 已通知用户 {user_id} ({username}) 群组绑定失效')
+                except Exception as e:
+                    print(f'[通知] ❌ 所有机器人向用户 {user_id} ({username}) 发送通知都失败了: {e}')
 
             except Exception as user_err:
                 print(f'[通知] 处理用户 {user_id} 失败: {user_err}')
@@ -816,6 +701,7 @@ def link_account(main_id, backup_id, backup_username):
                     ''', (backup_id, main_id, clean_username or None))
                     conn.commit()
                     conn.close()
+                    account_map.set_fallback(backup_id, main_id)
                     return True, f"⚠️绑定成功/完成\n绑定值: {value_to_store}\n\n备用号已注册，将使用备用关联模式。\n\n请使用备用号访问个人中心测试。"
                 except Exception as e:
                     try:
@@ -851,6 +737,7 @@ def link_account(main_id, backup_id, backup_username):
              main_id))
         conn.commit()
         conn.close()
+        account_map.set_backup(main_id, value_to_store)
         return True, f"⚠️绑定成功/完成\n绑定值: {value_to_store}\n\n请使用备用号发送 /start 测试。"
         
     except Exception as e:
@@ -868,26 +755,31 @@ def get_fallback_resource(resource_type='group'):
         c = conn.cursor()
         if resource_type == 'group':
             # 返回包含群组名称和链接的列表
-            c.execute("SELECT username, group_link FROM fallback_accounts WHERE is_active = 1 AND group_link IS NOT NULL AND group_link != '' ORDER BY id ASC")
+            c.execute("SELECT username, group_link, group_titles FROM fallback_accounts WHERE is_active = 1 AND group_link IS NOT NULL AND group_link != '' ORDER BY id ASC")
             results = c.fetchall()
             conn.close()
             if results:
+                import json
                 groups = []
                 seen = set()
-                for username, group_link in results:
+                for username, group_link, group_titles in results:
                     if not group_link:
                         continue
+                    try:
+                        titles = json.loads(group_titles) if group_titles else {}
+                    except Exception:
+                        titles = {}
                     g_links = group_link.split('\n')
                     for link in g_links:
                         link = link.strip()
                         if link and link not in seen:
-                            # 默认使用用户名，如果没有则使用链接最后一部分
+                            # 优先使用后台缓存的群名，没有则使用用户名或链接最后一部分
                             default_name = username or link.split(
                                 '/')[-1].replace('+', '')
                             groups.append({
                                 'username': username or '',
                                 'link': link,
-                                'name': default_name  # 默认名称，后续可以通过Telegram API获取实际名称
+                                'name': titles.get(link) or default_name
                             })
                             seen.add(link)
                 return groups if groups else None
@@ -1002,7 +894,7 @@ async def process_vip_upgrade(
     # 4. 【核心】调用统一分红函数（替代所有手写循环）
     # 使用主bot发送分红通知
     if bot:
-        stats = await distribute_vip_rewards(bot, telegram_id, vip_price, config)
+        stats = await distribute_vip_rewards(interactive_sender, telegram_id, vip_price, config)
     else:
         stats = {'real': 0, 'total': 0}  # 如果bot未启动，返回空统计
     
@@ -1027,6 +919,7 @@ async def verify_and_handle_upline_group(bot, upline_id, group_link, clients):
         is_in_group, admin_bot_id = await check_any_bot_in_group(clients, group_link)
 
         if is_in_group and admin_bot_id:
+            group_affinity.set_owner(admin_bot_id, group_link)
             return True  # 有效：在群且是管理
 
         # --- 处理失效逻辑 ---
@@ -1040,12 +933,13 @@ async def verify_and_handle_upline_group(bot, upline_id, group_link, clients):
             'UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (upline_id,))
         conn.commit()
         conn.close()
+        required_groups_cache.invalidate_upline(upline_id)
 
         # 2. 通知上级用户 (异步发送，不阻塞当前流程)
         try:
             fail_reason = "机器人不是管理员" if is_in_group else "机器人不在群组内"
             msg = f"⚠️ **群组权限异常通知**\n\n检测到您的群组状态异常：{fail_reason}\n\n这导致您的下级无法加入您的群组，您将**失去分红收益**！\n\n请尽快将机器人重新设为管理员。"
-            await bot.send_message(upline_id, msg)
+            await send_dispatcher.send_message(upline_id, msg)
         except BaseException:
             pass  # 可能被拉黑，忽略
 
@@ -1055,16 +949,83 @@ async def verify_and_handle_upline_group(bot, upline_id, group_link, clients):
         print(f"[懒加载检测] 检查失败: {e}")
         return False  # 保守起见，出错视为无效，转为捡漏
 
+
+async def get_required_groups(telegram_id, level_count):
+    """
+    获取用户需要加入的群组列表（按显示顺序，长度为 level_count）
+    上N级完成任务且群有效 -> 替换显示列表从后向前第N项，其余位置用捡漏群补全。
+    结果缓存在 required_groups_cache，只在上级状态 / 捡漏配置变化时重建。
+    捡漏群未配置时返回 None。
+    """
+    slots = required_groups_cache.get(telegram_id, level_count)
+    if slots is not None:
+        return slots
+
+    chain = get_upline_chain(telegram_id, level_count)
+    fb_groups = get_fallback_resource('group')
+    if not fb_groups:
+        return None
+
+    upline_ids = [item['id'] for item in chain if not item.get('is_fallback')]
+    upline_titles = get_member_group_titles(upline_ids)
+    slots = [None] * level_count  # 0-based positions
+
+    # 先把上级群放到对应显示位置（上1级 -> 最后一个位置，含实时群权检测）
+    for item in chain:
+        if item.get('is_fallback'):
+            continue
+        level = item['level']
+        upline_id = item['id']
+        pos = level_count - level
+        if pos < 0 or pos >= level_count:
+            continue
+        try:
+            up_member = DB.get_member(upline_id)
+            if not up_member or not up_member.get('group_link'):
+                continue
+            conds = await check_user_conditions(bot, upline_id)
+            if not conds or not conds['all_conditions_met']:
+                continue
+            group_link = next(
+                (l.strip() for l in up_member['group_link'].split('\n') if l.strip()), '')
+            # 只有 DB 显示条件满足时才检测真实权限，检测不通过该位置留给捡漏群
+            if group_link and await verify_and_handle_upline_group(bot, upline_id, group_link, clients):
+                slots[pos] = {
+                    'display_index': pos + 1,
+                    'level': level,
+                    'link': group_link,
+                    'name': upline_titles.get(upline_id) or f"第{level}层上级",
+                    'type': 'upline',
+                    'upline_id': upline_id
+                }
+        except Exception as e:
+            print(f"[群裂变列表] 检查第{level}层上级条件失败: {e}")
+
+    # 用捡漏群补全剩余位置
+    for display_idx in range(level_count):
+        if slots[display_idx] is None:
+            level_for_slot = level_count - display_idx
+            fb_group = fb_groups[(level_for_slot - 1) % len(fb_groups)]
+            slots[display_idx] = {
+                'display_index': display_idx + 1,
+                'level': level_for_slot,
+                'link': (fb_group.get('link') or '').strip(),
+                'name': fb_group.get('name') or fb_group.get(
+                    'username') or f'推荐群组 {level_for_slot}',
+                'type': 'fallback',
+                'username': fb_group.get('username', '')
+            }
+
+    required_groups_cache.set(telegram_id, level_count, slots, upline_ids)
+    return slots
+
 # ==================== 事件处理器 ====================
 
 
-@multi_bot_on(events.NewMessage(pattern='/check_permission'))
+@update_router.command('/check_permission')
 async def check_permission_handler(event):
     """手动检查权限状态的命令"""
-    original_id = event.sender_id
-    sender_id = get_main_account_id(
-        original_id, getattr(
-            event.sender, 'username', None))
+    sender_id = resolve_event_account(event)
 
     member = DB.get_member(sender_id)
     if not member or not member.get('is_vip'):
@@ -1080,7 +1041,7 @@ async def check_permission_handler(event):
     await event.respond("✅ 已触发权限检查，请等待系统自动检测并通知")
 
 
-@multi_bot_on(events.NewMessage(pattern='/bind'))
+@update_router.command('/bind')
 async def bind_command_handler(event):
     """群内绑定命令：在群组中发送 /bind 绑定当前群"""
     if event.is_private:
@@ -1101,10 +1062,7 @@ async def bind_command_handler(event):
         group_link = f"https://t.me/{chat_username}" if chat_username else ""
 
         # 2. 解析发送者（支持备用号）
-        original_id = event.sender_id
-        sender_id = get_main_account_id(
-            original_id, getattr(
-                event.sender, 'username', None))
+        sender_id = resolve_event_account(event)
 
         # 3. 检查用户是否注册
         member = DB.get_member(sender_id)
@@ -1150,6 +1108,7 @@ async def bind_command_handler(event):
         ''', (final_link, is_bot_admin, sender_id))
         conn.commit()
         conn.close()
+        required_groups_cache.invalidate_upline(sender_id)
 
         # 更新 member_groups 表 (upsert)
         from .database import upsert_member_group
@@ -1159,6 +1118,7 @@ async def bind_command_handler(event):
             member['username'],
             is_bot_admin,
             group_id=chat_id)
+        group_peers.remember(bot_registry.get_id(event.client), chat, group_link or None)
 
         await event.respond(
             f"💡提示绑定成功/完成\n"
@@ -1175,12 +1135,11 @@ async def bind_command_handler(event):
         await event.respond("❌ 绑定失败，请稍后重试")
 
 
-@multi_bot_on(events.NewMessage(pattern='/start'))
+@update_router.command('/start')
 async def start_handler(event):
     """启动命令"""
     original_id = event.sender_id
-    original_username = getattr(event.sender, 'username', None)
-    telegram_id = get_main_account_id(original_id, original_username)
+    telegram_id = resolve_event_account(event)
     
     username = event.sender.username or f'user_{original_id}'
     
@@ -1240,10 +1199,11 @@ async def start_handler(event):
             if referrer:
                 try:
                     user_full_name = event.sender.first_name or f'user_{telegram_id}'
-                    await bot.send_message(
+                    await interactive_sender.send_message(
                         referrer_id,
                         f'🎉 新成员加入!\n用户: [{user_full_name}](tg://user?id={telegram_id})\n通过您的推广链接加入了机器人\n\n快去引导开通VIP完成任务，快速发展团队。',
-                        parse_mode='markdown'
+                        parse_mode='markdown',
+                        prefer=event.client
                     )
                 except BaseException:
                     pass
@@ -1265,8 +1225,8 @@ async def start_handler(event):
     await event.respond(welcome_text, buttons=get_main_keyboard(telegram_id))
 
 
+@update_router.callback(b'open_vip_balance')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(data=b'open_vip_balance'))
 async def open_vip_balance_callback(event):
     """【已修复】使用余额开通VIP - 统一调用 distribute_vip_rewards"""
     original_sender_id, resolved_id = get_resolved_sender_info(event)
@@ -1320,8 +1280,8 @@ async def open_vip_balance_callback(event):
         pass
 
 
+@update_router.callback(b'confirm_vip')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'confirm_vip'))
 async def confirm_vip_callback(event):
     """【已修复】确认开通VIP - 统一调用 distribute_vip_rewards"""
     config = get_system_config()
@@ -1375,7 +1335,7 @@ async def send_recharge_notification(telegram_id, amount):
 
 您的余额已自动增加，可以在个人中心查看。"""
         
-        await bot.send_message(telegram_id, message)
+        await send_dispatcher.send_message(telegram_id, message)
         print(f'[充值通知] 已发送通知给用户 {telegram_id}')
     except Exception as e:
         print(f'[充值通知] 发送失败: {e}')
@@ -1404,14 +1364,14 @@ async def process_recharge(telegram_id, amount, is_vip_order=False):
                 vip_time=get_cn_time())
             update_level_path(telegram_id)
             if bot:
-                await distribute_vip_rewards(bot, telegram_id, vip_price, config)
+                await distribute_vip_rewards(send_dispatcher, telegram_id, vip_price, config)
 
             from .core_functions import generate_vip_success_message
             msg = generate_vip_success_message(
                 telegram_id, amount, vip_price, new_balance)
             if bot:
                 try:
-                    await bot.send_message(telegram_id, msg, parse_mode=None)
+                    await send_dispatcher.send_message(telegram_id, msg, parse_mode=None)
                     print(f"[充值处理] ✅ VIP开通通知已发送给 {telegram_id}")
                 except Exception as e:
                     print(f"[充值处理] ❌ 发送VIP通知失败: {e}")
@@ -1419,7 +1379,7 @@ async def process_recharge(telegram_id, amount, is_vip_order=False):
             if bot:
                 try:
                     msg = f'✅ 充值到账通知\n\n💰 金额: {amount} U\n💵 当前余额: {current_balance} U'
-                    await bot.send_message(telegram_id, msg, parse_mode=None)
+                    await send_dispatcher.send_message(telegram_id, msg, parse_mode=None)
                     print(f"[充值处理] ✅ 普通充值通知已发送给 {telegram_id}")
                 except Exception as e:
                     print(f"[充值处理] ❌ 发送普通充值通知失败: {e}")
@@ -1453,7 +1413,7 @@ async def admin_manual_vip_handler(telegram_id, config):
     
     # 通知用户
     try:
-        await bot.send_message(
+        await send_dispatcher.send_message(
             telegram_id,
             f'🎉 恭喜! 管理员已为您开通VIP!\n\n'
             f'您现在可以:\n'
@@ -1474,12 +1434,10 @@ async def admin_manual_vip_handler(telegram_id, config):
 # ==================== 群裂变加入（修复版）====================
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_FISSION))
+@update_router.text(BTN_FISSION)
 async def fission_handler(event):
     """群裂变加入（修复版 - 使用 get_upline_chain）"""
-    telegram_id = get_main_account_id(
-        event.sender_id, getattr(
-            event.sender, 'username', None))
+    telegram_id = resolve_event_account(event)
     member = DB.get_member(telegram_id)
     
     if not member:
@@ -1519,155 +1477,13 @@ async def fission_handler(event):
     
     # 获取系统配置
     level_count = min(config.get('level_count', 10), 10)
-    
-    # 使用 get_upline_chain 获取完整的10层关系
-    chain = get_upline_chain(telegram_id, level_count)
-    
-    # 获取所有捡漏群组
-    fb_groups = get_fallback_resource('group')
-    # Debug: 打印捡漏群组原始返回，便于诊断为何为空或不包含链接
-    print(
-        f"[fission debug] get_fallback_resource('group') returned: {fb_groups}")
-    try:
-        conn_dbg = get_db_conn()
-        c_dbg = conn_dbg.cursor()
-        c_dbg.execute(
-            "SELECT id, telegram_id, username, group_link, is_active FROM fallback_accounts ORDER BY id ASC")
-        fb_rows = c_dbg.fetchall()
-        print(f"[fission debug] fallback_accounts count: {len(fb_rows)}")
-        for r in fb_rows:
-            print(
-                f"[fission debug] fallback_accounts row: id={r[0]}, telegram_id={r[1]}, username={r[2]}, is_active={r[4]}, group_link={r[3]}")
-        conn_dbg.close()
-    except Exception as dbg_e:
-        print(f"[fission debug] error reading fallback_accounts: {dbg_e}")
 
-    if not fb_groups:
+    # 需要加入的群组列表（按显示顺序，带缓存）
+    groups_to_show = await get_required_groups(telegram_id, level_count)
+    if groups_to_show is None:
         await event.respond("❌ 系统错误：捡漏群组未配置，请联系管理员")
         return
     
-    # 构建层级映射：level -> 上级信息（如果存在且完成任务）
-    upline_map = {}
-    for item in chain:
-        if item.get('is_fallback'):
-            continue
-        level = item['level']
-        upline_id = item['id']
-        up_member = DB.get_member(upline_id)
-        if up_member and up_member.get('group_link'):
-            # 检查上级是否完成任务
-            try:
-                conds = await check_user_conditions(bot, upline_id)
-                if conds and conds['all_conditions_met']:
-                    group_links = up_member['group_link'].split('\n')
-                    for link in group_links:
-                        if link.strip():
-                            upline_map[level] = {
-                                'link': link.strip(),
-                                'upline_id': upline_id
-                            }
-                            break
-            except Exception as e:
-                print(f"[群裂变列表] 检查第{level}层上级条件失败: {e}")
-    
-    # 构建最终显示的群组列表（按显示顺序填充：第1..第N）
-    # 规则调整：如果上级存在并完成任务，应该替换显示列表的从后向前位置：
-    #   上1级 (level=1) -> 替换显示第 N 项（最后一项）
-    #   上2级 (level=2) -> 替换显示第 N-1 项，依此类推
-    groups_to_show = [None] * level_count  # 0-based positions
-
-    # 先把上级群放到对应显示位置（增加实时群权检测）
-    for item in chain:
-        if item.get('is_fallback'):
-            continue
-
-        level = item['level']
-        upline_id = item['id']
-        up_member = DB.get_member(upline_id)
-
-        # 只有当上级设置了群链接，才进行深入检测
-        if up_member and up_member.get('group_link'):
-            try:
-                # 1. 基础条件检查 (DB层面)
-                conds = await check_user_conditions(bot, upline_id)
-
-                # 2. 实时权限检查 (API层面 - 核心修改)
-                # 只有当 DB 显示条件满足时，才去 verify 真实权限，节省资源
-                is_valid = False
-                if conds and conds['all_conditions_met']:
-                    group_link = up_member['group_link'].split('\n')[0].strip()
-                    # 【核心】调用懒加载检测
-                    is_valid = await verify_and_handle_upline_group(bot, upline_id, group_link, clients)
-
-                if is_valid:
-                    pos = level_count - level  # 0-based index
-                    if pos < 0 or pos >= level_count:
-                        continue
-
-                    group_name = f"第{level}层上级"
-                    # 尝试获取群名 (代码保持不变...)
-                    try:
-                        if 't.me/' in group_link:
-                            group_username = group_link.split(
-                                't.me/')[-1].split('/')[0].split('?')[0]
-                        elif group_link.startswith('@'):
-                            group_username = group_link[1:]
-                        else:
-                            group_username = group_link
-
-                        if not group_username.startswith('+'):
-                            try:
-                                group_entity = await bot.get_entity(group_username)
-                                title = getattr(group_entity, 'title', None)
-                                if title:
-                                    group_name = title
-                            except Exception:
-                                # 获取实体或标题失败，使用默认 group_name
-                                pass
-                    except Exception:
-                        # group_link 解析异常，继续使用默认 group_name
-                        pass
-
-                    # 填充显示数组
-                    groups_to_show[pos] = {
-                        'level': level,
-                        'link': group_link,
-                        'name': group_name,
-                        'type': 'upline'
-                    }
-                else:
-                    # 检测不通过，该位置留空，后续会自动填充捡漏
-                    pass
-
-            except Exception as e:
-                print(f"[群裂变列表] 检查第{level}层上级条件失败: {e}")
-
-    # 用捡漏群补全剩余位置（按从前到后映射级别）
-    for display_idx in range(level_count):
-        if groups_to_show[display_idx] is None:
-            # 要计算该显示位对应的层级（反向）： display_idx = level_count - level
-            level_for_slot = level_count - display_idx
-            fb_index = (level_for_slot - 1) % len(fb_groups)
-            fb_group = fb_groups[fb_index]
-            group_link = (fb_group.get('link') or '').strip()
-            group_name = fb_group.get('name') or fb_group.get(
-                'username') or f'推荐群组 {level_for_slot}'
-            try:
-                if group_link:
-                    actual_title = await get_group_title(bot, group_link)
-                    if actual_title:
-                        group_name = actual_title
-            except BaseException:
-                pass
-            # Always fill the slot; if link missing, leave empty string and
-            # display as plain text
-            groups_to_show[display_idx] = {
-                'level': level_for_slot,
-                'link': group_link,
-                'name': group_name,
-                'type': 'fallback'
-            }
-    
     # 统一显示在"推荐加入的群组"中
     if groups_to_show:
         text += "🔥 **推荐加入的群组：**\n"
@@ -1694,7 +1510,7 @@ async def fission_handler(event):
 # ==================== 注册其他命令处理器 ====================
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_PROFILE))
+@update_router.text(BTN_PROFILE)
 async def profile_handler(event):
     """个人中心 (修复版)"""
     original_id = event.sender_id
@@ -1763,15 +1579,12 @@ async def profile_handler(event):
 # ==================== 个人中心按钮回调处理 ====================
 
 
+@update_router.callback(b'set_group')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'set_group'))
 async def set_group_callback(event):
     """设置群链接回调"""
     # 账号关联处理（备用号->主账号）
-    original_sender_id = event.sender_id
-    main_id = get_main_account_id(
-        original_sender_id, getattr(
-            event.sender, 'username', None))
+    main_id = resolve_event_account(event)
 
     member = DB.get_member(main_id)
     if not member:
@@ -1786,9 +1599,8 @@ async def set_group_callback(event):
         await send_vip_required_prompt(event)
         return
     
-    # 切换到群链接输入时，清理备用号等待状态
-    waiting_for_backup.pop(resolved_id, None)
-    waiting_for_group_link[resolved_id] = True
+    # 切换到群链接输入（覆盖备用号等其他等待状态）
+    conversation_store.set(resolved_id, STATE_GROUP_LINK)
     await event.respond(
         '🔗 **设置群链接**\n\n'
         '**方法 A (推荐)：**\n'
@@ -1804,8 +1616,8 @@ async def set_group_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'set_backup')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'set_backup'))
 async def set_backup_callback(event):
     """设置备用号回调"""
     # 账号关联处理（备用号->主账号）
@@ -1821,9 +1633,8 @@ async def set_backup_callback(event):
         await send_vip_required_prompt(event)
         return
     
-    # 切换到备用号输入时，清理群链接等待状态
-    waiting_for_group_link.pop(resolved_id, None)
-    waiting_for_backup[resolved_id] = True
+    # 切换到备用号输入（覆盖群链接等其他等待状态）
+    conversation_store.set(resolved_id, STATE_BACKUP)
     await event.respond(
         '💡 防止这个账户被TG官方封锁，资金无法使用。你可以在这里添加备用账户。可同时登录这个账户\n\n'
         '请发送直接您没注册过飞机号 (带@的用户名或ID)如: @qxzy7\n\n'
@@ -1832,8 +1643,8 @@ async def set_backup_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'earnings_history')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'earnings_history'))
 async def earnings_history_callback(event):
     """查看个人收益记录"""
     # 账号关联处理（备用号->主账号）
@@ -1901,17 +1712,15 @@ async def earnings_history_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'withdraw')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'withdraw'))
 async def withdraw_callback(event):
     """提现回调"""
     config = get_system_config()
 
     # 备用号映射：始终使用主账号ID
     try:
-        mapped_id = get_main_account_id(
-            event.sender_id, getattr(
-                event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         effective_user_id = mapped_id if mapped_id != event.sender_id else event.sender_id
     except BaseException:
         effective_user_id = event.sender_id
@@ -1930,7 +1739,7 @@ async def withdraw_callback(event):
             f'还需: {config["withdraw_threshold"] - member["balance"]} U'
         )
     else:
-        waiting_for_withdraw_amount[event.sender_id] = True
+        conversation_store.set(event.sender_id, STATE_WITHDRAW_AMOUNT)
         await event.respond(
             f'💳 提现申请\n\n'
             f'当前余额: {member["balance"]} U\n'
@@ -1940,26 +1749,19 @@ async def withdraw_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'do_recharge')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'do_recharge'))
 async def do_recharge_callback(event):
     """充值回调"""
     # 账号关联处理（备用号->主账号）
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
-    telegram_id = event.sender_id
+    telegram_id = resolve_event_account(event)
     member = DB.get_member(telegram_id)
     
     if not member:
         await event.answer("❌ 用户信息不存在", alert=True)
         return
     
-    waiting_for_recharge_amount[telegram_id] = True
+    conversation_store.set(telegram_id, STATE_RECHARGE_AMOUNT)
     
     text = """💰 充值余额
 
@@ -1979,16 +1781,14 @@ async def do_recharge_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'open_vip')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'open_vip'))
 async def open_vip_callback(event):
     """开通VIP"""
     # 账号关联处理（备用号->主账号）
     original_sender_id = event.sender_id
     try:
-        mapped_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         # 强制使用映射后的主账号ID
         telegram_id = mapped_id if mapped_id != original_sender_id else original_sender_id
     except BaseException:
@@ -2060,19 +1860,13 @@ VIP价格: {vip_price} U
 # 返回个人中心
 
 
+@update_router.callback(b'back_to_profile')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'back_to_profile'))
 async def back_to_profile_callback(event):
     """返回个人中心"""
     # 账号关联处理（备用号->主账号）
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
-    member = DB.get_member(event.sender_id)
+    telegram_id = resolve_event_account(event)
+    member = DB.get_member(telegram_id)
     if not member:
         await event.answer("❌ 用户信息不存在", alert=True)
         return
@@ -2112,19 +1906,12 @@ async def back_to_profile_callback(event):
     await event.answer()
 
 
+@update_router.callback(b'recharge_for_vip')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(data=b'recharge_for_vip'))
 async def recharge_for_vip_callback(event):
     """充值开通VIP - 调用充值输入金额功能"""
     # 账号关联处理（备用号->主账号）
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
-    telegram_id = event.sender_id
+    telegram_id = resolve_event_account(event)
     member = DB.get_member(telegram_id)
     
     if not member:
@@ -2144,7 +1931,7 @@ async def recharge_for_vip_callback(event):
     # 调用充值订单创建函数（传入bot参数）
     try:
         from .payment import create_recharge_order
-        await create_recharge_order(bot, event, need_recharge, is_vip_order=True)
+        await create_recharge_order(send_dispatcher, event, need_recharge, is_vip_order=True)
     except Exception as e:
         print(f"[充值VIP订单创建失败] {e}")
         import traceback
@@ -2153,20 +1940,13 @@ async def recharge_for_vip_callback(event):
     await event.answer()
 
 
+@update_router.callback_prefix(b'verify_groups_')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'verify_groups_.*'))
 async def verify_groups_callback(event):
     """验证用户是否加入所有需要加入的群组（上级群 + 捡漏群组，共10个）"""
     # 账号关联处理（备用号->主账号）
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
+    telegram_id = resolve_event_account(event)
     
-    telegram_id = event.sender_id
     member = DB.get_member(telegram_id)
     
     if not member:
@@ -2187,94 +1967,15 @@ async def verify_groups_callback(event):
     # 【核心修复】加群任务 = 必须加入1-10层的群组（每层：有上级且完成任务用上级群，否则用捡漏群）
     config = get_system_config()
     required_groups_count = min(config.get('level_count', 10), 10)
-    
-    groups_to_check = []
-    
-    # 获取完整的10层关系
-    from core_functions import get_upline_chain
-    chain = get_upline_chain(telegram_id, required_groups_count)
-    
-    # 获取所有捡漏群组
-    fb_groups = get_fallback_resource('group')
-    if not fb_groups:
+
+    # 与群裂变列表共用同一份缓存的群组列表
+    required_groups = await get_required_groups(telegram_id, required_groups_count)
+    if required_groups is None:
         await event.respond("❌ 系统错误：捡漏群组未配置，请联系管理员")
         return
-    
-    # 构建层级映射：level -> 上级信息（如果存在且完成任务）
-    upline_map = {}
-    for item in chain:
-        if item.get('is_fallback'):
-            continue
-        level = item['level']
-        upline_id = item['id']
-        up_member = DB.get_member(upline_id)
-        if up_member and up_member.get('group_link'):
-            # 检查上级是否完成任务
-            try:
-                conds = await check_user_conditions(bot, upline_id)
-                if conds and conds['all_conditions_met']:
-                    group_links = up_member.get('group_link', '').split('\n')
-                    for link in group_links:
-                        link = link.strip()
-                        if link:
-                            upline_map[level] = {
-                                'link': link,
-                                'upline_id': upline_id
-                            }
-                            break
-            except Exception as e:
-                print(f"[验证加群] 检查第{level}层上级条件失败: {e}")
-    
-    # 构建需要检查的群组列表（按显示顺序，采用与 fission_handler 相同的从后向前替换策略）
-    groups_to_check = [None] * required_groups_count
-
-    # 先把真实上级放到对应显示位置（上1级 -> 最后一个位置，含实时检测）
-    for level, info in upline_map.items():
-        try:
-            pos = required_groups_count - level
-            if pos < 0 or pos >= required_groups_count:
-                continue
-
-            # 【核心】实时检测上级群有效性
-            upline_id = info.get('upline_id')
-            group_link = info['link']
-            is_valid = False
-
-            if upline_id:
-                # 调用懒加载检测
-                is_valid = await verify_and_handle_upline_group(bot, upline_id, group_link, clients)
-
-            if is_valid:
-                groups_to_check[pos] = {
-                    'display_index': pos + 1,
-                    'link': group_link,
-                    'level': level,
-                    'type': 'upline',
-                    'group_name': f"第{level}层上级",
-                    'upline_id': upline_id
-                }
-            # 如果检测不通过，该位置留空，后续用捡漏补全
-
-        except Exception as e:
-            print(f"[验证加群] 构建上级映射失败: {e}")
-
-    # 补全空位为捡漏群组
-    for display_pos in range(required_groups_count):
-        if groups_to_check[display_pos] is None:
-            # 对应的层级（反向映射）
-            level_for_slot = required_groups_count - display_pos
-            fb_index = (level_for_slot - 1) % len(fb_groups)
-            fb_group = fb_groups[fb_index]
-            group_link = fb_group.get('link', '').strip()
-            if group_link:
-                groups_to_check[display_pos] = {
-                    'display_index': display_pos + 1,
-                    'link': group_link,
-                    'level': level_for_slot,
-                    'type': 'fallback',
-                    'username': fb_group.get('username', ''),
-                    'group_name': fb_group.get('name', '')
-                }
+    groups_to_check = [
+        dict(g, group_name=g.get('name', '')) for g in required_groups
+        if g and g.get('link')]
     
     # 过滤空
     groups_to_check = [g for g in groups_to_check if g is not None]
@@ -2293,58 +1994,21 @@ async def verify_groups_callback(event):
 
     not_joined = []
     joined = []
-    
+    unknown = []
+
+    # 并发检测所有群组（分摊到各机器人，单群超时不影响其他群的结果）
+    check_results = await check_user_in_groups(
+        clients, telegram_id, [g['link'] for g in dedup_groups])
     for group_info in dedup_groups:
-        group_link = group_info['link']
-        print(
-            f"[verify_groups] 检查群: display_index={group_info.get('display_index')} level={group_info.get('level')} link={group_link}")
-        try:
-            # 提取群组用户名或ID
-            if 't.me/' in group_link:
-                group_username = group_link.split(
-                    't.me/')[-1].split('/')[0].split('?')[0].replace('+', '')
-            elif group_link.startswith('@'):
-                group_username = group_link[1:]
-            else:
-                group_username = group_link
-                
-            # 跳过私有群链接（无法通过用户名检查成员）
-            if group_username.startswith('+'):
-                not_joined.append(group_info)
-                continue
-            
-            # 尝试获取群组实体
-            try:
-                group_entity = await bot.get_entity(group_username)
-                
-                # 记录更友好的群名称，方便后面展示（优先使用实际群组名称）
-                try:
-                    title = getattr(group_entity, 'title', None)
-                    if title:
-                        group_info['group_name'] = title
-                except Exception:
-                    pass
-                
-                # 检查用户是否在群组中
-                try:
-                    from telethon.tl.functions.channels import GetParticipantRequest
-                    participant = await bot(GetParticipantRequest(
-                        channel=group_entity,
-                        participant=telegram_id
-                    ))
-                    joined.append(group_info)
-                    print(f"[verify_groups] 已检测到用户加入: {group_username}")
-                except Exception as part_err:
-                    not_joined.append(group_info)
-                    print(
-                        f"[verify_groups] 用户未加入: {group_username} ({part_err})")
-            except Exception as e:
-                # 无法获取群组信息，可能是私有群或链接无效
-                not_joined.append(group_info)
-                print(f"[verify_groups] 获取群信息失败: {group_link} ({e})")
-        except Exception as e:
+        result = check_results.get(group_info['link'])
+        if result is True:
+            joined.append(group_info)
+        else:
             not_joined.append(group_info)
-            print(f"[verify_groups] 内部异常: {e}")
+            if result is None:
+                unknown.append(group_info)
+    print(
+        f"[verify_groups] 检测完成: 已加入 {len(joined)}, 未加入 {len(not_joined) - len(unknown)}, 无法检测 {len(unknown)}")
     
     # 构建结果消息
     total_groups = len(dedup_groups)
@@ -2404,15 +2068,18 @@ async def verify_groups_callback(event):
                     't.me/')[-1].split('/')[0] if 't.me/' in g['link'] else g['link'])
                 idx = g.get('display_index', g.get('level', '?'))
                 link = g['link']
+                mark = '⏳' if g in unknown else '❌'
                 # 确保链接格式正确，避免Markdown解析错误
                 if link and (link.startswith(
                         'http://') or link.startswith('https://') or link.startswith('@')):
                     # 对链接中的特殊字符进行转义
                     safe_link = link.replace('(', '\\(').replace(')', '\\)')
-                    text += f"  ❌ {idx}. [{group_name}]({safe_link})\n"
+                    text += f"  {mark} {idx}. [{group_name}]({safe_link})\n"
                 else:
                     # 如果链接格式不正确，只显示名称不加链接
-                    text += f"  ❌ {idx}. {group_name}\n"
+                    text += f"  {mark} {idx}. {group_name}\n"
+            if unknown:
+                text += "\n⏳ 标记的群组暂时无法检测，请稍后再次点击验证"
             text += "\n⚠️ **重要提示**：请加入以上未加入的群组，才能获得分红！"
     
     try:
@@ -2444,26 +2111,26 @@ async def verify_groups_callback(event):
                 await event.answer("验证完成，但显示结果时出现错误", alert=True)
 
 
-@multi_bot_on(events.NewMessage(pattern='/bind_group'))
+@update_router.command('/bind_group')
 async def bind_group_cmd(event):
     """绑定群组命令 (修复：传入 event.client)"""
     # 传递 event.client 作为 bot 参数，确保使用正确的机器人实例检测权限
     await handle_bind_group(event, event.client, DB)
 
 
-@multi_bot_on(events.NewMessage(pattern='/join_upline'))
+@update_router.command('/join_upline')
 async def join_upline_cmd(event):
     """加入上层群命令"""
     await handle_join_upline(event, event.client, DB, get_system_config)
 
 
-@multi_bot_on(events.NewMessage(pattern='/check_status'))
+@update_router.command('/check_status')
 async def check_status_cmd(event):
     """检查状态命令"""
     await handle_check_status(event, event.client, DB)
 
 
-@multi_bot_on(events.NewMessage(pattern='/my_team'))
+@update_router.command('/my_team')
 async def my_team_cmd(event):
     """我的团队命令"""
     await handle_my_team(event, event.client, DB)
@@ -2471,7 +2138,7 @@ async def my_team_cmd(event):
 # ==================== 其他事件处理器 ====================
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_VIEW_FISSION))
+@update_router.text(BTN_VIEW_FISSION)
 async def view_fission_handler(event):
     """查看裂变数据"""
     original_sender_id = event.sender_id
@@ -2479,9 +2146,7 @@ async def view_fission_handler(event):
 
     # 备用号映射：始终使用主账号ID
     try:
-        mapped_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         print(f"[DEBUG] view_fission_handler: mapped_id = {mapped_id}")
         # 强制使用映射后的主账号ID
         effective_user_id = mapped_id if mapped_id != original_sender_id else original_sender_id
@@ -2569,8 +2234,8 @@ async def view_fission_handler(event):
     await event.respond(text, buttons=buttons)
 
 
+@update_router.callback_prefix(b'flv_')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'flv_(\d+)_(\d+)'))
 async def flv_level_callback(event):
     """查看指定层的下级成员列表：flv_{level}_{page}"""
     try:
@@ -2584,9 +2249,7 @@ async def flv_level_callback(event):
         if page < 1:
             page = 1
 
-        telegram_id = get_main_account_id(
-            event.sender_id, getattr(
-                event.sender, 'username', None))
+        telegram_id = resolve_event_account(event)
         conn = get_db_conn()
         c = conn.cursor()
 
@@ -2660,15 +2323,13 @@ async def flv_level_callback(event):
         await event.answer('加载失败', alert=True)
 
 
+@update_router.callback(b'fission_main_menu')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'fission_main_menu'))
 async def fission_main_menu_callback(event):
     """返回主菜单"""
     try:
         # 获取用户信息
-        telegram_id = get_main_account_id(
-            event.sender_id, getattr(
-                event.sender, 'username', None))
+        telegram_id = resolve_event_account(event)
         member = DB.get_member(telegram_id)
 
         if not member:
@@ -2698,8 +2359,8 @@ async def fission_main_menu_callback(event):
         await event.answer('返回失败', alert=True)
 
 
+@update_router.callback(b'back_handler')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=b'back_handler'))
 async def back_handler_callback(event):
     """Callback 版本的返回主菜单"""
     await event.delete()
@@ -2707,19 +2368,13 @@ async def back_handler_callback(event):
     await start_handler(event)
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_PROMOTE))
+@update_router.text(BTN_PROMOTE)
 async def promote_handler(event):
     """赚钱推广"""
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
+    telegram_id = resolve_event_account(event)
     
     config = get_system_config()
-    member = DB.get_member(event.sender_id)
+    member = DB.get_member(telegram_id)
     if not member:
         await event.respond('请先发送 /start 注册')
         return
@@ -2732,7 +2387,7 @@ async def promote_handler(event):
             "抱歉，您还没加入上级群，不能使用此功能\n\n"
             "请先按照要求加入 10 级共 10 个上级群，\n"
             "完成后再回来使用推广功能。",
-            buttons=[[Button.inline('🔍 验证未加群', f'verify_groups_{event.sender_id}'.encode())]]
+            buttons=[[Button.inline('🔍 验证未加群', f'verify_groups_{telegram_id}'.encode())]]
         )
         return
     
@@ -2746,8 +2401,8 @@ async def promote_handler(event):
         return
     
     # 生成推广链接
-    bot_info = await event.client.get_me()
-    invite_link = f'https://t.me/{bot_info.username}?start={event.sender_id}'
+    bot_username = await bot_registry.resolve_username(event.client)
+    invite_link = f'https://t.me/{bot_username}?start={telegram_id}'
     
     text = f'💰 赚钱推广\n\n'
     text += f'您的专属推广链接:\n{invite_link}\n\n'
@@ -2764,16 +2419,9 @@ async def promote_handler(event):
     await event.respond(text, buttons=[[Button.url('📤 立即推广 (选择好友/群)', share_url)]])
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_RESOURCES))
+@update_router.text(BTN_RESOURCES)
 async def resources_handler(event):
     """行业资源"""
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
     await show_resource_categories(event, page=1, is_new=True)
 
 
@@ -2843,8 +2491,8 @@ async def show_resource_categories(event, page=1, is_new=False):
 
 
 # 点击分类回调：显示该分类下的资源
+@update_router.callback_prefix(b'cat_')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'cat_(\d+)'))
 async def category_callback(event):
     try:
         data = event.data.decode()
@@ -2918,8 +2566,8 @@ async def category_callback(event):
         await event.answer('加载失败', alert=True)
 
 
+@update_router.callback(b'back_to_categories')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'back_to_categories'))
 async def back_to_categories_callback(event):
     """返回分类列表（同 show_resource_categories 第1页）"""
     try:
@@ -2930,21 +2578,20 @@ async def back_to_categories_callback(event):
         await event.answer('返回失败', alert=True)
 
 
+@update_router.callback_prefix(b'res_page_')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'res_page_(\d+)_(\d+)'))
 async def resource_page_callback(event):
     """处理资源页面按钮"""
 
 
+@update_router.callback(b'res_back_main')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(data=b'res_back_main'))
 async def resource_back_main_callback(event):
     """处理资源页面返回主菜单按钮"""
     # 账号关联处理（备用号->主账号）
     original_sender_id = event.sender_id
     try:
-        mapped_id = get_main_account_id(
-            original_sender_id, getattr(event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         telegram_id = mapped_id if mapped_id != original_sender_id else original_sender_id
     except BaseException:
         telegram_id = original_sender_id
@@ -2959,8 +2606,8 @@ async def resource_back_main_callback(event):
     await event.answer("返回主菜单", alert=True)
 
 
+@update_router.callback_prefix(b'catpg_')
 @rate_limit_callback
-@multi_bot_on(events.CallbackQuery(pattern=rb'catpg_(\d+)'))
 async def category_page_callback(event):
     """处理分类页面分页按钮"""
     try:
@@ -2970,8 +2617,7 @@ async def category_page_callback(event):
         # 账号关联处理（备用号->主账号）
         original_sender_id = event.sender_id
         try:
-            mapped_id = get_main_account_id(
-                original_sender_id, getattr(event.sender, 'username', None))
+            mapped_id = resolve_event_account(event)
             telegram_id = mapped_id if mapped_id != original_sender_id else original_sender_id
         except BaseException:
             telegram_id = original_sender_id
@@ -3099,17 +2745,9 @@ async def category_page_callback(event):
         await event.answer('加载失败', alert=True)
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_SUPPORT))
+@update_router.text(BTN_SUPPORT)
 async def support_handler(event):
     """在线客服"""
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
-    
     # 获取客服列表
     services = DB.get_customer_services()
     
@@ -3137,16 +2775,14 @@ async def support_handler(event):
     await event.respond(text, buttons=buttons, parse_mode='md')
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_VIP))
+@update_router.text(BTN_VIP)
 async def vip_handler(event):
     """开通会员"""
     original_sender_id = event.sender_id
 
     # 备用号映射：始终使用主账号ID
     try:
-        mapped_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         # 强制使用映射后的主账号ID
         effective_user_id = mapped_id if mapped_id != original_sender_id else original_sender_id
     except BaseException:
@@ -3201,7 +2837,7 @@ async def vip_handler(event):
         )
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_MY_PROMOTE))
+@update_router.text(BTN_MY_PROMOTE)
 async def my_promote_handler(event):
     """我的推广"""
     original_sender_id = event.sender_id
@@ -3209,9 +2845,7 @@ async def my_promote_handler(event):
 
     # 备用号映射：始终使用主账号ID
     try:
-        mapped_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
+        mapped_id = resolve_event_account(event)
         print(f"[DEBUG] my_promote_handler: mapped_id = {mapped_id}")
         # 强制使用映射后的主账号ID
         effective_user_id = mapped_id if mapped_id != original_sender_id else original_sender_id
@@ -3236,8 +2870,8 @@ async def my_promote_handler(event):
     total_vip = sum(c['vip'] for c in counts)
     
     # 生成推广链接
-    bot_info = await event.client.get_me()
-    invite_link = f'https://t.me/{bot_info.username}?start={event.sender_id}'
+    bot_username = await bot_registry.resolve_username(event.client)
+    invite_link = f'https://t.me/{bot_username}?start={event.sender_id}'
     
     text = f'🎁 我的推广\n\n'
     text += f'📊 推广统计:\n'
@@ -3257,18 +2891,12 @@ async def my_promote_handler(event):
     await event.respond(text, buttons=buttons, parse_mode='md')
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_BACK))
+@update_router.text(BTN_BACK)
 async def back_handler(event):
     """返回主菜单"""
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
+    telegram_id = resolve_event_account(event)
     
-    member = DB.get_member(event.sender_id)
+    member = DB.get_member(telegram_id)
     if not member:
         await event.respond('请先发送 /start 注册')
         return
@@ -3279,22 +2907,16 @@ async def back_handler(event):
         f'💎 VIP状态: {"✅ 已开通" if member["is_vip"] else "❌ 未开通"}\n'
         f'💰 余额: {member["balance"]} U\n\n'
         f'请选择功能:',
-        buttons=get_main_keyboard(event.sender_id)
+        buttons=get_main_keyboard(telegram_id)
     )
 
 
-@multi_bot_on(events.NewMessage(pattern=BTN_ADMIN))
+@update_router.text(BTN_ADMIN)
 async def admin_handler(event):
     """管理后台"""
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
+    telegram_id = resolve_event_account(event)
     
-    if event.sender_id not in ADMIN_IDS:
+    if telegram_id not in ADMIN_IDS:
         return
     
     # 获取系统配置
@@ -3354,21 +2976,13 @@ async def raw_permission_handler(event):
             channel_id = update.channel_id
 
             # 检查是否是我们的机器人
-            is_our_bot = False
-            target_bot = None
-            for client in clients:
-                try:
-                    me = await client.get_me()
-                    if me.id == user_id:
-                        is_our_bot = True
-                        target_bot = client
-                        break
-                except BaseException:
-                    continue
-
-            if not is_our_bot:
+            target_bot = bot_registry.get_client(user_id)
+            if not target_bot:
                 return
 
+            # 通知调度器尽快复查该群
+            group_health.mark_dirty(channel_id)
+
             # 分析新旧状态
             prev = update.prev_participant
             new_p = update.new_participant
@@ -3390,19 +3004,11 @@ async def raw_permission_handler(event):
             is_admin = update.is_admin
 
             # 检查是否是我们的机器人被取消了管理员
-            is_our_bot = False
-            target_bot = None
-            for client in clients:
-                try:
-                    me = await client.get_me()
-                    if me.id == user_id:
-                        is_our_bot = True
-                        target_bot = client
-                        break
-                except BaseException:
-                    continue
+            target_bot = bot_registry.get_client(user_id)
+            if target_bot:
+                group_health.mark_dirty(chat_id, user_id, present=True)
 
-            if is_our_bot and not is_admin:
+            if target_bot and not is_admin:
                 print(f"[Raw检测] 🚨 普通群 {chat_id}: 机器人 {user_id} 被撤销管理员")
                 await notify_group_binding_invalid(chat_id, user_id, "管理员权限被撤销", target_bot)
 
@@ -3436,15 +3042,7 @@ async def check_permission_changes():
         for user_id, group_id, group_name, username in bound_groups:
             try:
                 # 找到对应的机器人
-                target_bot = None
-                for client in clients:
-                    try:
-                        me = await client.get_me()
-                        if me.id == user_id:
-                            target_bot = client
-                            break
-                    except BaseException:
-                        continue
+                target_bot = bot_registry.get_client(user_id)
 
                 if not target_bot:
                     print(f"[权限检查] 未找到用户 {user_id} 对应的机器人，跳过")
@@ -3483,6 +3081,7 @@ async def check_permission_changes():
                                     'UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (user_id,))
                                 conn.commit()
                                 conn.close()
+                                required_groups_cache.invalidate_upline(user_id)
                                 break
                             except Exception as db_err:
                                 if conn:
@@ -3567,7 +3166,15 @@ async def group_welcome_handler(event):
     try:
         print(
             f'[ChatAction] 收到事件: {type(event.action_message.action).__name__ if event.action_message else "无"}')
-        
+
+        # 我们的机器人被拉入 / 移出群组时，通知健康调度器立即复查该群
+        action_user_ids = list(getattr(event, 'user_ids', None) or [])
+        for action_user_id in action_user_ids:
+            if bot_registry.is_our_bot(action_user_id):
+                group_health.mark_dirty(
+                    event.chat_id, action_user_id,
+                    present=bool(event.user_joined or event.user_added))
+
         # 检查是否是用户加入事件
         if event.user_joined or event.user_added:
             sys_config = get_system_config()
@@ -3588,6 +3195,7 @@ async def group_welcome_handler(event):
             # 获取群信息
             chat = await event.get_chat()
             chat_id = chat.id if chat else None
+            group_peers.remember(bot_registry.get_id(event.client), chat)
             print(f'[群事件] 群ID={chat_id}, 新用户={new_user_id}({new_username})')
             
             # ===== 自动注册功能 =====
@@ -3672,7 +3280,7 @@ async def group_welcome_handler(event):
                                 
                                 # 通知邀请者
                                 try:
-                                    await bot.send_message(
+                                    await interactive_sender.send_message(
                                         added_by,
                                         (
                                             "📨 邀请成功通知\n\n"
@@ -3723,27 +3331,10 @@ async def group_welcome_handler(event):
                     print(f'[机器人检测] 当前活跃机器人数量: {len(clients)}')
                     return
 
-                bot_ids = []
-                for client in clients:
-                    try:
-                        bot_ids.append((await client.get_me()).id)
-                    except Exception as e:
-                        print(f'[机器人检测] 获取机器人ID失败: {e}')
-                        continue
-
-                print(f'[机器人检测] 当前活跃机器人ID: {bot_ids}')
+                kicked_bot = bot_registry.get_client(kicked_user_id)
 
-                if kicked_user_id in bot_ids:
+                if kicked_bot:
                     print(f'[机器人检测] ✅ 检测到我们的机器人被踢出群组: {kicked_user_id}')
-                    # 找到被踢出的机器人实例
-                    kicked_bot = None
-                    for client in clients:
-                        try:
-                            if (await client.get_me()).id == kicked_user_id:
-                                kicked_bot = client
-                                break
-                        except Exception as e:
-                            continue
 
                     # 【修改】优先使用被踢出的机器人发送私聊通知（因为是PM给用户，不需要在群里发）
                     # 只有当找不到该机器人实例时，才使用其他机器人兜底
@@ -3778,17 +3369,7 @@ async def group_welcome_handler(event):
             user_id = getattr(event, 'user_id', None)
             if user_id:
                 # 检查是否是我们的机器人
-                is_our_bot = False
-                for client in clients:
-                    try:
-                        me = await client.get_me()
-                        if me.id == user_id:
-                            is_our_bot = True
-                            break
-                    except BaseException:
-                        continue
-
-                if is_our_bot:
+                if bot_registry.is_our_bot(user_id):
                     print(f'[权限检测] 检测到本机机器人 {user_id} 离开群组 {chat_id}，开始权限检查')
                     should_check_permissions = True
         elif event.action_message and hasattr(event.action_message.action, 'users'):
@@ -3800,17 +3381,7 @@ async def group_welcome_handler(event):
                 removed_users = getattr(
                     event.action_message.action, 'users', [])
                 for removed_user_id in removed_users:
-                    is_our_bot = False
-                    for client in clients:
-                        try:
-                            me = await client.get_me()
-                            if me.id == removed_user_id:
-                                is_our_bot = True
-                                break
-                        except BaseException:
-                            continue
-
-                    if is_our_bot:
+                    if bot_registry.is_our_bot(removed_user_id):
                         print(f'[权限检测] 检测到本机机器人 {removed_user_id} 被移除，准备权限检查')
                         should_check_permissions = True
                         break
@@ -3831,15 +3402,7 @@ async def group_welcome_handler(event):
 
             if user_id:
                 # 找到对应的机器人客户端
-                target_bot = None
-                for client in clients:
-                    try:
-                        me = await client.get_me()
-                        if me.id == user_id:
-                            target_bot = client
-                            break
-                    except BaseException:
-                        continue
+                target_bot = bot_registry.get_client(user_id)
 
                 if target_bot:
                     # 转换chat_id格式
@@ -3882,19 +3445,9 @@ async def group_welcome_handler(event):
         user_id = getattr(event, 'user_id', None)
         if user_id:
             # 检查是否是我们的机器人
-            is_our_bot = False
-            target_bot = None
-            for client in clients:
-                try:
-                    me = await client.get_me()
-                    if me.id == user_id:
-                        is_our_bot = True
-                        target_bot = client
-                        break
-                except BaseException:
-                    continue
+            target_bot = bot_registry.get_client(user_id)
 
-            if is_our_bot and target_bot:
+            if target_bot:
                 action_type = type(
                     event.action_message.action).__name__ if event.action_message else "Unknown"
                 print(
@@ -3913,28 +3466,21 @@ async def group_welcome_handler(event):
 # ==================== 完整的消息处理器 ====================
 
 
-@multi_bot_on(events.NewMessage())
+@update_router.fallback
 async def message_handler(event):
-    """完整的消息处理器 - 处理提现、管理员设置、群链接等"""
-    # 账号关联处理
-    try:
-        original_sender_id = event.sender_id
-        event.sender_id = get_main_account_id(
-            original_sender_id, getattr(
-                event.sender, 'username', None))
-    except BaseException:
-        pass
-    
+    """完整的消息处理器 - 处理提现、管理员设置、群链接等（群聊闲聊已被 _message_fast_path 过滤）"""
     # 忽略命令和按钮文字
     if not event.message.text:
         return
     
     text = event.message.text.strip()
-    sender_id = event.sender_id
+    # 账号关联处理：流程状态按主账号记录（event.sender_id 是只读属性，不能直接改写）
+    sender_id = resolve_event_account(event)
+    state, state_data = conversation_store.get(sender_id)
     
     # 处理提现金额输入
-    if sender_id in waiting_for_withdraw_amount:
-        del waiting_for_withdraw_amount[sender_id]
+    if state == STATE_WITHDRAW_AMOUNT:
+        conversation_store.pop(sender_id)
         try:
             amount = float(text)
             config = get_system_config()
@@ -3948,8 +3494,7 @@ async def message_handler(event):
                 await event.respond(f'❌ 余额不足\n\n当前余额: {member["balance"]} U')
                 return
             
-            withdraw_temp_data[sender_id] = amount
-            waiting_for_withdraw_address[sender_id] = True
+            conversation_store.set(sender_id, STATE_WITHDRAW_ADDRESS, {'amount': amount})
             await event.respond(
                 f'💳 提现申请\n\n'
                 f'提现金额: {amount} U\n\n'
@@ -3960,21 +3505,19 @@ async def message_handler(event):
         return
     
     # 处理提现地址输入
-    if sender_id in waiting_for_withdraw_address:
-        del waiting_for_withdraw_address[sender_id]
+    if state == STATE_WITHDRAW_ADDRESS:
+        conversation_store.pop(sender_id)
         usdt_address = text.strip()
         
         if not usdt_address or len(usdt_address) < 20:
             await event.respond('❌ 请输入有效的USDT地址')
             return
         
-        amount = withdraw_temp_data.get(sender_id, 0)
+        amount = (state_data or {}).get('amount', 0)
         if amount <= 0:
             await event.respond('❌ 提现金额错误，请重新申请')
             return
         
-        del withdraw_temp_data[sender_id]
-        
         try:
             import datetime
             import time
@@ -4044,10 +3587,7 @@ async def message_handler(event):
     # 忽略命令
     if text.startswith('/'):
         if text == '/cancel':
-            waiting_for_group_link.pop(sender_id, None)
-            waiting_for_backup.pop(sender_id, None)
-            waiting_for_recharge_amount.pop(sender_id, None)
-            admin_waiting.pop(sender_id, None)
+            conversation_store.clear(sender_id)
             await event.respond('已取消操作', buttons=get_main_keyboard(sender_id))
         return
     
@@ -4066,8 +3606,8 @@ async def message_handler(event):
         return
     
     # 管理员设置处理
-    if sender_id in admin_waiting:
-        wait_type = admin_waiting[sender_id]
+    if state and state.startswith(ADMIN_STATE_PREFIX):
+        wait_type = state[len(ADMIN_STATE_PREFIX):]
         config = get_system_config()
         
         if wait_type == 'level_count':
@@ -4085,7 +3625,7 @@ async def message_handler(event):
                             'level_amounts', json.dumps(amounts))
                     except Exception as e:
                         print(f"[admin_set_level] 无法初始化 level_amounts: {e}")
-                    del admin_waiting[sender_id]
+                    conversation_store.pop(sender_id)
                     await event.respond(f'✅ 层数设置成功!\n\n当前层数: {value} 层')
                 else:
                     await event.respond('❌ 请输入1-20之间的数字')
@@ -4099,7 +3639,7 @@ async def message_handler(event):
                 if value > 0:
                     from database import update_system_config
                     update_system_config('level_reward', value)
-                    del admin_waiting[sender_id]
+                    conversation_store.pop(sender_id)
                     await event.respond(f'✅ 返利设置成功!\n\n每层返利: {value} U')
                 else:
                     await event.respond('❌ 请输入大于0的数字')
@@ -4113,7 +3653,7 @@ async def message_handler(event):
                 if value > 0:
                     from database import update_system_config
                     update_system_config('vip_price', value)
-                    del admin_waiting[sender_id]
+                    conversation_store.pop(sender_id)
                     await event.respond(f'✅ VIP价格设置成功!\n\n当前价格: {value} U')
                 else:
                     await event.respond('❌ 请输入大于0的数字')
@@ -4127,7 +3667,7 @@ async def message_handler(event):
                 if value >= 0:
                     from database import update_system_config
                     update_system_config('withdraw_threshold', value)
-                    del admin_waiting[sender_id]
+                    conversation_store.pop(sender_id)
                     await event.respond(f'✅ 提现门槛设置成功!\n\n当前门槛: {value} U')
                 else:
                     await event.respond('❌ 请输入大于等于0的数字')
@@ -4138,7 +3678,7 @@ async def message_handler(event):
         elif wait_type == 'support_text':
             from database import update_system_config
             update_system_config('support_text', text)
-            del admin_waiting[sender_id]
+            conversation_store.pop(sender_id)
             await event.respond(f'✅ 客服文本设置成功!\n\n当前文本:\n{text}')
             return
         
@@ -4188,7 +3728,7 @@ async def message_handler(event):
                     f'用户名: @{target_user["username"]}\n'
                     f'VIP开通时间: {target_user["vip_time"][:10] if target_user["vip_time"] else "未知"}'
                 )
-                del admin_waiting[sender_id]
+                conversation_store.pop(sender_id)
                 return
             
             # 【核心修复】调用统一处理函数
@@ -4205,7 +3745,7 @@ async def message_handler(event):
             else:
                 await event.respond(f'❌ {result}')
             
-            del admin_waiting[sender_id]
+            conversation_store.pop(sender_id)
             return
         
         elif wait_type == 'broadcast':
@@ -4221,7 +3761,7 @@ async def message_handler(event):
             
             if not all_users:
                 await event.respond('❌ 暂无用户')
-                del admin_waiting[sender_id]
+                conversation_store.pop(sender_id)
                 return
             
             # 发送确认消息
@@ -4240,13 +3780,12 @@ async def message_handler(event):
             
             for user_id, username in all_users:
                 try:
-                    await bot.send_message(
+                    await send_dispatcher.send_message(
                         user_id,
                         f'📢 系统广播\n\n{broadcast_message}',
                         parse_mode='markdown'
                     )
                     success_count += 1
-                    await asyncio.sleep(0.05)
                 except Exception as e:
                     failed_count += 1
                     print(f"发送广播给用户 {user_id} (@{username}) 失败: {e}")
@@ -4265,11 +3804,11 @@ async def message_handler(event):
                 f'• 用户隐私设置限制'
             )
             
-            del admin_waiting[sender_id]
+            conversation_store.pop(sender_id)
             return
     
     # 处理充值金额输入
-    if sender_id in waiting_for_recharge_amount and waiting_for_recharge_amount[sender_id]:
+    if state == STATE_RECHARGE_AMOUNT:
         try:
             amount = float(text)
             if amount <= 0:
@@ -4279,14 +3818,14 @@ async def message_handler(event):
                 await event.respond('❌ 单次充值金额不能超过99999 U')
                 return
             
-            del waiting_for_recharge_amount[sender_id]
-            await create_recharge_order(bot, event, amount)
+            conversation_store.pop(sender_id)
+            await create_recharge_order(send_dispatcher, event, amount)
         except ValueError:
             await event.respond('❌ 请输入有效的数字')
         return
     
     # 设置备用号
-    if sender_id in waiting_for_backup and waiting_for_backup[sender_id]:
+    if state == STATE_BACKUP:
         backup_raw = text.strip().lstrip('@')
         backup_id = None
         backup_username = None
@@ -4298,7 +3837,7 @@ async def message_handler(event):
         # 无论是ID还是用户名，都尝试通过 Telegram 获取实体
         try:
             entity_query = backup_id if backup_id is not None else backup_raw
-            entity = await bot.get_entity(entity_query)
+            entity = await event.client.get_entity(entity_query)
             if getattr(entity, 'id', None):
                 backup_id = entity.id
                 backup_username = getattr(entity, 'username', None)
@@ -4310,12 +3849,12 @@ async def message_handler(event):
             return
         
         success, message = link_account(sender_id, backup_id, backup_username)
-        del waiting_for_backup[sender_id]
+        conversation_store.pop(sender_id)
         await event.respond(message)
         return
     
     # 设置群链接
-    if sender_id in waiting_for_group_link and waiting_for_group_link[sender_id]:
+    if state == STATE_GROUP_LINK:
         link = text
         # 只允许 http(s)://t.me/ 开头的链接
         if link.startswith('http://t.me/') or link.startswith('https://t.me/'):
@@ -4387,7 +3926,7 @@ async def message_handler(event):
                     await event.respond(f'❌ 绑定失败: {str(sync_err)}')
                     return
 
-                del waiting_for_group_link[sender_id]
+                conversation_store.pop(sender_id)
                 
                 # 构造提示文案
                 if verification_result.get('admin_checked'):
@@ -4424,469 +3963,248 @@ async def message_handler(event):
 
 
 async def process_notify_queue():
-    """处理通知队列"""
+    """投递通知发件箱（notify_outbox 表）中的通知"""
+    await notify_outbox.run(send_dispatcher.send_message, NOTIFY_WORKERS, NOTIFY_MAX_ATTEMPTS)
+
+
+async def process_bot_actions():
+    """执行 Web 后台写入的操作（bot_actions 表，见 bot_actions.py）"""
+    async def recharge(member_id, amount, is_vip_order=False):
+        return await process_recharge(member_id, amount, is_vip_order)
+
+    async def manual_vip(telegram_id):
+        success, result = await admin_manual_vip_handler(telegram_id, get_system_config())
+        if not success:
+            raise RuntimeError(result)
+        return result
+
+    await bot_action_runner.run({'recharge': recharge, 'manual_vip': manual_vip})
+
+
+async def watch_bot_configs():
+    """后台新增 / 启用机器人后（可能在其他进程）启动对应的机器人，见 database.notify_bot_configs_changed"""
+    version = get_cache_version('bot_configs')
     while True:
+        await asyncio.sleep(BOT_CONFIG_CHECK_INTERVAL)
         try:
-            await asyncio.sleep(1)
-            while notify_queue:
-                item = notify_queue.pop(0)
-                try:
-                    await bot.send_message(item['member_id'], item['message'])
-                    print(f"✅ 通知已发送: 用户{item['member_id']}")
-                except Exception as e:
-                    print(f"发送通知失败: {e}")
+            current = get_cache_version('bot_configs')
+            if current == version:
+                continue
+            version = current
+            for db_id, token in get_active_bot_tokens():
+                if db_id in _bot_supervisors and not _bot_supervisors[db_id].done():
+                    continue
+                active_tokens.append((db_id, token))
+                _launch_bot(db_id, token)
+                print(f"[机器人初始化] 检测到新机器人配置，启动 Bot ID {db_id}")
         except Exception as e:
-            print(f"[通知队列] 错误: {e}")
-            await asyncio.sleep(5)
+            print(f"[机器人初始化] 检查机器人配置失败: {e}")
+
+
+async def process_dm_campaigns():
+    """分批发送全体会员私信群发活动（dm_campaigns 表，见 dm_campaign.py）"""
+    await dm_campaign_runner.run(
+        send_dispatcher.send_message, lambda: len(clients),
+        DM_CAMPAIGN_RATE_PER_BOT, DM_CAMPAIGN_CHUNK)
 
 # ==================== 后台定时任务 ====================
 
 
 async def auto_broadcast_timer():
-    """定时自动群发 - 根据 assignment 中每条消息的 broadcast_interval 和 last_sent_time 调度发送"""
-    import json
-    from datetime import datetime
+    """定时自动群发 - 到期的分配写入 broadcast_queue（调度逻辑见 broadcast_scheduler.py）"""
+    await broadcast_scheduler.run()
 
-    check_interval_seconds = 10  # 每10秒扫描一次
-    
-    while True:
-        try:
-            await asyncio.sleep(check_interval_seconds)
-            now_ts = time.time()
-            print("[定时群发] 扫描分配任务...", flush=True)
-            
-            conn = get_db_conn()
-            c = conn.cursor()
-            
-            # 全局开关：允许管理员关闭定时分发
-            c.execute(
-                "SELECT value FROM system_config WHERE key = 'broadcast_enabled'")
-            row = c.fetchone()
-            broadcast_enabled = row[0] == '1' if row else True
-            if not broadcast_enabled:
-                conn.close()
-                continue
-            
-            # 查询所有启用分配：关联
-            # member_groups、broadcast_assignments、broadcast_messages
-            c.execute("""
-                SELECT ba.id, ba.group_id, ba.message_id, ba.last_sent_time,
-                       mg.group_link, mg.group_name,
-                       bm.content, bm.image_url, bm.video_url, bm.buttons, bm.buttons_per_row, bm.broadcast_interval, bm.create_time
-                FROM broadcast_assignments ba
-                JOIN broadcast_messages bm ON ba.message_id = bm.id
-                JOIN member_groups mg ON ba.group_id = mg.id
-                WHERE ba.is_active = 1 AND bm.is_active = 1 AND mg.schedule_broadcast = 1
-                ORDER BY bm.create_time ASC, bm.id ASC
-            """)
-            rows = c.fetchall()
 
-            if not rows:
-                conn.close()
-                continue
-            
-            to_enqueue = []
-            for r in rows:
-                assign_id, group_id, message_id, last_sent_time, group_link, group_name, content, image_url, video_url, buttons_json, buttons_per_row, b_interval, bm_create = r
-                try:
-                    interval_minutes = int(b_interval) if b_interval else 120
-                except BaseException:
-                    interval_minutes = 120
-                interval_seconds = interval_minutes * 60
+def _group_owner_client(group):
+    """群的管理员机器人客户端（见 group_affinity.py），未知 / 不在线返回 None"""
+    return bot_registry.get_client(group_affinity.owner(group))
 
-                # parse last_sent_time (ISO) to timestamp
-                last_ts = 0
-                if last_sent_time:
-                    try:
-                        # handle timezone-aware ISO strings
-                        dt = datetime.fromisoformat(last_sent_time)
-                        last_ts = dt.timestamp()
-                    except Exception:
-                        try:
-                            last_ts = float(last_sent_time)
-                        except BaseException:
-                            last_ts = 0
-
-                # if never sent or interval elapsed, enqueue
-                if now_ts - last_ts >= interval_seconds:
-                    # prepare message content (simple: content only;
-                    # buttons/media handled by process_broadcast_queue)
-                    to_enqueue.append({
-                        'assign_id': assign_id,
-                        'group_id': group_id,
-                        'group_link': group_link,
-                        'group_name': group_name,
-                        'message_id': message_id,
-                        'content': content or '',
-                        'image_url': image_url or '',
-                        'video_url': video_url or '',
-                        'buttons': buttons_json or '',
-                        'buttons_per_row': buttons_per_row or 2
-                    })
-
-            # 插入到 broadcast_queue 并更新 last_sent_time
-            if to_enqueue:
-                now_iso = get_cn_time()
-                for item in to_enqueue:
-                    try:
-                        # insert queue entry (store JSON if item contains
-                        # media)
-                        import json as _json
-                        msg_payload = _json.dumps({
-                            'content': item.get('content') or '',
-                            'image_url': item.get('image_url') or '',
-                            'video_url': item.get('video_url') or '',
-                            'buttons': item.get('buttons') or '',
-                            'buttons_per_row': item.get('buttons_per_row') or 2
-                        }, ensure_ascii=False)
-                        c.execute(
-                            'INSERT INTO broadcast_queue (group_link, group_name, message, status, create_time) VALUES (?, ?, ?, ?, ?)',
-                            (item['group_link'],
-                             item['group_name'],
-                                msg_payload,
-                                'pending',
-                                now_iso))
-                        # update last_sent_time for assignment
-                        c.execute(
-                            'UPDATE broadcast_assignments SET last_sent_time = ? WHERE id = ?',
-                            (now_iso,
-                             item['assign_id']))
-                    except Exception as e:
-                        print(
-                            f"[定时群发] 入队失败 assign_id={item.get('assign_id')}: {e}")
-                conn.commit()
-                print(f"[定时群发] 已入队 {len(to_enqueue)} 条消息")
-            
-            conn.close()
-        except Exception as e:
-            print(f"[定时群发] 错误: {e}")
-            await asyncio.sleep(30)
 
+async def send_pinned_announcement(group_link, content):
+    """置顶公告：由群的管理员机器人发送并置顶，返回 (是否已置顶, message_id)"""
+    chat_username = group_link.split('t.me/')[-1].split('/')[0].split('?')[0] if 't.me/' in group_link \
+        else group_link.lstrip('@')
+    chat = chat_username if chat_username.startswith('+') else f'@{chat_username}'
+    msg = await send_dispatcher.send_message(
+        chat, f'📢 公告\n\n{content}', prefer=_group_owner_client(group_link))
+    # 置顶需要管理员权限，使用发出该消息的机器人
+    try:
+        await msg.pin(notify=False)
+    except Exception as pin_err:
+        print(f'置顶失败(可能无权限) {group_link}: {pin_err}')
+        return False, msg.id
+    return True, msg.id
+
+
+async def process_pinned_campaigns():
+    """发送置顶公告活动（pinned_campaigns 表，见 pinned_campaign.py）"""
+    await pinned_campaign_runner.run(
+        send_pinned_announcement, max(BROADCAST_QUEUE_WORKERS, len(active_tokens)))
+
+
+async def send_queued_broadcast(group_link, group_name, message, message_id=None, message_version=None):
+    """发送 broadcast_queue 中的一条记录，返回 (status, result)"""
+    if not group_link or 't.me/' not in group_link:
+        return 'failed', '无效链接'
+    chat_username = group_link.split('t.me/')[-1].split('/')[0].split('?')[0]
+    # 私有邀请链接无法按用户名解析，只能按记录的群ID + access_hash 发送
+    if chat_username.startswith('+') and group_peers.group_id(group_link) is None:
+        return 'failed', '私有群未记录群ID'
+
+    # 同一条群发消息的同一版本只编译一次（文本 / entities / 媒体路径 / 按钮）
+    payload = broadcast_payloads.for_row(message, message_id, message_version)
+    if payload is None:
+        return 'failed', '群发内容已删除'
+
+    chat = chat_username if chat_username.startswith('+') else f'@{chat_username}'
+    # 从该群的管理员机器人发出（未知时由调度器按负载选择）
+    owner = _group_owner_client(chat_username)
+    if payload.media_path:
+        await send_dispatcher.send_file(chat, payload.media_path, caption=payload.text,
+                                        formatting_entities=payload.entities, prefer=owner)
+    else:
+        await send_dispatcher.send_message(chat, payload.text, formatting_entities=payload.entities,
+                                           buttons=payload.markup, prefer=owner)
+    print(f"[群发队列] 已发送到 {group_name}")
+    return 'sent', '发送成功'
 
-async def process_broadcast_queue():
-    """处理群发队列（数据库队列）"""
-    while True:
-        try:
-            await asyncio.sleep(5)  # 每5秒检查一次
-            conn = get_db_conn()
-            c = conn.cursor()
-            
-            # 获取待发送的任务
-            c.execute(
-                "SELECT id, group_link, group_name, message FROM broadcast_queue WHERE status = 'pending' LIMIT 10")
-            tasks = c.fetchall()
-            
-            for task in tasks:
-                task_id, group_link, group_name, message = task
-                try:
-                    if group_link and 't.me/' in group_link:
-                        chat_username = group_link.split(
-                            't.me/')[-1].split('/')[0].split('?')[0]
-                        if not chat_username.startswith('+'):
-                            # 支持 message 存储为纯文本或 JSON 字符串（包含
-                            # content/image_url/video_url/buttons）
-                            send_text = None
-                            send_image = None
-                            send_video = None
-                            send_buttons = None
-                            try:
-                                import json as _json
-                                parsed = _json.loads(message)
-                                if isinstance(parsed, dict):
-                                    send_text = parsed.get('content') or ''
-                                    send_image = parsed.get('image_url') or ''
-                                    send_video = parsed.get('video_url') or ''
-                                    send_buttons = parsed.get('buttons') or ''
-                                else:
-                                    send_text = str(parsed)
-                            except Exception:
-                                send_text = message
-
-                            # send file if image or video present
-                            if send_image:
-                                file_path = send_image
-                                if send_image.startswith('/static/uploads/'):
-                                    # prefer local file path using UPLOAD_DIR
-                                    # from config
-                                    try:
-                                        from config import UPLOAD_DIR
-                                        filename = os.path.basename(send_image)
-                                        local_path = os.path.join(
-                                            UPLOAD_DIR, filename)
-                                    except Exception:
-                                        local_path = os.path.join(os.path.dirname(
-                                            os.path.dirname(__file__)), send_image.lstrip('/'))
-
-                                    if os.path.exists(local_path):
-                                        await bot.send_file(f'@{chat_username}', local_path, caption=send_text)
-                                    else:
-                                        # fallback to sending as URL and log
-                                        # error
-                                        print(
-                                            f"[群发错误] 找不到本地图片文件: {local_path}")
-                                        await bot.send_message(f'@{chat_username}', send_text + '\n' + send_image)
-                                else:
-                                    await bot.send_message(f'@{chat_username}', send_text + '\n' + send_image)
-                            elif send_video:
-                                file_path = send_video
-                                if send_video.startswith('/static/uploads/'):
-                                    try:
-                                        from config import UPLOAD_DIR
-                                        filename = os.path.basename(send_video)
-                                        local_path = os.path.join(
-                                            UPLOAD_DIR, filename)
-                                    except Exception:
-                                        local_path = os.path.join(os.path.dirname(
-                                            os.path.dirname(__file__)), send_video.lstrip('/'))
-
-                                    if os.path.exists(local_path):
-                                        await bot.send_file(f'@{chat_username}', local_path, caption=send_text)
-                                    else:
-                                        print(
-                                            f"[群发错误] 找不到本地视频文件: {local_path}")
-                                        await bot.send_message(f'@{chat_username}', send_text + '\n' + send_video)
-                                else:
-                                    await bot.send_message(f'@{chat_username}', send_text + '\n' + send_video)
-                            else:
-                                # try to build buttons if any
-                                buttons_obj = None
-                                if send_buttons:
-                                    try:
-                                        import json as _json2
-                                        btns = _json2.loads(send_buttons)
-                                        per_row = 2
-                                        # if buttons_per_row present in parsed,
-                                        # use it
-                                        if isinstance(
-                                                parsed, dict) and parsed.get('buttons_per_row'):
-                                            per_row = int(
-                                                parsed.get('buttons_per_row') or per_row)
-                                        rows = []
-                                        row_buf = []
-                                        for b in btns:
-                                            if b.get('name') and b.get('url'):
-                                                row_buf.append(
-                                                    Button.url(b['name'], b['url']))
-                                                if len(row_buf) >= per_row:
-                                                    rows.append(row_buf)
-                                                    row_buf = []
-                                        if row_buf:
-                                            rows.append(row_buf)
-                                        if rows:
-                                            buttons_obj = rows
-                                    except Exception:
-                                        buttons_obj = None
-
-                                if buttons_obj:
-                                    await bot.send_message(f'@{chat_username}', send_text, buttons=buttons_obj)
-                                else:
-                                    await bot.send_message(f'@{chat_username}', send_text)
 
-                            c.execute(
-                                "UPDATE broadcast_queue SET status = 'sent', result = '发送成功' WHERE id = ?",
-                                (task_id,
-                                 ))
-                            print(f"[群发队列] 已发送到 {group_name}")
-                        else:
-                            c.execute(
-                                "UPDATE broadcast_queue SET status = 'failed', result = '私有群链接' WHERE id = ?",
-                                (task_id,
-                                 ))
-                    else:
-                        c.execute(
-                            "UPDATE broadcast_queue SET status = 'failed', result = '无效链接' WHERE id = ?",
-                            (task_id,
-                             ))
-                except Exception as e:
-                    c.execute(
-                        "UPDATE broadcast_queue SET status = 'failed', result = ? WHERE id = ?",
-                        (str(e)[
-                            :200],
-                            task_id))
-                    print(f"[群发队列] 发送到 {group_name} 失败: {e}")
-                
-                conn.commit()
-                await asyncio.sleep(1)  # 每条消息间隔1秒，避免频率限制
-            
-            conn.close()
-        except Exception as e:
-            print(f"[群发队列] 处理错误: {e}")
-            await asyncio.sleep(10)
+async def process_broadcast_queue():
+    """处理群发队列（数据库队列，租约式多协程消费，见 broadcast_queue.py）"""
+    # 每条记录从群的管理员机器人发出，发送协程数不少于机器人数，让每个机器人都能满速发送
+    await broadcast_queue_consumer.run(
+        send_queued_broadcast, max(BROADCAST_QUEUE_WORKERS, len(active_tokens)))
 
 
-async def process_broadcasts():
-    """定期检查并处理待发送的群发任务（内存队列）"""
-    while True:
-        try:
-            if pending_broadcasts:
-                task = pending_broadcasts.pop(0)
-                task_type = task.get('type', 'broadcast')
-                
-                # 处理置顶广告任务
-                if task_type == 'pinned_ad':
-                    content = task['content']
-                    groups = task['groups']  # [(telegram_id, group_link), ...]
-                    
-                    print(f'开始发布置顶广告到 {len(groups)} 个群')
-                    success_count = 0
-                    fail_count = 0
-                    
-                    for telegram_id, group_link in groups:
-                        try:
-                            if not group_link:
-                                continue
-                            # 从群链接提取群ID或用户名
-                            if group_link.startswith('https://t.me/'):
-                                group_username = group_link.replace(
-                                    'https://t.me/', '')
-                            elif group_link.startswith('@'):
-                                group_username = group_link
-                            else:
-                                group_username = group_link
-                            
-                            # 发送广告消息
-                            msg = await bot.send_message(group_username, f'📢 公告\n\n{content}')
-                            
-                            # 尝试置顶消息（需要管理员权限）
-                            try:
-                                await bot.pin_message(group_username, msg.id, notify=False)
-                            except Exception as pin_err:
-                                print(f'置顶失败(可能无权限): {pin_err}')
-                            
-                            success_count += 1
-                            await asyncio.sleep(0.5)
-                        except Exception as e:
-                            fail_count += 1
-                            print(f'发送到群组失败 {group_link}: {e}')
-                    
-                    print(f'置顶广告发布完成: 成功{success_count}个群，失败{fail_count}个')
-                
-                # 处理普通群发任务
-                else:
-                    log_id = task.get('log_id')
-                    message_content = task.get('message_content', '')
-                    group_links = task.get('group_links', [])
-                    
-                    print(f'开始群发到群组: {len(group_links)}个群')
-                    success_count = 0
-                    fail_count = 0
-                    
-                    for group_link in group_links:
-                        try:
-                            # 从群链接提取群ID或用户名
-                            if group_link.startswith('https://t.me/'):
-                                group_username = group_link.replace(
-                                    'https://t.me/', '')
-                            elif group_link.startswith('@'):
-                                group_username = group_link
-                            else:
-                                group_username = '@' + group_link
-                            
-                            await bot.send_message(group_username, message_content)
-                            success_count += 1
-                            await asyncio.sleep(0.5)
-                        except Exception as e:
-                            fail_count += 1
-                            print(f'发送到群组失败 {group_link}: {e}')
-                    
-                    # 更新日志状态
-                    if log_id:
-                        conn = get_db_conn()
-                        c = conn.cursor()
-                        c.execute('''
-                            UPDATE broadcast_logs 
-                            SET status = 'completed', 
-                                sent_count = ?, 
-                                failed_count = ?
-                            WHERE id = ?
-                        ''', (success_count, fail_count, log_id))
-                        conn.commit()
-                        conn.close()
-                    
-                    print(f'群组群发完成: 成功发送到{success_count}个群，失败{fail_count}个')
-            
-            await asyncio.sleep(1)  # 每秒检查一次
-        except Exception as e:
-            print(f'群发任务处理异常: {e}')
-            await asyncio.sleep(5)
+def _load_health_check_rows():
+    conn = get_db_conn()
+    c = conn.cursor()
+    c.execute(
+        "SELECT id, telegram_id, group_id, group_link, is_bot_admin, bot_id FROM member_groups "
+        "WHERE (group_id IS NOT NULL AND group_id != '') OR (group_link IS NOT NULL AND group_link != '')")
+    rows = c.fetchall()
+    conn.close()
+    return rows
 
 
-async def check_member_status_task():
-    """
-    【核心修复】定期轮询，作为 Raw 事件的兜底。
-    每 30 秒检查一次所有绑定了群组的机器人权限。
-    """
-    while True:
-        try:
-            await asyncio.sleep(30)
-            print("[轮询检测] 开始检查所有群组权限...")
-            
+async def _apply_health_result(entry, is_in, admin_bot_id):
+    """根据群组检测结果同步数据库状态，权限丢失时通知群主"""
+    uid, gid = entry['uid'], entry['gid']
+    if is_in and admin_bot_id:
+        if not entry['is_admin']:
+            print(f"[群组健康] ✅ 用户 {uid} 的群组 {gid or entry['link']} 权限恢复，更新数据库")
             conn = get_db_conn()
             c = conn.cursor()
-            # 【修复】获取所有绑定了群组的记录，不仅仅是管理员的
-            c.execute(
-                "SELECT telegram_id, group_id, group_link, is_bot_admin FROM member_groups WHERE group_id IS NOT NULL")
-            groups = c.fetchall()
+            c.execute('UPDATE member_groups SET is_bot_admin = 1 WHERE id = ?', (entry['id'],))
+            c.execute('UPDATE members SET is_bot_admin = 1 WHERE telegram_id = ?', (uid,))
+            conn.commit()
             conn.close()
+            required_groups_cache.invalidate_upline(uid)
+        # 记录该群的管理员机器人，群发从它发出
+        group_affinity.set_owner(admin_bot_id, entry['link'], gid, row_id=entry['id'])
+    elif entry['is_admin']:
+        print(f"[群组健康] ⚠️ 用户 {uid} 的群组 {gid or entry['link']} 权限异常 (在群:{is_in})")
+        await notify_group_binding_invalid(gid if gid else 0, uid, "系统检测发现机器人权限丢失", clients[0] if clients else None)
+        conn = get_db_conn()
+        c = conn.cursor()
+        c.execute('UPDATE member_groups SET is_bot_admin = 0 WHERE id = ?', (entry['id'],))
+        c.execute('UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (uid,))
+        conn.commit()
+        conn.close()
+        required_groups_cache.invalidate_upline(uid)
+        group_affinity.forget(entry['link'], gid)
 
-            for uid, gid, link, current_is_admin in groups:
-                if not gid and not link:
-                    continue
 
-                # 确定要检查的群标识符 (ID优先，其次链接)
-                target = gid if gid else link
+async def check_member_status_task():
+    """
+    【优化】群组健康检测：由 Raw / ChatAction 事件驱动，自适应轮询兜底。
+    替代原先每 30 秒全量检查所有群组的做法，API 调用按机器人预算分摊。
+    """
+    await group_health.run(
+        bot_registry, lambda: clients, _load_health_check_rows, _apply_health_result)
 
-                # 使用多机器人检查
-                is_in, admin_bot_id = await check_any_bot_in_group(clients, target)
 
-                # 获取数据库中当前的管理员状态
-                db_is_admin = current_is_admin or 0
+# 群名缓存刷新参数
+GROUP_TITLE_REFRESH_INTERVAL = 60     # 每轮间隔（秒）
+GROUP_TITLE_REFRESH_BUDGET = 20       # 每轮最多调用 Telegram API 次数
+GROUP_TITLE_MAX_AGE = 6 * 3600        # 群名缓存有效期（秒）
 
-                if is_in and admin_bot_id:
-                    # 机器人在群里且是管理员
-                    if db_is_admin == 0:
-                        # 数据库状态需要更新为管理员
-                        print(f"[轮询检测] ✅ 用户 {uid} 的群组 {gid} 权限正常，更新数据库")
-                        conn = get_db_conn()
-                        c = conn.cursor()
-                        c.execute(
-                            'UPDATE member_groups SET is_bot_admin = 1 WHERE group_id = ? AND telegram_id = ?',
-                            (gid,
-                             uid))
-                        c.execute(
-                            'UPDATE members SET is_bot_admin = 1 WHERE telegram_id = ?', (uid,))
-                        conn.commit()
-                        conn.close()
-                else:
-                    # 不在群里，或者在群里但不是管理员
-                    if db_is_admin == 1:
-                        # 权限丢失，需要通知并更新数据库
-                        print(
-                            f"[轮询检测] ⚠️ 用户 {uid} 的群组 {gid} 权限异常 (在群:{is_in}, 管理:{admin_bot_id})")
 
-                        # 找到一个可用的 bot 用于发送通知
-                        notify_bot = clients[0] if clients else None
+def _is_private_group_link(link):
+    tail = link.split('t.me/')[-1] if 't.me/' in link else link.lstrip('@')
+    return tail.startswith('+') or tail.startswith('joinchat/')
 
-                        # 触发通知
-                        raw_chat_id = gid if gid else 0
-                        await notify_group_binding_invalid(raw_chat_id, uid, "系统检测发现机器人权限丢失", notify_bot)
-
-                        # 更新数据库状态
-                        conn = get_db_conn()
-                        c = conn.cursor()
-                        if gid:
-                            c.execute(
-                                'UPDATE member_groups SET is_bot_admin = 0 WHERE group_id = ?', (gid,))
-                        c.execute(
-                            'UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (uid,))
-                        conn.commit()
-                        conn.close()
 
-                await asyncio.sleep(0.5)  # 避免速率限制
+async def refresh_group_titles_task():
+    """
+    后台刷新群名缓存（member_groups.group_name / fallback_accounts.group_titles）
+    每轮按 API 预算只刷新最久未更新的记录，渲染路径无需再访问 Telegram
+    """
+    import json
+    rr = 0
+    while True:
+        try:
+            await asyncio.sleep(GROUP_TITLE_REFRESH_INTERVAL)
+            if not clients:
+                continue
 
+            member_rows, fallback_rows = get_stale_group_titles(
+                GROUP_TITLE_MAX_AGE, GROUP_TITLE_REFRESH_BUDGET)
+            budget = GROUP_TITLE_REFRESH_BUDGET
+
+            async def fetch_title(link):
+                nonlocal budget, rr
+                if _is_private_group_link(link):
+                    return None  # 私有链接无法解析，不消耗预算
+                budget -= 1
+                # 轮流使用各机器人，分摊请求
+                client = clients[rr % len(clients)]
+                rr += 1
+                return await get_group_title(client, link)
+
+            # 捡漏群优先（每个群裂变列表都会展示）
+            for row_id, group_link, group_titles in fallback_rows:
+                if budget <= 0:
+                    break
+                # 本轮第一条记录总是刷新完整（群链接多于预算时也能推进）
+                first = budget == GROUP_TITLE_REFRESH_BUDGET
+                try:
+                    old_titles = json.loads(group_titles) if group_titles else {}
+                except Exception:
+                    old_titles = {}
+                titles = {}
+                complete = True
+                for link in group_link.split('\n'):
+                    link = link.strip()
+                    if not link:
+                        continue
+                    if budget > 0 or first or _is_private_group_link(link):
+                        title = await fetch_title(link)
+                    else:
+                        title = None
+                        complete = False
+                    # 获取失败 / 未刷新时保留旧群名
+                    if title or old_titles.get(link):
+                        titles[link] = title or old_titles[link]
+                # 预算中途用完时不更新刷新时间，下一轮继续（未刷新的群不会被当作已刷新）
+                save_fallback_group_titles(row_id, titles, stamp=complete)
+                if titles != old_titles:
+                    required_groups_cache.invalidate_all()
+
+            for row_id, owner_id, group_link, old_title in member_rows:
+                if budget <= 0:
+                    break
+                link = group_link.split('\n')[0].strip()
+                title = await fetch_title(link) if link else None
+                save_member_group_title(row_id, title)
+                if title and title != old_title:
+                    required_groups_cache.invalidate_upline(owner_id)
+
+            refreshed = GROUP_TITLE_REFRESH_BUDGET - budget
+            if refreshed:
+                print(f"[群名缓存] 本轮刷新 {refreshed} 个群名")
         except Exception as e:
-            print(f"[轮询检测] 异常: {e}")
-            await asyncio.sleep(10)
+            print(f"[群名缓存] 刷新异常: {e}")
 
 
 async def check_permission_changes():
@@ -4902,16 +4220,7 @@ async def check_permission_changes():
         for uid, gid in rows:
             if not gid:
                 continue
-            target_bot = None
-            for client in clients:
-                try:
-                    me = await client.get_me()
-                    if me.id == uid:
-                        target_bot = client
-                        break
-                except BaseException:
-                    continue
-            
+            target_bot = bot_registry.get_client(uid)
             if not target_bot:
                 continue
             
@@ -4931,59 +4240,172 @@ async def check_permission_changes():
                         'UPDATE members SET is_bot_admin = 0 WHERE telegram_id = ?', (uid,))
                     conn.commit()
                     conn.close()
+                    required_groups_cache.invalidate_upline(uid)
             except BaseException:
                 pass
     except Exception as e:
         print(f"[权限检查] 错误: {e}")
 
 
-def run_bot():
-    """Bot 启动入口"""
+# ==================== 机器人启动与重连 ====================
+
+# 重试间隔从 BOT_RETRY_MIN_DELAY 开始逐次翻倍，最多 BOT_RETRY_MAX_DELAY
+BOT_RETRY_MIN_DELAY = 5
+# Token 本身无效，重试没有意义
+_PERMANENT_LOGIN_ERRORS = (errors.AccessTokenInvalidError, errors.AccessTokenExpiredError)
+
+
+async def _start_bot(db_id, token):
+    """连接并登录单个机器人，成功后立即开始处理消息"""
+    global bot
+    session_path = os.path.join(SESSION_DIR, f'bot_{db_id}')
+    client = telegram_client_class()(session_path, API_ID, API_HASH, proxy=proxy,
+                                     receive_updates=_receive_updates)
+    # 登录前挂载处理器，连上后收到的第一条更新就能处理
+    if _receive_updates:
+        for handler, event_builder in registered_handlers:
+            client.add_event_handler(handler, event_builder)
+    try:
+        await asyncio.wait_for(client.start(bot_token=token), BOT_START_TIMEOUT)
+        await asyncio.wait_for(bot_registry.register(client), BOT_START_TIMEOUT)
+    except BaseException:
+        try:
+            await client.disconnect()
+        except Exception:
+            pass
+        raise
+    clients.append(client)
+    if bot is None:
+        bot = client
+    return client
+
+
+def _detach_bot(client):
+    """机器人断线后从在线列表移除"""
+    global bot
+    if client in clients:
+        clients.remove(client)
+    bot_registry.unregister(client)
+    if bot is client:
+        bot = clients[0] if clients else None
+
+
+async def _supervise_bot(db_id, token, semaphore, first_attempt=None):
+    """
+    单个机器人的守护任务：启动失败或断线后在后台按退避间隔重试，不影响其他机器人
+    first_attempt: 首次尝试结束时写入 (是否成功, 说明) 的 Future
+    """
+    delay = BOT_RETRY_MIN_DELAY
+    while True:
+        client = None
+        async with semaphore:
+            print(f"[机器人初始化] 正在启动 Bot ID {db_id} (Session: bot_{db_id})...")
+            try:
+                client = await _start_bot(db_id, token)
+                print(f"[机器人初始化] ✅ 成功启动: {token[:10]}... (当前在线 {len(clients)} 个)")
+                result = (True, "启动成功")
+            except _PERMANENT_LOGIN_ERRORS as e:
+                print(f"[机器人初始化] ❌ Token 无效，停止重试 (ID: {db_id}): {e}")
+                result = (False, str(e))
+                delay = None
+            except asyncio.TimeoutError:
+                print(f"[机器人初始化] ⚠️ 启动超时 (ID: {db_id})，{delay}秒后重试")
+                result = (False, "启动超时")
+            except Exception as e:
+                print(f"[机器人初始化] ⚠️ 启动失败 (ID: {db_id}): {e}，{delay}秒后重试")
+                result = (False, str(e))
+        if first_attempt is not None and not first_attempt.done():
+            first_attempt.set_result(result)
+        if delay is None:
+            _bot_supervisors.pop(db_id, None)
+            return
+        if client is None:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BOT_RETRY_MAX_DELAY)
+            continue
+
+        delay = BOT_RETRY_MIN_DELAY
+        # Telethon 会自动重连，这里只在彻底断开后重新登录
+        try:
+            await client.disconnected
+        except Exception as e:
+            print(f"[机器人初始化] ⚠️ Bot ID {db_id} 连接中断: {e}")
+        _detach_bot(client)
+        print(f"[机器人初始化] 🔄 Bot ID {db_id} 已断开，{delay}秒后重新连接")
+        await asyncio.sleep(delay)
+
+
+_start_semaphore = None
+
+
+def _launch_bot(db_id, token):
+    """为机器人创建守护任务（已在运行则忽略），返回首次尝试结果的 Future"""
+    global _start_semaphore
+    if _start_semaphore is None:
+        _start_semaphore = asyncio.Semaphore(max(1, BOT_START_CONCURRENCY))
+    first_attempt = asyncio.get_event_loop().create_future()
+    if db_id in _bot_supervisors and not _bot_supervisors[db_id].done():
+        first_attempt.set_result((True, "已在运行"))
+        return first_attempt
+    _bot_supervisors[db_id] = asyncio.ensure_future(
+        _supervise_bot(db_id, token, _start_semaphore, first_attempt))
+    return first_attempt
+
+
+def run_bot(handle_updates=True, run_workers=True):
+    """
+    Bot 启动入口
+    handle_updates: 接收并处理用户消息（机器人进程）
+    run_workers: 运行所有基于数据库的后台任务：定时群发、群发队列、置顶公告、通知发件箱、
+                 会员私信群发、后台操作（充值 / 手动开通VIP）、群组检测、群名刷新、启动同步
+    两者都为 False 的进程没有意义；分进程部署时 bot 与 worker 角色必须同时运行（见 run.py）
+    """
+    global _receive_updates
     print("🚀 Telegram Bots (Multi) 启动中...")
 
-    if not clients:
-        print("❌ 没有活跃的机器人客户端，跳过Bot启动")
+    active_tokens[:] = load_bot_tokens()
+    if not active_tokens:
+        print("❌ 没有活跃的机器人配置，跳过Bot启动")
         print("💡 请在Web后台的机器人设置中添加并启用机器人")
         return
 
     try:
+        os.makedirs(SESSION_DIR, exist_ok=True)
+        _receive_updates = handle_updates
         # 启动后台任务
         loop = asyncio.get_event_loop()
-        loop.create_task(process_notify_queue())
-        loop.create_task(auto_broadcast_timer())
-        loop.create_task(check_member_status_task())
-        loop.create_task(process_broadcast_queue())
-        loop.create_task(process_broadcasts())
-
-        async def _process_recharge_queue_worker():
-            while True:
-                try:
-                    if process_recharge_queue:
-                        item = process_recharge_queue.pop(0)
-                        await process_recharge(item.get('member_id'), item.get('amount'), item.get('is_vip_order'))
-                except Exception as e:
-                    print(f"[充值队列] 处理失败: {e}")
-                await asyncio.sleep(1)
-
-        loop.create_task(_process_recharge_queue_worker())
-
-        # 在机器人启动后同步会员群组数据 (延迟执行，确保连接完成)
+        # 所有机器人并发登录，各自连上后立即开始处理消息
+        startup_attempts = [_launch_bot(db_id, token) for db_id, token in active_tokens]
+        # 后台新增的机器人：每个运行机器人的进程都要启动（收消息 / 发送）
+        loop.create_task(watch_bot_configs())
+        if run_workers:
+            # 基于数据库租约的消费者都在 worker 角色运行
+            loop.create_task(auto_broadcast_timer())
+            loop.create_task(check_member_status_task())
+            loop.create_task(process_broadcast_queue())
+            loop.create_task(process_pinned_campaigns())
+            loop.create_task(process_notify_queue())
+            loop.create_task(process_dm_campaigns())
+            loop.create_task(process_bot_actions())
+            loop.create_task(refresh_group_titles_task())
+
+        # 在首轮启动结束后同步会员群组数据
         async def sync_after_start():
-            global clients  # 声明全局变量
             try:
-                # 等待一段时间，确保机器人完全连接
-                await asyncio.sleep(10)
+                # 等待每个机器人都完成首次登录尝试（失败的在后台继续重试）
+                await asyncio.gather(*startup_attempts)
+                print(f"[机器人初始化] 🎉 首轮启动完成，{len(clients)}/{len(active_tokens)} 个机器人在线")
                 print("🔄 同步会员群组数据...")
 
                 # 检查机器人连接状态 (机器人API兼容的检查)
                 connected_clients = []
                 for i, client in enumerate(clients):
                     try:
-                        # 机器人只能使用允许的API方法：get_me()
-                        me = await client.get_me()
-                        if me and me.id:
+                        # 未登记的机器人在此补登记
+                        bot_id = await bot_registry.resolve_id(client)
+                        if bot_id and client.is_connected():
                             connected_clients.append(client)
-                            print(f"✅ 机器人 {i+1} 连接正常 (ID: {me.id})")
+                            print(f"✅ 机器人 {i+1} 连接正常 (ID: {bot_id})")
                         else:
                             print(f"⚠️ 机器人 {i+1} 无法获取机器人信息")
                     except Exception as e:
@@ -5010,39 +4432,15 @@ def run_bot():
                 import traceback
                 traceback.print_exc()
 
-        loop.create_task(sync_after_start())
+        if run_workers:
+            loop.create_task(sync_after_start())
 
         print("✅ 所有后台任务已挂载")
-        print(f"✅ {len(clients)} 个机器人正在监听消息...")
+        print(f"🔄 正在连接 {len(active_tokens)} 个机器人 (并发 {BOT_START_CONCURRENCY})...")
 
-        # 所有机器人共享同一个事件循环并发运行
-        print("🔄 正在连接到Telegram服务器...")
-
-        async def run_all_bots():
-            """运行所有机器人直到断开"""
-            try:
-                # 客户端已经在初始化时启动了，这里只需要等待断开
-                print("🔄 所有机器人正在运行，等待消息...")
-
-                # 等待任一客户端断开
-                disconnect_futures = [
-                    client.disconnected for client in clients]
-                done, pending = await asyncio.wait(disconnect_futures, return_when=asyncio.FIRST_COMPLETED)
-
-                print("🛑 一个或多个机器人已断开连接，正在停止其他机器人...")
-                # 取消其他待处理的 Future
-                for future in pending:
-                    if not future.done():
-                        future.cancel()
-
-            except Exception as e:
-                print(f"❌ 多机器人运行失败: {e}")
-                import traceback
-                traceback.print_exc()
-
-        # 运行所有机器人
+        # 机器人断线由各自的守护任务重连，事件循环一直运行
         try:
-            loop.run_until_complete(run_all_bots())
+            loop.run_forever()
         except KeyboardInterrupt:
             print("🛑 收到停止信号，正在关闭机器人...")
         except Exception as e:
@@ -5058,39 +4456,22 @@ def run_bot():
 
 
 async def add_bot_dynamically(db_id, token):
-    try:
-        session_name = f'bot_{db_id}'
-        session_path = os.path.join(SESSION_DIR, session_name)
-        print(f"[动态添加] 正在启动 Bot ID {db_id} (Session: {session_name})...")
-
-        client = TelegramClient(session_path, API_ID, API_HASH, proxy=proxy)
-        await client.start(bot_token=token)
-
-        for handler, event_builder in registered_handlers:
-            client.add_event_handler(handler, event_builder)
-
-        clients.append(client)
-        global bot
-        if bot is None:
-            bot = client
-
-        print(f"[动态添加] ✅ 启动成功: {token[:10]}...")
-        return True, "启动成功"
-    except Exception as e:
-        print(f"[动态添加] ❌ 启动失败 (ID: {db_id}): {e}")
-        return False, str(e)
+    """后台新增机器人：启动守护任务并等待首次登录结果（失败会在后台继续重试）"""
+    return await _launch_bot(db_id, token)
 
 
 # 导出
 __all__ = [
     'bot', 'clients', 'process_vip_upgrade', 'process_recharge',
     'admin_manual_vip_handler', 'get_main_account_id', 'run_bot',
-    'pending_broadcasts', 'notify_queue',
-    'add_bot_dynamically',
+    'add_bot_dynamically', 'bot_registry', 'send_dispatcher',
     # 后台任务（供调试使用）
     'auto_broadcast_timer',
     'process_broadcast_queue',
-    'process_broadcasts',
+    'process_pinned_campaigns',
+    'process_bot_actions',
     'check_member_status_task',
-    'process_notify_queue'
+    'process_notify_queue',
+    'process_dm_campaigns',
+    'refresh_group_titles_task'
 ]
@@ -0,0 +1,73 @@
+"""
+机器人身份注册表 - 统一管理所有机器人客户端的 ID / 用户名
+每个客户端只在启动（或动态添加）时调用一次 get_me()，之后所有身份查询都走内存 O(1) 查找
+"""
+
+
+class BotRegistry:
+    """机器人身份注册表：bot_id <-> client 双向映射"""
+
+    def __init__(self):
+        self._clients = {}     # bot_id -> client
+        self._identities = {}  # id(client) -> (bot_id, username)
+
+    async def register(self, client):
+        """解析并登记客户端身份（全项目唯一调用 get_me() 的地方）"""
+        me = await client.get_me()
+        if not me:
+            return None
+        old = self._identities.get(id(client))
+        if old and old[0] != me.id:
+            self._clients.pop(old[0], None)
+        self._clients[me.id] = client
+        self._identities[id(client)] = (me.id, me.username)
+        print(f'[机器人注册] ✅ 登记机器人 @{me.username} (ID: {me.id})')
+        return me.id
+
+    def unregister(self, client):
+        """移除客户端身份"""
+        identity = self._identities.pop(id(client), None)
+        if identity:
+            self._clients.pop(identity[0], None)
+
+    async def resolve_id(self, client):
+        """获取客户端的 bot_id，未登记时登记一次"""
+        identity = self._identities.get(id(client))
+        if identity:
+            return identity[0]
+        return await self.register(client)
+
+    async def resolve_username(self, client):
+        """获取客户端的用户名，未登记时登记一次"""
+        identity = self._identities.get(id(client))
+        if not identity:
+            await self.register(client)
+            identity = self._identities.get(id(client))
+        return identity[1] if identity else None
+
+    def get_id(self, client):
+        identity = self._identities.get(id(client))
+        return identity[0] if identity else None
+
+    def get_username(self, client):
+        identity = self._identities.get(id(client))
+        return identity[1] if identity else None
+
+    def get_client(self, bot_id):
+        """根据 bot_id 获取客户端，不是我们的机器人返回 None"""
+        if bot_id is None:
+            return None
+        try:
+            return self._clients.get(int(bot_id))
+        except (TypeError, ValueError):
+            return None
+
+    def is_our_bot(self, user_id):
+        return self.get_client(user_id) is not None
+
+    def bot_ids(self):
+        return list(self._clients.keys())
+
+
+# 全局注册表实例
+bot_registry = BotRegistry()
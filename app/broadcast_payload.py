@@ -0,0 +1,171 @@
+"""
+群发内容编译缓存 - 每条群发消息的每个版本只解析一次
+1. broadcast_queue 记录只保存 message_id + message_version，不再复制整段内容
+2. 首次发送某个版本时读取 broadcast_messages，编译为不可变的 CompiledPayload：
+   去掉 Markdown 后的文本与 entities、本地媒体路径、按钮 ReplyInlineMarkup
+3. 之后每次发送只按主键读取消息当前版本号：与缓存的版本一致时直接复用，不再解析 JSON、Markdown，
+   也不再重建按钮；入队后消息被修改时发送最新内容（队列记录中的版本号只是入队时的版本）
+4. 旧记录（message 字段保存 JSON / 纯文本）仍可发送，按原文缓存编译结果
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from telethon import Button, TelegramClient
+from telethon.extensions import markdown
+
+from .database import get_db_conn
+from .config import UPLOAD_DIR, BASE_DIR
+
+# 最多缓存的编译结果数
+MAX_PAYLOADS = 256
+DEFAULT_BUTTONS_PER_ROW = 2
+
+
+class CompiledPayload:
+    """编译后的群发内容（只读）"""
+
+    __slots__ = ('text', 'entities', 'media_path', 'markup')
+
+    def __init__(self, text, entities, media_path, markup):
+        object.__setattr__(self, 'text', text)
+        object.__setattr__(self, 'entities', entities)
+        object.__setattr__(self, 'media_path', media_path)  # 本地图片 / 视频路径
+        object.__setattr__(self, 'markup', markup)          # 只有纯文本消息带按钮
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompiledPayload 不可修改')
+
+
+def _local_media_path(url):
+    """/static/uploads/xxx -> 本地文件路径（不存在返回 None）"""
+    local_path = os.path.join(UPLOAD_DIR, os.path.basename(url))
+    if os.path.exists(local_path):
+        return local_path
+    local_path = os.path.join(BASE_DIR, url.lstrip('/'))
+    return local_path if os.path.exists(local_path) else None
+
+
+def _build_markup(buttons_json, per_row):
+    if not buttons_json:
+        return None
+    try:
+        buttons = json.loads(buttons_json)
+        per_row = int(per_row or DEFAULT_BUTTONS_PER_ROW)
+    except (TypeError, ValueError):
+        return None
+    rows, row = [], []
+    for b in buttons if isinstance(buttons, list) else []:
+        if isinstance(b, dict) and b.get('name') and b.get('url'):
+            row.append(Button.url(b['name'], b['url']))
+            if len(row) >= per_row:
+                rows.append(row)
+                row = []
+    if row:
+        rows.append(row)
+    return TelegramClient.build_reply_markup(rows) if rows else None
+
+
+def compile_payload(content, image_url='', video_url='', buttons='', buttons_per_row=None):
+    """
+    与原先逐条发送时的规则一致：
+    - 图片优先于视频；本地上传的文件作为媒体发送（文字为说明），找不到本地文件或外链时把链接附在文字后
+    - 只有纯文本消息附带按钮
+    """
+    text = content or ''
+    media_path = None
+    markup = None
+    media_url = image_url or video_url
+    if media_url:
+        if media_url.startswith('/static/uploads/'):
+            media_path = _local_media_path(media_url)
+            if not media_path:
+                print(f'[群发错误] 找不到本地媒体文件: {media_url}')
+        if not media_path:
+            text = text + '\n' + media_url
+    else:
+        markup = _build_markup(buttons, buttons_per_row)
+    text, entities = markdown.parse(text)
+    return CompiledPayload(text, entities, media_path, markup)
+
+
+class PayloadCache:
+    """(message_id, 当前版本) / 原始 JSON -> CompiledPayload，LRU"""
+
+    def __init__(self, max_entries=MAX_PAYLOADS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'compiled': 0}
+
+    def _get(self, key):
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.stats['hits'] += 1
+            return payload
+
+    def _put(self, keys, payload):
+        with self._lock:
+            for key in keys:
+                self._entries[key] = payload
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.stats['compiled'] += 1
+
+    def for_message(self, message_id, version=None):
+        """
+        按群发消息ID取最新版本的编译结果；消息已删除返回 None
+        version 为入队时的版本，不参与查找：总是发送消息当前的内容
+        """
+        conn = get_db_conn()
+        try:
+            row = conn.execute('SELECT version FROM broadcast_messages WHERE id = ?',
+                               (message_id,)).fetchone()
+            if not row:
+                return None
+            key = (message_id, row[0])
+            payload = self._get(key)
+            if payload is not None:
+                return payload
+            row = conn.execute(
+                'SELECT content, image_url, video_url, buttons, buttons_per_row, version '
+                'FROM broadcast_messages WHERE id = ?', (message_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        payload = compile_payload(*row[:5])
+        self._put([(message_id, row[5])], payload)
+        return payload
+
+    def for_raw(self, message):
+        """旧格式记录：message 为 JSON（content/image_url/video_url/buttons）或纯文本"""
+        key = ('raw', message)
+        payload = self._get(key)
+        if payload is not None:
+            return payload
+        try:
+            parsed = json.loads(message)
+        except (TypeError, ValueError):
+            parsed = message
+        if isinstance(parsed, dict):
+            payload = compile_payload(
+                parsed.get('content') or '', parsed.get('image_url') or '',
+                parsed.get('video_url') or '', parsed.get('buttons') or '',
+                parsed.get('buttons_per_row'))
+        else:
+            payload = compile_payload(str(parsed if parsed is not None else ''))
+        self._put([key], payload)
+        return payload
+
+    def for_row(self, message, message_id=None, version=None):
+        if message_id:
+            return self.for_message(message_id, version)
+        return self.for_raw(message)
+
+
+broadcast_payloads = PayloadCache()
@@ -0,0 +1,182 @@
+"""
+群发队列消费 - broadcast_queue 表（定时群发 / 后台立即发送写入）的租约式多协程消费
+1. 领取：BEGIN IMMEDIATE 事务内选出待发送记录（以及租约已过期的记录），
+   标记 status='sending'、claimed_by=本进程、lease_until=到期时间，多个进程不会领到同一条
+2. 分片：按群链接哈希分给 N 个发送协程，同一个群的消息按顺序发送，不同群并发
+3. 发送前续租并确认记录仍属于本进程，租约已被其他进程接管则跳过，避免重复发送
+4. 进程退出 / 卡死时租约到期，记录被其他进程（或重启后的本进程）重新领取；
+   领取次数超过 MAX_ATTEMPTS 的记录直接标记失败
+"""
+import asyncio
+import os
+import socket
+import time
+import uuid
+
+from .database import get_db_conn
+
+# 租约时长（秒）：需覆盖单条消息排队限速 + FloodWait 等待
+LEASE_SECONDS = 300
+# 没有待发送记录时的轮询间隔（秒）
+POLL_INTERVAL = 2
+# 每个发送协程最多预先领取的记录数
+PREFETCH_PER_WORKER = 5
+# 同一条记录最多被领取的次数（租约反复过期说明发送时进程崩溃）
+MAX_ATTEMPTS = 3
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+
+def make_worker_id():
+    return f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}'
+
+
+class BroadcastQueueConsumer:
+    """领取 broadcast_queue 记录并分发给按群分片的发送协程"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self._shards = []
+        self._loop = None
+        self._wake = None
+        self.stats = {'claimed': 0, 'sent': 0, 'failed': 0, 'lease_lost': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self, send, workers=4):
+        """
+        send: async send(group_link, group_name, message, message_id, message_version) -> (status, result)
+        status 为 'sent' / 'failed'；抛出异常视为 failed
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._shards = [asyncio.Queue() for _ in range(max(1, workers))]
+        for shard in self._shards:
+            asyncio.create_task(self._worker(shard, send))
+        print(f'[群发队列] 已启动 {len(self._shards)} 个发送协程（{self.worker_id}）')
+
+        while True:
+            claimed = 0
+            try:
+                capacity = len(self._shards) * PREFETCH_PER_WORKER - self._backlog()
+                if capacity > 0:
+                    claimed = self._claim_and_dispatch(capacity)
+            except Exception as e:
+                print(f'[群发队列] 领取失败: {e}')
+            if claimed:
+                await asyncio.sleep(0)
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _backlog(self):
+        return sum(shard.qsize() for shard in self._shards)
+
+    def _claim_and_dispatch(self, limit):
+        rows = self._claim(limit)
+        for row in rows:
+            group_link = row[1] or ''
+            self._shards[hash(group_link) % len(self._shards)].put_nowait(row)
+        self.stats['claimed'] += len(rows)
+        return len(rows)
+
+    async def _worker(self, shard, send):
+        while True:
+            task_id, group_link, group_name, message, message_id, message_version = await shard.get()
+            try:
+                if not self._renew(task_id):
+                    self.stats['lease_lost'] += 1
+                    continue
+                try:
+                    status, result = await send(group_link, group_name, message, message_id, message_version)
+                except Exception as e:
+                    status, result = STATUS_FAILED, str(e)[:200]
+                    print(f'[群发队列] 发送到 {group_name} 失败: {e}')
+                self._finish(task_id, status, result)
+                self.stats['sent' if status == STATUS_SENT else 'failed'] += 1
+            except Exception as e:
+                print(f'[群发队列] 处理 #{task_id} 出错: {e}')
+            finally:
+                if shard.empty():
+                    self._wake.set()  # 有空闲发送协程，立即领取下一批
+
+    # ---------- 租约 ----------
+
+    def _claim(self, limit):
+        """原子领取最多 limit 条：待发送，或租约已过期的发送中记录"""
+        now = time.time()
+        conn = get_db_conn()
+        try:
+            conn.isolation_level = None
+            c = conn.cursor()
+            c.execute('BEGIN IMMEDIATE')
+            try:
+                # 反复过期的记录不再领取
+                c.execute(
+                    'UPDATE broadcast_queue SET status = ?, result = ?, lease_until = NULL '
+                    'WHERE status = ? AND lease_until < ? AND attempts >= ?',
+                    (STATUS_FAILED, '多次领取后仍未完成', STATUS_SENDING, now, MAX_ATTEMPTS))
+                c.execute(
+                    'SELECT id, group_link, group_name, message, message_id, message_version FROM broadcast_queue '
+                    'WHERE status = ? OR (status = ? AND lease_until < ?) '
+                    'ORDER BY id LIMIT ?',
+                    (STATUS_PENDING, STATUS_SENDING, now, limit))
+                rows = c.fetchall()
+                if rows:
+                    placeholders = ','.join('?' for _ in rows)
+                    c.execute(
+                        f'UPDATE broadcast_queue SET status = ?, claimed_by = ?, lease_until = ?, '
+                        f'attempts = COALESCE(attempts, 0) + 1 WHERE id IN ({placeholders})',
+                        [STATUS_SENDING, self.worker_id, now + LEASE_SECONDS] + [row[0] for row in rows])
+                c.execute('COMMIT')
+            except Exception:
+                c.execute('ROLLBACK')
+                raise
+            return rows
+        finally:
+            conn.close()
+
+    def _renew(self, task_id):
+        """发送前续租；记录已不属于本进程返回 False"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute(
+                'UPDATE broadcast_queue SET lease_until = ? '
+                'WHERE id = ? AND claimed_by = ? AND status = ?',
+                (time.time() + LEASE_SECONDS, task_id, self.worker_id, STATUS_SENDING))
+            conn.commit()
+            return c.rowcount == 1
+        finally:
+            conn.close()
+
+    def _finish(self, task_id, status, result):
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'UPDATE broadcast_queue SET status = ?, result = ?, lease_until = NULL '
+                'WHERE id = ? AND claimed_by = ?',
+                (status, result, task_id, self.worker_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+broadcast_queue_consumer = BroadcastQueueConsumer()
@@ -0,0 +1,172 @@
+"""
+定时群发调度 - 按 broadcast_assignments.next_due_at 把到期的分配写入 broadcast_queue
+1. 启用中的分配（分配 / 消息 / 群三者都启用）的 (next_due_at, id) 放在内存最小堆里
+2. 只在最早到期时间醒来，醒来后只处理已到期的分配，不再每 10 秒扫描全部分配
+3. 后台修改分配 / 群发内容时递增版本号并唤醒调度器，重新加载堆
+   （Web 与机器人不在同一进程时，每 VERSION_CHECK_INTERVAL 秒检测一次版本号）
+"""
+import asyncio
+import heapq
+import time
+
+from .database import get_db_conn, get_cn_time, get_cache_version
+from .broadcast_queue import broadcast_queue_consumer
+
+CACHE_NAME = 'broadcast_schedule'
+# 跨进程版本号检查间隔（秒），也是调度器最长的睡眠时间
+VERSION_CHECK_INTERVAL = 5
+# 到期分配按批查询（SQLite 参数个数限制）
+FIRE_BATCH = 500
+DEFAULT_INTERVAL_MINUTES = 120
+
+_ACTIVE_JOIN = '''
+    FROM broadcast_assignments ba
+    JOIN broadcast_messages bm ON ba.message_id = bm.id
+    JOIN member_groups mg ON ba.group_id = mg.id
+    WHERE ba.is_active = 1 AND bm.is_active = 1 AND mg.schedule_broadcast = 1
+'''
+
+
+class BroadcastScheduler:
+    """最小堆 (next_due_at, assignment_id)，删除采用惰性方式（以 _due 中的时间为准）"""
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}        # assignment_id -> next_due_at
+        self._version = None
+        self._loop = None
+        self._wake = None
+        self.stats = {'fired': 0, 'reloads': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self):
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            timeout = VERSION_CHECK_INTERVAL
+            try:
+                self._sync_version()
+                now = time.time()
+                if self._heap and self._heap[0][0] <= now:
+                    if self._broadcast_enabled():
+                        self._fire(self._pop_due(now))
+                        continue
+                elif self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+            except Exception as e:
+                print(f'[定时群发] 错误: {e}')
+                self._version = None  # 下次从数据库重新加载，避免丢失已弹出的分配
+                timeout = 30
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    # ---------- 堆 ----------
+
+    def _push(self, assign_id, due_at):
+        self._due[assign_id] = due_at
+        heapq.heappush(self._heap, (due_at, assign_id))
+
+    def _pop_due(self, now):
+        ids = []
+        while self._heap and self._heap[0][0] <= now:
+            due_at, assign_id = heapq.heappop(self._heap)
+            if self._due.get(assign_id) == due_at:
+                del self._due[assign_id]
+                ids.append(assign_id)
+        return ids
+
+    def _reload(self):
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(f'SELECT ba.id, ba.next_due_at {_ACTIVE_JOIN}').fetchall()
+        finally:
+            conn.close()
+        self._due = {assign_id: next_due_at or 0 for assign_id, next_due_at in rows}
+        self._heap = [(due_at, assign_id) for assign_id, due_at in self._due.items()]
+        heapq.heapify(self._heap)
+        self.stats['reloads'] += 1
+
+    def _sync_version(self):
+        version = get_cache_version(CACHE_NAME)
+        if self._version is None or version != self._version:
+            self._version = version
+            self._reload()
+
+    @staticmethod
+    def _broadcast_enabled():
+        """全局开关：允许管理员关闭定时分发"""
+        conn = get_db_conn()
+        try:
+            row = conn.execute(
+                "SELECT value FROM system_config WHERE key = 'broadcast_enabled'").fetchone()
+        finally:
+            conn.close()
+        return row[0] == '1' if row else True
+
+    # ---------- 到期处理 ----------
+
+    def _fire(self, assign_ids):
+        """把到期分配写入 broadcast_queue，并按各自间隔计算下次到期时间"""
+        if not assign_ids:
+            return
+        now_ts = int(time.time())
+        now_iso = get_cn_time()
+        enqueued = 0
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            for start in range(0, len(assign_ids), FIRE_BATCH):
+                batch = assign_ids[start:start + FIRE_BATCH]
+                placeholders = ','.join('?' for _ in batch)
+                c.execute(f'''
+                    SELECT ba.id, mg.group_link, mg.group_name,
+                           ba.message_id, bm.version, bm.broadcast_interval
+                    {_ACTIVE_JOIN} AND ba.id IN ({placeholders})
+                    ORDER BY bm.create_time ASC, bm.id ASC
+                ''', batch)
+                for (assign_id, group_link, group_name, message_id, version,
+                     interval) in c.fetchall():
+                    try:
+                        interval_minutes = int(interval) if interval else DEFAULT_INTERVAL_MINUTES
+                    except (TypeError, ValueError):
+                        interval_minutes = DEFAULT_INTERVAL_MINUTES
+                    next_due_at = now_ts + interval_minutes * 60
+                    try:
+                        # 只引用消息ID和版本，内容由发送端按版本编译一次后复用
+                        c.execute(
+                            'INSERT INTO broadcast_queue '
+                            '(group_link, group_name, message_id, message_version, status, create_time) '
+                            'VALUES (?, ?, ?, ?, ?, ?)',
+                            (group_link, group_name, message_id, version or 1, 'pending', now_iso))
+                        c.execute(
+                            'UPDATE broadcast_assignments SET last_sent_time = ?, next_due_at = ? WHERE id = ?',
+                            (now_iso, next_due_at, assign_id))
+                        enqueued += 1
+                    except Exception as e:
+                        print(f'[定时群发] 入队失败 assign_id={assign_id}: {e}')
+                    self._push(assign_id, next_due_at)
+            conn.commit()
+        finally:
+            conn.close()
+        self.stats['fired'] += enqueued
+        if enqueued:
+            print(f'[定时群发] 已入队 {enqueued} 条消息')
+            broadcast_queue_consumer.wake()
+
+
+broadcast_scheduler = BroadcastScheduler()
@@ -87,3 +87,57 @@ PROXY_PORT = int(os.getenv('PROXY_PORT') or _env_config.get('PROXY_PORT', '7897'
 # - https://your-domain.com
 PUBLIC_BASE_URL = (os.getenv('PUBLIC_BASE_URL') or _env_config.get('PUBLIC_BASE_URL', '')).rstrip('/')
 
+
+# ==================== 群组健康检测配置 ====================
+# 每个机器人每分钟最多用于群组检测的 API 次数
+HEALTH_CHECK_BUDGET_PER_BOT = int(os.getenv('HEALTH_CHECK_BUDGET_PER_BOT') or _env_config.get('HEALTH_CHECK_BUDGET_PER_BOT', '20'))
+# 群组检测间隔（秒）：状态变化后从最小间隔开始，稳定后逐步放宽到最大间隔
+HEALTH_CHECK_MIN_INTERVAL = int(os.getenv('HEALTH_CHECK_MIN_INTERVAL') or _env_config.get('HEALTH_CHECK_MIN_INTERVAL', '60'))
+HEALTH_CHECK_MAX_INTERVAL = int(os.getenv('HEALTH_CHECK_MAX_INTERVAL') or _env_config.get('HEALTH_CHECK_MAX_INTERVAL', '3600'))
+
+
+# ==================== 对话状态配置 ====================
+# 用户输入流程（群链接 / 备用号 / 充值 / 提现 / 管理员设置）的超时时间（秒）
+CONVERSATION_TTL = int(os.getenv('CONVERSATION_TTL') or _env_config.get('CONVERSATION_TTL', '600'))
+# 内存模式下最多保存的对话状态数
+CONVERSATION_MAX_ENTRIES = int(os.getenv('CONVERSATION_MAX_ENTRIES') or _env_config.get('CONVERSATION_MAX_ENTRIES', '10000'))
+# 是否把对话状态写入数据库（重启不丢失，多进程共享）
+CONVERSATION_PERSIST = (os.getenv('CONVERSATION_PERSIST') or _env_config.get('CONVERSATION_PERSIST', 'False')).lower() == 'true'
+
+
+# ==================== 机器人启动配置 ====================
+# 同时进行登录的机器人数量
+BOT_START_CONCURRENCY = int(os.getenv('BOT_START_CONCURRENCY') or _env_config.get('BOT_START_CONCURRENCY', '5'))
+# 单个机器人连接 + 登录的超时时间（秒）
+BOT_START_TIMEOUT = int(os.getenv('BOT_START_TIMEOUT') or _env_config.get('BOT_START_TIMEOUT', '30'))
+# 启动失败 / 断线后的重试间隔上限（秒），从 5 秒开始逐次翻倍
+BOT_RETRY_MAX_DELAY = int(os.getenv('BOT_RETRY_MAX_DELAY') or _env_config.get('BOT_RETRY_MAX_DELAY', '600'))
+
+
+# ==================== 运行指标配置 ====================
+# 是否记录处理器 / 接口 / 数据库 / Telegram 请求耗时，并在 /metrics 输出（Prometheus 文本格式）
+METRICS_ENABLED = (os.getenv('METRICS_ENABLED') or _env_config.get('METRICS_ENABLED', 'False')).lower() == 'true'
+# 访问 /metrics 需要的令牌（?token= 或 Authorization: Bearer）
+# 为空时 Web 端的 /metrics 只对已登录的管理员开放，独立端口（METRICS_PORT）不提供
+METRICS_TOKEN = os.getenv('METRICS_TOKEN') or _env_config.get('METRICS_TOKEN', '')
+# 单独运行 bot / worker 角色时提供 /metrics 的端口，0 表示不提供
+METRICS_PORT = int(os.getenv('METRICS_PORT') or _env_config.get('METRICS_PORT', '0'))
+
+
+# ==================== 通知发件箱配置 ====================
+# 并发投递通知的协程数
+NOTIFY_WORKERS = int(os.getenv('NOTIFY_WORKERS') or _env_config.get('NOTIFY_WORKERS', '4'))
+# 单条通知最多尝试发送的次数
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS') or _env_config.get('NOTIFY_MAX_ATTEMPTS', '5'))
+
+
+# ==================== 群发队列配置 ====================
+# 并发消费 broadcast_queue 的发送协程数（按群分片，同一个群按顺序发送）
+BROADCAST_QUEUE_WORKERS = int(os.getenv('BROADCAST_QUEUE_WORKERS') or _env_config.get('BROADCAST_QUEUE_WORKERS', '4'))
+
+
+# ==================== 会员私信群发配置 ====================
+# 全体会员群发每批读取的会员数（处理完一批保存一次进度）
+DM_CAMPAIGN_CHUNK = int(os.getenv('DM_CAMPAIGN_CHUNK') or _env_config.get('DM_CAMPAIGN_CHUNK', '200'))
+# 每个在线机器人每秒发送的私信数（总速度 = 该值 × 机器人数，仍受 SendRateLimiter 限速）
+DM_CAMPAIGN_RATE_PER_BOT = float(os.getenv('DM_CAMPAIGN_RATE_PER_BOT') or _env_config.get('DM_CAMPAIGN_RATE_PER_BOT', '20'))
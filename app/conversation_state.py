@@ -0,0 +1,177 @@
+"""
+对话状态存储 - 记录用户当前正在进行的输入流程（设置群链接 / 备用号 / 充值 / 提现 / 管理员设置）
+1. 每个用户同一时间只有一个进行中的流程，新流程覆盖旧流程
+2. 每条状态带过期时间，超时未输入自动作废
+3. 内存模式：LRU 上限，超出后淘汰最久未使用的用户
+4. 持久化模式：状态写入 conversation_states 表，重启不丢失，多个进程共享
+5. has_active 查内存，供消息快速过滤使用；持久化模式下维护进行中用户的内存镜像，
+   其他进程开始 / 结束流程时递增版本号，镜像每 VERSION_CHECK_INTERVAL 秒最多检查一次版本号并重新加载
+"""
+import json
+import time
+from collections import OrderedDict
+
+from .database import get_db_conn, get_cache_version, bump_cache_version
+
+# 持久化模式下清理过期记录的写入间隔（次）
+PURGE_EVERY = 200
+# 持久化模式下检查其他进程写入的间隔（秒）
+VERSION_CHECK_INTERVAL = 2
+CACHE_NAME = 'conversation_states'
+
+# 流程名称
+STATE_GROUP_LINK = 'group_link'
+STATE_BACKUP = 'backup'
+STATE_RECHARGE_AMOUNT = 'recharge_amount'
+STATE_WITHDRAW_AMOUNT = 'withdraw_amount'
+STATE_WITHDRAW_ADDRESS = 'withdraw_address'
+ADMIN_STATE_PREFIX = 'admin:'
+
+
+class ConversationStore:
+    """telegram_id -> (state, data, expires_at)"""
+
+    def __init__(self, ttl=600, max_entries=10000, persist=False):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries = OrderedDict()
+        self._writes = 0
+        self._active = None   # 持久化模式：telegram_id -> expires_at（首次使用时从数据库加载）
+        self._version = None
+        self._version_checked = 0
+
+    # ---------- 读取 ----------
+
+    def get(self, telegram_id):
+        """返回 (state, data)，没有进行中的流程返回 (None, None)"""
+        if self.persist:
+            return self._db_get(telegram_id)
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            return None, None
+        state, data, expires_at = entry
+        if expires_at < time.time():
+            del self._entries[telegram_id]
+            return None, None
+        self._entries.move_to_end(telegram_id)
+        return state, data
+
+    def has_active(self, telegram_id):
+        """是否有进行中的流程（不改变 LRU 顺序；持久化模式下只有定期的版本号检查访问数据库）"""
+        if self.persist:
+            self._sync_active()
+            expires_at = self._active.get(telegram_id)
+        else:
+            entry = self._entries.get(telegram_id)
+            expires_at = entry[2] if entry else None
+        return expires_at is not None and expires_at >= time.time()
+
+    # ---------- 写入 ----------
+
+    def set(self, telegram_id, state, data=None, ttl=None):
+        expires_at = time.time() + (ttl or self.ttl)
+        if self.persist:
+            self._db_set(telegram_id, state, data, expires_at)
+            return
+        self._entries[telegram_id] = (state, data, expires_at)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def pop(self, telegram_id, state=None):
+        """
+        结束流程并返回其数据
+        state: 只有当前流程是该状态时才结束（None 表示不论什么流程）
+        """
+        current, data = self.get(telegram_id)
+        if current is None or (state is not None and current != state):
+            return None
+        if self.persist:
+            self._db_delete(telegram_id)
+        else:
+            self._entries.pop(telegram_id, None)
+        return data
+
+    def clear(self, telegram_id):
+        self.pop(telegram_id)
+
+    # ---------- 持久化 ----------
+
+    def _sync_active(self):
+        now = time.time()
+        if self._active is not None and now - self._version_checked < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        try:
+            version = get_cache_version(CACHE_NAME)
+        except Exception:
+            if self._active is None:
+                self._active = {}
+            return
+        if self._active is None or version != self._version:
+            self._load_active()
+            self._version = version
+
+    def _bump(self):
+        """本进程写入后递增版本号；期间其他进程也有写入时下次检查重新加载"""
+        try:
+            version = bump_cache_version(CACHE_NAME)
+        except Exception as e:
+            print(f'[对话状态] 更新版本号失败: {e}')
+            return
+        if self._version is not None and version == self._version + 1:
+            self._version = version
+
+    def _load_active(self):
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(
+                'SELECT telegram_id, expires_at FROM conversation_states WHERE expires_at >= ?',
+                (time.time(),)).fetchall()
+        finally:
+            conn.close()
+        self._active = dict(rows)
+
+    def _db_get(self, telegram_id):
+        conn = get_db_conn()
+        try:
+            row = conn.execute(
+                'SELECT state, data, expires_at FROM conversation_states WHERE telegram_id = ?',
+                (telegram_id,)).fetchone()
+        finally:
+            conn.close()
+        if not row or row[2] < time.time():
+            return None, None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def _db_set(self, telegram_id, state, data, expires_at):
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO conversation_states (telegram_id, state, data, expires_at) '
+                'VALUES (?, ?, ?, ?)',
+                (telegram_id, state, json.dumps(data) if data is not None else None, expires_at))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                conn.execute('DELETE FROM conversation_states WHERE expires_at < ?', (time.time(),))
+            conn.commit()
+        finally:
+            conn.close()
+        if self._active is not None:
+            self._active[telegram_id] = expires_at
+            if self._writes % PURGE_EVERY == 0:
+                now = time.time()
+                self._active = {k: v for k, v in self._active.items() if v >= now}
+        self._bump()
+
+    def _db_delete(self, telegram_id):
+        conn = get_db_conn()
+        try:
+            conn.execute('DELETE FROM conversation_states WHERE telegram_id = ?', (telegram_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        if self._active is not None:
+            self._active.pop(telegram_id, None)
+        self._bump()
@@ -2,18 +2,25 @@
 核心功能模块
 包含群组检测、层级计算、分红分配等核心逻辑
 """
+import asyncio
 import sqlite3
 import os
 import sys
 from datetime import datetime, timedelta, timezone
 from telethon import TelegramClient
 from telethon.tl.functions.channels import GetParticipantRequest
-from telethon.tl.types import ChannelParticipantAdmin, ChannelParticipantCreator
+from telethon.tl.functions.messages import GetFullChatRequest
+from telethon.tl.types import ChannelParticipantAdmin, ChannelParticipantCreator, Chat, ChatForbidden, \
+    ChatParticipantsForbidden, InputPeerChat
 
 # 导入配置
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.insert(0, BASE_DIR)
 from app.config import DB_PATH
+from app.bot_registry import bot_registry
+from app.group_peers import group_peers
+from app.group_affinity import group_affinity
+from app.send_suppression import PeerSuppressedError
 
 # 定义中国时区
 CN_TIMEZONE = timezone(timedelta(hours=8))
@@ -47,6 +54,7 @@ async def verify_group_link(bot, link, clients=None):
                 if isinstance(invite, ChatInviteAlready):
                     # 机器人已经在群里：获取 Chat 对象和 ID
                     chat = invite.chat
+                    group_peers.remember(bot_registry.get_id(bot), chat, link)
                     return {
                         'success': True,
                         'message': '验证成功，机器人已在群内',
@@ -75,6 +83,7 @@ async def verify_group_link(bot, link, clients=None):
         try:
             # 尝试获取实体
             entity = await bot.get_entity(username)
+            group_peers.remember(bot_registry.get_id(bot), entity, link)
             group_id = entity.id
             group_name = getattr(entity, 'title', username)
         except Exception as e:
@@ -193,7 +202,7 @@ async def check_any_bot_in_group(clients, group_link):
 
     for client in clients:
         try:
-            bot_id = (await client.get_me()).id
+            bot_id = await bot_registry.resolve_id(client)
 
             # 首先尝试获取群组实体
             try:
@@ -206,6 +215,7 @@ async def check_any_bot_in_group(clients, group_link):
                 continue
 
             # 实体获取成功，说明机器人至少知道这个群组
+            group_peers.remember(bot_id, group_entity, group_link)
             # 现在尝试获取机器人在群组中的身份
             try:
                 participant = await client(GetParticipantRequest(group_entity, bot_id))
@@ -236,6 +246,164 @@ async def check_any_bot_in_group(clients, group_link):
     return False, None  # 没有机器人加入群组
 
 
+async def check_bot_membership(client, group_target):
+    """
+    使用单个机器人检测自己在群内的身份（供群组健康调度器使用）
+
+    Returns:
+        tuple: (is_in_group, is_admin)
+    Raises:
+        FloodWait / 网络等临时错误原样抛出，由调用方稍后重试
+    """
+    from telethon.errors import BadRequestError, ForbiddenError
+    bot_id = await bot_registry.resolve_id(client)
+    try:
+        entity = await client.get_entity(group_target)
+        group_peers.remember(bot_id, entity, group_target if isinstance(group_target, str) else None)
+        perms = await client.get_permissions(entity, bot_id)
+    except (ValueError, BadRequestError, ForbiddenError):
+        # 群不存在 / 私有群且不在群内 / 不是群成员
+        return False, False
+    return True, bool(perms.is_admin or perms.is_creator)
+
+
+# 每个机器人同时进行的成员检测数量上限
+PARTICIPANT_CHECKS_PER_BOT = 4
+# 单次成员检测超时（秒）
+PARTICIPANT_CHECK_TIMEOUT = 5
+
+_participant_semaphores = {}
+
+
+def _get_participant_semaphore(client):
+    sem = _participant_semaphores.get(id(client))
+    if sem is None:
+        sem = asyncio.Semaphore(PARTICIPANT_CHECKS_PER_BOT)
+        _participant_semaphores[id(client)] = sem
+    return sem
+
+
+def _group_link_target(group_link):
+    """从群链接提取可解析的目标，私有邀请链接返回 None"""
+    if 't.me/' in group_link:
+        target = group_link.split('t.me/')[-1].split('/')[0].split('?')[0]
+    elif group_link.startswith('@'):
+        target = group_link[1:]
+    else:
+        target = group_link
+    if not target or target.startswith('+') or target == 'joinchat':
+        return None
+    return target
+
+
+class _CannotCheckError(Exception):
+    """该机器人无法读取群成员（如普通群成员列表不可见），换下一个机器人"""
+
+
+def _bot_access_errors():
+    """这些错误只说明当前机器人无法检测该群，其他机器人可能可以"""
+    from telethon import errors
+    return (
+        _CannotCheckError,
+        ValueError,                        # 该机器人无法解析群实体
+        errors.ChannelPrivateError,
+        errors.ChannelInvalidError,
+        errors.ChatAdminRequiredError,
+        errors.ChatIdInvalidError,
+        errors.PeerIdInvalidError,
+        errors.FloodWaitError,
+    )
+
+
+async def _check_participant_with_client(client, target, user_id, peer=None):
+    """
+    使用指定机器人检测用户是否在群内
+    peer: 该机器人已记录的 InputPeer（没有时按 target 解析）
+    机器人无法访问该群时抛出 _bot_access_errors() 中的异常
+    """
+    from telethon.errors import UserNotParticipantError
+    entity = peer if peer is not None else await client.get_entity(target)
+    if isinstance(entity, (Chat, ChatForbidden, InputPeerChat)):
+        # 普通群没有 GetParticipant，从完整成员列表中查找
+        chat_id = entity.chat_id if isinstance(entity, InputPeerChat) else entity.id
+        full = await client(GetFullChatRequest(chat_id))
+        participants = full.full_chat.participants
+        if isinstance(participants, ChatParticipantsForbidden):
+            raise _CannotCheckError('普通群成员列表不可见')
+        return any(p.user_id == user_id for p in participants.participants)
+    try:
+        await client(GetParticipantRequest(channel=entity, participant=user_id))
+        return True
+    except UserNotParticipantError:
+        return False
+
+
+def _clients_for_group(clients, index, link):
+    """
+    检测该群时依次尝试的机器人：群的管理员机器人、已知在群内的机器人优先，
+    其余机器人从 index 开始轮换（分摊请求）
+    """
+    owner = group_affinity.owner(link)
+    known = group_peers.bots_for(link)
+    start = index % len(clients)
+    rotated = clients[start:] + clients[:start]
+
+    def rank(client):
+        bot_id = bot_registry.get_id(client)
+        return bot_id != owner or bot_id is None, bot_id not in known
+    return sorted(rotated, key=rank)
+
+
+async def check_user_in_groups(clients, user_id, group_links, timeout=PARTICIPANT_CHECK_TIMEOUT):
+    """
+    并发检测用户是否已加入多个群组
+
+    每个群先用已知在群内的机器人（管理员机器人 / 有 InputPeer 记录），其余机器人轮换分摊；
+    只有机器人无法访问该群（无权限 / 无法解析 / FloodWait）时换下一个机器人，
+    超时或其他错误直接记为无法检测。每个机器人受信号量限制并发数，单次检测有超时。
+    普通群按成员列表检测；私有邀请链接只能由有 InputPeer 记录的机器人检测。
+
+    Returns:
+        dict: {group_link: True(已加入) / False(未加入) / None(无法检测或超时)}
+    """
+    if not clients:
+        return {link: None for link in group_links}
+
+    from telethon.errors import FloodWaitError
+    access_errors = _bot_access_errors()
+
+    async def check_one(index, link):
+        target = _group_link_target(link)
+        for client in _clients_for_group(clients, index, link):
+            bot_id = bot_registry.get_id(client)
+            peer = group_peers.input_peer(bot_id, link)
+            if peer is None and not target:
+                continue  # 私有邀请链接，该机器人没有记录
+            try:
+                async with _get_participant_semaphore(client):
+                    return await asyncio.wait_for(
+                        _check_participant_with_client(client, target, user_id, peer), timeout)
+            except asyncio.TimeoutError:
+                print(f"[成员检测] 检测超时: {link}")
+                return None
+            except access_errors as e:
+                if peer is not None and not isinstance(e, (_CannotCheckError, FloodWaitError)):
+                    group_peers.forget(bot_id, link)  # 记录的 access_hash 已失效
+                print(f"[成员检测] 机器人 {bot_id} 无法检测 {link}，换下一个: {e}")
+            except Exception as e:
+                print(f"[成员检测] 检测 {link} 失败: {e}")
+                return None
+        return None
+
+    results = await asyncio.gather(
+        *(check_one(i, link) for i, link in enumerate(group_links)),
+        return_exceptions=True)
+    return {
+        link: (None if isinstance(result, BaseException) else result)
+        for link, result in zip(group_links, results)
+    }
+
+
 def get_upline_chain(telegram_id, max_level=10):
     """
     获取用户的上级链（向上N层），如果上级不足，自动用捡漏账号补齐
@@ -668,7 +836,10 @@ async def distribute_vip_rewards(bot, telegram_id, pay_amount, config):
                                 f"来源: 下级 @{source_username} (第{level}层) 开通VIP\n\n"
                                 f"请尽快完成任务，以免再次错过！"
                             )
-                        except: pass
+                        except PeerSuppressedError:
+                            pass  # 已拉黑 / 注销，不再调用 Telegram
+                        except Exception as e:
+                            print(f"[错失收益通知] 发送给 {upline_id} 失败: {e}")
 
             # --- 步骤B：如果需要捡漏，寻找替补 ---
             if is_rewarding_fallback:
@@ -727,7 +898,10 @@ async def distribute_vip_rewards(bot, telegram_id, pay_amount, config):
                     try:
                         await bot.send_message(target_id_to_reward,
                             f'🎉 获得 {reward_amount} U 奖励\n\n来源：第 {level} 层下级 @{source_username} 开通VIP\n\n快去联系他带领他一起发展团队')
-                    except: pass
+                    except PeerSuppressedError:
+                        pass
+                    except Exception as e:
+                        print(f"[分红通知] 发送给 {target_id_to_reward} 失败: {e}")
 
             conn.commit()
         except Exception as e:
@@ -1,6 +1,7 @@
 """
 数据库层 - 统一管理所有数据库操作
 """
+import json
 import sqlite3
 import time
 import os
@@ -23,6 +24,13 @@ except ImportError:
         DATA_DIR = os.path.join(BASE_DIR, 'data')
         DB_PATH = os.path.join(DATA_DIR, 'bot.db')
 
+# 启用运行指标时使用按调用位置计时的连接类
+try:
+    from app.metrics import connection_factory
+    _CONNECTION_CLASS = connection_factory()
+except ImportError:
+    _CONNECTION_CLASS = sqlite3.Connection
+
 # 定义中国时区
 CN_TIMEZONE = timezone(timedelta(hours=8))
 
@@ -32,7 +40,7 @@ def get_cn_time():
 
 def get_db_conn():
     """获取数据库连接，设置超时和 WAL 模式以避免锁定"""
-    conn = sqlite3.connect(DB_PATH, timeout=10.0)
+    conn = sqlite3.connect(DB_PATH, timeout=10.0, factory=_CONNECTION_CLASS)
     conn.execute('PRAGMA journal_mode=WAL')
     conn.execute('PRAGMA busy_timeout=10000')
     return conn
@@ -248,6 +256,131 @@ def init_db():
         create_time TEXT
     )''')
 
+    # 对话状态表（CONVERSATION_PERSIST 开启时使用）
+    c.execute('''CREATE TABLE IF NOT EXISTS conversation_states (
+        telegram_id INTEGER PRIMARY KEY,
+        state TEXT,
+        data TEXT,
+        expires_at REAL
+    )''')
+
+    # 已上传媒体缓存（见 media_cache.py）
+    c.execute('''CREATE TABLE IF NOT EXISTS media_cache (
+        file_hash TEXT NOT NULL,
+        bot_id INTEGER NOT NULL,
+        media_type TEXT,
+        media_id TEXT,
+        access_hash TEXT,
+        file_reference BLOB,
+        update_time TEXT,
+        PRIMARY KEY (file_hash, bot_id)
+    )''')
+
+    # 群组 InputPeer（见 group_peers.py）：超级群 / 频道的 access_hash 对每个机器人不同
+    c.execute('''CREATE TABLE IF NOT EXISTS group_peers (
+        group_id INTEGER NOT NULL,
+        bot_id INTEGER NOT NULL,
+        peer_type TEXT,
+        access_hash TEXT,
+        update_time TEXT,
+        PRIMARY KEY (group_id, bot_id)
+    )''')
+
+    # 通知发件箱（见 notify_outbox.py）
+    c.execute('''CREATE TABLE IF NOT EXISTS notify_outbox (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        member_id INTEGER NOT NULL,
+        message TEXT NOT NULL,
+        source TEXT,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        last_error TEXT,
+        create_time TEXT,
+        sent_time TEXT,
+        sent_at REAL,
+        claimed_by TEXT,
+        lease_until REAL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notify_outbox_status ON notify_outbox(status, next_attempt_at)')
+
+    # 发送抑制名单（见 send_suppression.py）：strikes = 0 表示已解除，seq 每次写入递增（增量同步用）
+    c.execute('''CREATE TABLE IF NOT EXISTS send_suppressions (
+        peer_key TEXT PRIMARY KEY,
+        reason TEXT,
+        strikes INTEGER DEFAULT 0,
+        suppressed_until REAL DEFAULT 0,
+        last_error TEXT,
+        updated_at REAL,
+        update_time TEXT,
+        seq INTEGER
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_send_suppressions_updated ON send_suppressions(updated_at)')
+
+    # 后台操作队列（见 bot_actions.py）：Web 后台写入，worker 进程执行
+    c.execute('''CREATE TABLE IF NOT EXISTS bot_actions (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        action TEXT NOT NULL,
+        payload TEXT,
+        status TEXT DEFAULT 'pending',
+        claimed_by TEXT,
+        lease_until REAL,
+        result TEXT,
+        create_time TEXT,
+        finish_time TEXT
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_bot_actions_status ON bot_actions(status, lease_until)')
+
+    # 会员私信群发活动（见 dm_campaign.py）：按 telegram_id 分批发送，cursor 为已处理到的最大 telegram_id
+    c.execute('''CREATE TABLE IF NOT EXISTS dm_campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        message TEXT NOT NULL,
+        status TEXT DEFAULT 'running',
+        cursor INTEGER DEFAULT 0,
+        total_count INTEGER DEFAULT 0,
+        sent_count INTEGER DEFAULT 0,
+        failed_count INTEGER DEFAULT 0,
+        deferred_count INTEGER DEFAULT 0,
+        claimed_by TEXT,
+        lease_until REAL,
+        started_at REAL,
+        create_time TEXT,
+        finish_time TEXT
+    )''')
+
+    # 置顶公告活动（见 pinned_campaign.py）：每个群一行结果，按群链接去重
+    c.execute('''CREATE TABLE IF NOT EXISTS pinned_campaigns (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        content TEXT NOT NULL,
+        status TEXT DEFAULT 'running',
+        total_count INTEGER DEFAULT 0,
+        claimed_by TEXT,
+        lease_until REAL,
+        started_at REAL,
+        create_time TEXT,
+        finish_time TEXT
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS pinned_campaign_results (
+        campaign_id INTEGER NOT NULL,
+        group_link TEXT NOT NULL,
+        status TEXT DEFAULT 'pending',
+        attempts INTEGER DEFAULT 0,
+        next_attempt_at REAL DEFAULT 0,
+        message_id INTEGER,
+        error TEXT,
+        PRIMARY KEY (campaign_id, group_link)
+    ) WITHOUT ROWID''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_pinned_results_status ON pinned_campaign_results(campaign_id, status, next_attempt_at)')
+
+    # 跨进程缓存事件（见 publish_cache_event）：按自增 id 顺序读取，不依赖各进程的时钟
+    c.execute('''CREATE TABLE IF NOT EXISTS cache_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        payload TEXT,
+        created_at REAL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_cache_events_name ON cache_events(name, id)')
+
     # 检查是否有管理员，如果没有则创建默认管理员
     c.execute('SELECT COUNT(*) FROM admin_users')
     if c.fetchone()[0] == 0:
@@ -333,6 +466,8 @@ class DB:
         c.execute(f'UPDATE members SET {sets} WHERE telegram_id = ?', values)
         conn.commit()
         conn.close()
+        if QUALIFICATION_FIELDS.intersection(kwargs):
+            invalidate_required_groups(telegram_id)
     
     @staticmethod
     def get_upline_members(telegram_id, levels=10):
@@ -514,6 +649,374 @@ def update_system_config(key, value):
     conn.commit()
     conn.close()
 
+def get_cache_version(name):
+    """读取缓存版本号（用于多进程间的缓存失效同步）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    c.execute('SELECT value FROM system_config WHERE key = ?', (f'cache_version_{name}',))
+    row = c.fetchone()
+    conn.close()
+    return int(row[0]) if row else 0
+
+def bump_cache_version(name):
+    """递增缓存版本号，返回新版本号"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO system_config (key, value) VALUES (?, '1')
+        ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1
+    ''', (f'cache_version_{name}',))
+    conn.commit()
+    c.execute('SELECT value FROM system_config WHERE key = ?', (f'cache_version_{name}',))
+    row = c.fetchone()
+    conn.close()
+    return int(row[0]) if row else 0
+
+# 缓存事件保留时间（秒）：其他进程在此期间内按版本号检测并读取
+CACHE_EVENT_RETENTION = 3600
+_cache_event_cleanup_at = 0
+
+def publish_cache_event(name, payload):
+    """
+    发布一条缓存事件（如「某上级的下级列表失效」「某群需要复查」）并递增版本号
+    其他进程检测到版本号变化后用 get_cache_events 读取新事件
+    """
+    global _cache_event_cleanup_at
+    now = time.time()
+    conn = get_db_conn()
+    try:
+        conn.execute('INSERT INTO cache_events (name, payload, created_at) VALUES (?, ?, ?)',
+                     (name, json.dumps(payload), now))
+        if now - _cache_event_cleanup_at > CACHE_EVENT_RETENTION:
+            conn.execute('DELETE FROM cache_events WHERE created_at < ?', (now - CACHE_EVENT_RETENTION,))
+            _cache_event_cleanup_at = now
+        conn.commit()
+    finally:
+        conn.close()
+    return bump_cache_version(name)
+
+def get_cache_events(name, after_id=None):
+    """
+    读取 id > after_id 的事件，返回 (最新 id, [payload])
+    after_id 为 None 时只返回当前最新 id（首次同步不回放历史事件）
+    """
+    conn = get_db_conn()
+    try:
+        if after_id is None:
+            row = conn.execute('SELECT MAX(id) FROM cache_events WHERE name = ?', (name,)).fetchone()
+            return (row[0] or 0), []
+        rows = conn.execute('SELECT id, payload FROM cache_events WHERE name = ? AND id > ? ORDER BY id',
+                            (name, after_id)).fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return after_id, []
+    return rows[-1][0], [json.loads(payload) for _, payload in rows]
+
+# ==================== 定时群发调度 ====================
+
+def notify_broadcast_schedule_changed(message_id=None):
+    """
+    群发分配 / 群发内容修改后调用
+    message_id: 发送间隔可能变化的消息，按新间隔重新计算其分配的 next_due_at
+    """
+    if message_id is not None:
+        conn = get_db_conn()
+        try:
+            conn.execute(f'''UPDATE broadcast_assignments SET next_due_at = CASE
+                                 WHEN last_sent_time IS NULL OR last_sent_time = '' THEN 0
+                                 ELSE {NEXT_DUE_SQL} END
+                             WHERE message_id = ?''', (message_id,))
+            conn.commit()
+        finally:
+            conn.close()
+    try:
+        bump_cache_version('broadcast_schedule')
+    except Exception as e:
+        print(f'[定时群发] 更新版本号失败: {e}')
+    # 调度器在本进程运行时立即唤醒（其他进程通过版本号检测）
+    scheduler_module = sys.modules.get('app.broadcast_scheduler')
+    if scheduler_module:
+        scheduler_module.broadcast_scheduler.wake()
+
+# ==================== 群发队列 ====================
+
+def enqueue_broadcasts(groups, message):
+    """
+    后台立即群发：每个群写入一条 broadcast_queue 记录，由机器人进程的队列消费者发送
+    groups: [(group_link, group_name)]，同一群链接只发一次；返回入队条数（任意进程可调用）
+    """
+    rows = {}
+    for group_link, group_name in groups:
+        if group_link and 't.me/' in group_link:
+            rows.setdefault(group_link, group_name)
+    rows = list(rows.items())
+    if not rows:
+        return 0
+    now = get_cn_time()
+    conn = get_db_conn()
+    try:
+        conn.executemany(
+            "INSERT INTO broadcast_queue (group_link, group_name, message, status, create_time) "
+            "VALUES (?, ?, ?, 'pending', ?)",
+            [(group_link, group_name, message, now) for group_link, group_name in rows])
+        conn.commit()
+    finally:
+        conn.close()
+    # 队列消费者在本进程运行时立即唤醒（其他进程靠轮询取到）
+    queue_module = sys.modules.get('app.broadcast_queue')
+    if queue_module:
+        queue_module.broadcast_queue_consumer.wake()
+    return len(rows)
+
+# ==================== 通知发件箱 ====================
+
+def enqueue_notifications(member_ids, message, source=''):
+    """把发给会员的通知写入 notify_outbox，返回入队条数（任意进程 / 线程可调用）"""
+    member_ids = list(member_ids)
+    if not member_ids:
+        return 0
+    now = time.time()
+    create_time = get_cn_time()
+    conn = get_db_conn()
+    try:
+        conn.executemany(
+            'INSERT INTO notify_outbox (member_id, message, source, status, next_attempt_at, create_time) '
+            "VALUES (?, ?, ?, 'pending', ?, ?)",
+            [(member_id, message, source, now, create_time) for member_id in member_ids])
+        conn.commit()
+    finally:
+        conn.close()
+    # 发件箱在本进程运行时立即唤醒（其他进程靠轮询取到）
+    outbox_module = sys.modules.get('app.notify_outbox')
+    if outbox_module:
+        outbox_module.notify_outbox.wake()
+    return len(member_ids)
+
+
+def enqueue_notification(member_id, message, source=''):
+    return enqueue_notifications([member_id], message, source)
+
+# ==================== 后台操作队列 ====================
+
+def enqueue_bot_action(action, **payload):
+    """
+    写入一条需要机器人执行的后台操作（见 bot_actions.py），返回记录ID（任意进程可调用）
+    action: 'recharge'（充值到账后续处理）/ 'manual_vip'（管理员手动开通VIP）
+    """
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute("INSERT INTO bot_actions (action, payload, status, create_time) VALUES (?, ?, 'pending', ?)",
+                  (action, json.dumps(payload, ensure_ascii=False), get_cn_time()))
+        action_id = c.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    actions_module = sys.modules.get('app.bot_actions')
+    if actions_module:
+        actions_module.bot_action_runner.wake()
+    return action_id
+
+def notify_bot_configs_changed():
+    """后台新增 / 启用机器人后调用：运行机器人的进程检测到版本号变化后启动新机器人"""
+    try:
+        bump_cache_version('bot_configs')
+    except Exception as e:
+        print(f'[机器人配置] 更新版本号失败: {e}')
+
+# ==================== 会员私信群发活动 ====================
+# 全体会员群发不再一次性把所有会员写入发件箱，由机器人进程按 telegram_id 分批发送（见 dm_campaign.py）
+
+DM_CAMPAIGN_FIELDS = ('id', 'message', 'status', 'cursor', 'total_count', 'sent_count',
+                      'failed_count', 'deferred_count', 'started_at', 'create_time', 'finish_time')
+
+def create_dm_campaign(message):
+    """创建全体会员私信群发活动，返回 (活动ID, 会员数)；没有会员时不创建，返回 (None, 0)"""
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM members')
+        total = c.fetchone()[0]
+        if not total:
+            return None, 0
+        c.execute(
+            "INSERT INTO dm_campaigns (message, status, cursor, total_count, create_time) "
+            "VALUES (?, 'running', 0, ?, ?)", (message, total, get_cn_time()))
+        campaign_id = c.lastrowid
+        conn.commit()
+    finally:
+        conn.close()
+    runner_module = sys.modules.get('app.dm_campaign')
+    if runner_module:
+        runner_module.dm_campaign_runner.wake()
+    return campaign_id, total
+
+def get_dm_campaigns(limit=20):
+    """最近的私信群发活动（含进度）"""
+    conn = get_db_conn()
+    try:
+        rows = conn.execute(
+            f"SELECT {', '.join(DM_CAMPAIGN_FIELDS)} FROM dm_campaigns ORDER BY id DESC LIMIT ?",
+            (limit,)).fetchall()
+    finally:
+        conn.close()
+    return [dict(zip(DM_CAMPAIGN_FIELDS, row)) for row in rows]
+
+def set_dm_campaign_status(campaign_id, status):
+    """暂停 / 继续 / 取消活动；已完成或已取消的活动不能再修改，返回是否成功"""
+    allowed_from = {
+        'paused': ('running',),
+        'running': ('paused',),
+        'cancelled': ('running', 'paused'),
+    }.get(status)
+    if not allowed_from:
+        return False
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        placeholders = ','.join('?' for _ in allowed_from)
+        c.execute(
+            f'UPDATE dm_campaigns SET status = ?, finish_time = CASE WHEN ? = \'cancelled\' '
+            f'THEN ? ELSE finish_time END WHERE id = ? AND status IN ({placeholders})',
+            (status, status, get_cn_time(), campaign_id) + allowed_from)
+        conn.commit()
+        changed = c.rowcount == 1
+    finally:
+        conn.close()
+    if changed and status == 'running':
+        runner_module = sys.modules.get('app.dm_campaign')
+        if runner_module:
+            runner_module.dm_campaign_runner.wake()
+    return changed
+
+# ==================== 置顶公告活动 ====================
+# 发布置顶公告时每个群写一行结果，机器人进程并发发送并逐群记录结果（见 pinned_campaign.py）
+
+PINNED_CAMPAIGN_FIELDS = ('id', 'status', 'total_count', 'started_at', 'create_time', 'finish_time')
+
+def _wake_pinned_campaigns():
+    runner_module = sys.modules.get('app.pinned_campaign')
+    if runner_module:
+        runner_module.pinned_campaign_runner.wake()
+
+def create_pinned_campaign(content, group_links=None):
+    """
+    创建置顶公告活动，返回 (活动ID, 群数)
+    group_links 为空时发送到所有机器人为管理员的会员群；同一个群只发送一次
+    """
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        if group_links is None:
+            c.execute("SELECT DISTINCT group_link FROM member_groups "
+                      "WHERE is_bot_admin = 1 AND group_link LIKE '%t.me/%'")
+            group_links = [row[0] for row in c.fetchall()]
+        links = list(dict.fromkeys(link.strip() for link in group_links if link and link.strip()))
+        if not links:
+            return None, 0
+        c.execute("INSERT INTO pinned_campaigns (content, status, total_count, create_time) "
+                  "VALUES (?, 'running', ?, ?)", (content, len(links), get_cn_time()))
+        campaign_id = c.lastrowid
+        c.executemany('INSERT INTO pinned_campaign_results (campaign_id, group_link) VALUES (?, ?)',
+                      [(campaign_id, link) for link in links])
+        conn.commit()
+    finally:
+        conn.close()
+    _wake_pinned_campaigns()
+    return campaign_id, len(links)
+
+def get_pinned_campaigns(limit=10):
+    """最近的置顶公告活动，附各状态群数 {'pending': n, 'pinned': n, 'sent': n, 'failed': n}"""
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute(f"SELECT {', '.join(PINNED_CAMPAIGN_FIELDS)} FROM pinned_campaigns ORDER BY id DESC LIMIT ?",
+                  (limit,))
+        campaigns = [dict(zip(PINNED_CAMPAIGN_FIELDS, row)) for row in c.fetchall()]
+        for item in campaigns:
+            c.execute('SELECT status, COUNT(*) FROM pinned_campaign_results WHERE campaign_id = ? GROUP BY status',
+                      (item['id'],))
+            item['counts'] = dict(c.fetchall())
+    finally:
+        conn.close()
+    return campaigns
+
+def get_pinned_campaign_failures(campaign_id, limit=200):
+    """发送失败的群及原因"""
+    conn = get_db_conn()
+    try:
+        rows = conn.execute(
+            "SELECT group_link, attempts, error FROM pinned_campaign_results "
+            "WHERE campaign_id = ? AND status = 'failed' LIMIT ?", (campaign_id, limit)).fetchall()
+    finally:
+        conn.close()
+    return [{'group_link': link, 'attempts': attempts, 'error': error} for link, attempts, error in rows]
+
+def retry_pinned_campaign(campaign_id):
+    """失败的群重新发送，返回重新排队的群数"""
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute("UPDATE pinned_campaign_results SET status = 'pending', attempts = 0, next_attempt_at = 0 "
+                  "WHERE campaign_id = ? AND status = 'failed' "
+                  "AND EXISTS (SELECT 1 FROM pinned_campaigns WHERE id = ? AND status != 'cancelled')",
+                  (campaign_id, campaign_id))
+        count = c.rowcount
+        if count:
+            # 只有确实有群重新排队时才把活动改回进行中
+            c.execute("UPDATE pinned_campaigns SET status = 'running', finish_time = NULL "
+                      "WHERE id = ? AND status != 'cancelled'", (campaign_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    if count:
+        _wake_pinned_campaigns()
+    return count
+
+def cancel_pinned_campaign(campaign_id):
+    conn = get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute("UPDATE pinned_campaigns SET status = 'cancelled', finish_time = ? "
+                  "WHERE id = ? AND status = 'running'", (get_cn_time(), campaign_id))
+        conn.commit()
+        return c.rowcount == 1
+    finally:
+        conn.close()
+
+# 影响「上级是否达标」或上级链的会员字段，变化时需要失效本人及下级的加群列表缓存
+QUALIFICATION_FIELDS = {'is_vip', 'is_group_bound', 'is_bot_admin', 'is_joined_upline', 'group_link',
+                        'referrer_id'}
+
+def invalidate_required_groups(telegram_id=None, propagate=False):
+    """
+    失效加群任务群组列表缓存
+    telegram_id: 状态变化的上级ID（只失效其下级）；为 None 时全部失效
+    """
+    try:
+        try:
+            from app.required_groups import required_groups_cache
+        except ImportError:
+            from required_groups import required_groups_cache
+        if telegram_id is None:
+            required_groups_cache.invalidate_all(propagate=propagate)
+        else:
+            required_groups_cache.invalidate_upline(telegram_id)
+    except Exception as e:
+        print(f'[群组列表缓存] 失效失败: {e}')
+
+def invalidate_account_map(propagate=False):
+    """备用号 / 捡漏账号关联变化后失效账号映射（propagate=True 同时通知其他进程）"""
+    try:
+        try:
+            from app.account_map import account_map
+        except ImportError:
+            from account_map import account_map
+        account_map.invalidate(propagate=propagate)
+    except Exception as e:
+        print(f'[账号映射] 失效失败: {e}')
+
 class AdminUser(UserMixin):
     """管理员用户类"""
     def __init__(self, id, username, password_hash):
@@ -717,19 +1220,16 @@ class WebDB:
                 
             conn.commit()
             
-            # 发送BOT通知
+            # 发送BOT通知（写入通知发件箱，由机器人进程投递）
             try:
-                import requests
                 if action == 'approve':
                     msg = f"✅ 提现审核通过\n\n💰 金额: {amount} USDT\n📝 订单号: #{withdrawal_id}\n⏰ 时间: {now}\n\n请注意查收，感谢您的耐心等待！"
                 else:
                     msg = f"❌ 提现申请被拒绝\n\n💰 金额: {amount} USDT\n📝 订单号: #{withdrawal_id}\n⏰ 时间: {now}\n\n余额已退回账户，如有疑问请联系客服。"
                 
-                requests.post("http://127.0.0.1:5051/internal/notify", json={
-                    'member_id': member_id, 'message': msg
-                }, timeout=1)
-            except:
-                pass
+                enqueue_notification(member_id, msg, source='withdrawal')
+            except Exception as e:
+                print(f'[提现通知] 入队失败: {e}')
             
             return True, "操作成功"
         except Exception as e:
@@ -888,6 +1388,9 @@ class WebDB:
             conn.commit()
         
         conn.close()
+        if QUALIFICATION_FIELDS.intersection(data):
+            # Web 端可能是独立进程，用版本号通知机器人进程
+            invalidate_required_groups(propagate=True)
     
     @staticmethod
     def delete_member(telegram_id):
@@ -897,6 +1400,8 @@ class WebDB:
         c.execute('DELETE FROM members WHERE telegram_id = ?', (telegram_id,))
         conn.commit()
         conn.close()
+        invalidate_required_groups(propagate=True)
+        invalidate_account_map(propagate=True)
 
 # ==================== 数据库升级函数 ====================
 
@@ -928,6 +1433,10 @@ def upgrade_members_table():
     try:
         c.execute('ALTER TABLE members ADD COLUMN withdraw_address TEXT')
     except: pass
+    try:
+        # 备用号 -> 主账号 反查
+        c.execute('CREATE INDEX IF NOT EXISTS idx_members_backup_account ON members(backup_account)')
+    except: pass
     conn.commit()
     conn.close()
 
@@ -944,6 +1453,23 @@ def upgrade_member_groups_table():
     try:
         c.execute('ALTER TABLE member_groups ADD COLUMN schedule_broadcast INTEGER DEFAULT 1')
     except: pass
+    try:
+        c.execute('ALTER TABLE member_groups ADD COLUMN title_update_time TEXT')
+    except: pass
+    conn.commit()
+    conn.close()
+
+def upgrade_fallback_accounts_table():
+    """升级fallback_accounts表结构"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        # 群名缓存 JSON: {群链接: 群名}
+        c.execute('ALTER TABLE fallback_accounts ADD COLUMN group_titles TEXT')
+    except: pass
+    try:
+        c.execute('ALTER TABLE fallback_accounts ADD COLUMN title_update_time TEXT')
+    except: pass
     conn.commit()
     conn.close()
 
@@ -975,6 +1501,10 @@ def upgrade_broadcast_table():
     try:
         c.execute('ALTER TABLE broadcast_messages ADD COLUMN broadcast_interval INTEGER DEFAULT 120')
     except: pass
+    try:
+        # 内容版本号：修改后递增，群发队列按 (id, version) 复用编译结果（见 broadcast_payload.py）
+        c.execute('ALTER TABLE broadcast_messages ADD COLUMN version INTEGER DEFAULT 1')
+    except: pass
     conn.commit()
     conn.close()
 
@@ -988,7 +1518,7 @@ def upsert_member_group(telegram_id, group_link, owner_username=None, is_bot_adm
     try:
         conn = get_db_conn()
         c = conn.cursor()
-        c.execute('SELECT id FROM member_groups WHERE telegram_id = ?', (telegram_id,))
+        c.execute('SELECT id, group_link FROM member_groups WHERE telegram_id = ?', (telegram_id,))
         row = c.fetchone()
         now = get_cn_time()
         if row:
@@ -996,6 +1526,11 @@ def upsert_member_group(telegram_id, group_link, owner_username=None, is_bot_adm
             update_fields = ['group_link = ?']
             update_values = [group_link]
 
+            # 群链接变化时清空群名缓存，等待后台任务刷新
+            if row[1] != group_link:
+                update_fields.append("group_name = ''")
+                update_fields.append('title_update_time = NULL')
+
             if owner_username is not None:
                 update_fields.append('owner_username = ?')
                 update_values.append(owner_username)
@@ -1026,6 +1561,80 @@ def upsert_member_group(telegram_id, group_link, owner_username=None, is_bot_adm
     except Exception as e:
         print(f'[member_groups upsert] error: {e}')
 
+# ==================== 群名缓存 ====================
+# 渲染路径（群裂变列表、验证加群）只读缓存，由后台任务按预算刷新
+
+def get_member_group_titles(telegram_ids):
+    """批量读取会员群名缓存，返回 {telegram_id: group_name}"""
+    ids = [i for i in telegram_ids if i]
+    if not ids:
+        return {}
+    try:
+        conn = get_db_conn()
+        c = conn.cursor()
+        placeholders = ','.join('?' * len(ids))
+        c.execute(f"SELECT telegram_id, group_name FROM member_groups WHERE telegram_id IN ({placeholders}) AND group_name IS NOT NULL AND group_name != ''", ids)
+        rows = c.fetchall()
+        conn.close()
+        return {row[0]: row[1] for row in rows}
+    except Exception as e:
+        print(f'[群名缓存] 读取失败: {e}')
+        return {}
+
+def get_stale_group_titles(max_age_seconds, limit):
+    """
+    获取需要刷新群名的记录（从未刷新或超过 max_age_seconds）
+    返回 (member_rows, fallback_rows):
+        member_rows: [(member_groups.id, telegram_id, group_link, group_name)]
+        fallback_rows: [(fallback_accounts.id, group_link, group_titles)]
+    """
+    cutoff = (datetime.now(CN_TIMEZONE) - timedelta(seconds=max_age_seconds)).isoformat()
+    conn = get_db_conn()
+    c = conn.cursor()
+    c.execute('''
+        SELECT id, group_link, group_titles FROM fallback_accounts
+        WHERE is_active = 1 AND group_link IS NOT NULL AND group_link != ''
+          AND (title_update_time IS NULL OR title_update_time < ?)
+        ORDER BY title_update_time IS NOT NULL, title_update_time ASC
+        LIMIT ?
+    ''', (cutoff, limit))
+    fallback_rows = c.fetchall()
+    c.execute('''
+        SELECT id, telegram_id, group_link, group_name FROM member_groups
+        WHERE group_link IS NOT NULL AND group_link != ''
+          AND (title_update_time IS NULL OR title_update_time < ?)
+        ORDER BY title_update_time IS NOT NULL, title_update_time ASC
+        LIMIT ?
+    ''', (cutoff, limit))
+    member_rows = c.fetchall()
+    conn.close()
+    return member_rows, fallback_rows
+
+def save_member_group_title(row_id, title):
+    """写入会员群名缓存（title 为空时只刷新时间戳，保留旧群名）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    if title:
+        c.execute('UPDATE member_groups SET group_name = ?, title_update_time = ? WHERE id = ?',
+                  (title, get_cn_time(), row_id))
+    else:
+        c.execute('UPDATE member_groups SET title_update_time = ? WHERE id = ?', (get_cn_time(), row_id))
+    conn.commit()
+    conn.close()
+
+def save_fallback_group_titles(row_id, titles, stamp=True):
+    """写入捡漏账号群名缓存 titles: {群链接: 群名}；stamp=False 时不更新刷新时间（只刷新了部分群）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    if stamp:
+        c.execute('UPDATE fallback_accounts SET group_titles = ?, title_update_time = ? WHERE id = ?',
+                  (json.dumps(titles, ensure_ascii=False), get_cn_time(), row_id))
+    else:
+        c.execute('UPDATE fallback_accounts SET group_titles = ? WHERE id = ?',
+                  (json.dumps(titles, ensure_ascii=False), row_id))
+    conn.commit()
+    conn.close()
+
 async def sync_member_groups_from_members(connected_clients=None):
     """启动时同步已存在的会员群链接到 member_groups，避免后台列表为空"""
     try:
@@ -1141,7 +1750,7 @@ async def sync_member_groups_from_members(connected_clients=None):
                     try:
                         conn = get_db_conn()
                         c = conn.cursor()
-                        c.execute("UPDATE member_groups SET group_name = ? WHERE group_id = ?", (group_name, group_id))
+                        c.execute("UPDATE member_groups SET group_name = ?, title_update_time = ? WHERE group_id = ?", (group_name, get_cn_time(), group_id))
                         conn.commit()
                         conn.close()
                     except Exception as e:
@@ -1157,8 +1766,101 @@ async def sync_member_groups_from_members(connected_clients=None):
         import traceback
         traceback.print_exc()
 
-# 在模块加载时执行数据库升级
-upgrade_members_table()
-upgrade_member_groups_table()
-upgrade_broadcast_table()
+def upgrade_recharge_records_table():
+    """升级recharge_records表结构"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        # 后台管理员备注
+        c.execute('ALTER TABLE recharge_records ADD COLUMN remark TEXT')
+    except: pass
+    conn.commit()
+    conn.close()
+
+# 由 last_sent_time（ISO 字符串）+ 消息发送间隔计算下次到期时间（秒级时间戳），从未发送过为 0
+NEXT_DUE_SQL = '''
+    COALESCE(CAST(strftime('%s', broadcast_assignments.last_sent_time) AS INTEGER), 0)
+    + COALESCE((SELECT broadcast_interval FROM broadcast_messages bm
+                WHERE bm.id = broadcast_assignments.message_id), 120) * 60
+'''
+
+def upgrade_broadcast_assignments_table():
+    """升级broadcast_assignments表结构：next_due_at 供定时群发调度使用"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('ALTER TABLE broadcast_assignments ADD COLUMN next_due_at INTEGER')
+    except: pass
+    c.execute(f'''UPDATE broadcast_assignments SET next_due_at = CASE
+                      WHEN last_sent_time IS NULL OR last_sent_time = '' THEN 0
+                      ELSE {NEXT_DUE_SQL} END
+                  WHERE next_due_at IS NULL''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_assignments_due '
+              'ON broadcast_assignments(is_active, next_due_at)')
+    conn.commit()
+    conn.close()
 
+def upgrade_broadcast_queue_table():
+    """升级broadcast_queue表结构：领取租约（见 broadcast_queue.py）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('ALTER TABLE broadcast_queue ADD COLUMN claimed_by TEXT')
+    except: pass
+    try:
+        c.execute('ALTER TABLE broadcast_queue ADD COLUMN lease_until REAL')
+    except: pass
+    try:
+        c.execute('ALTER TABLE broadcast_queue ADD COLUMN attempts INTEGER DEFAULT 0')
+    except: pass
+    try:
+        # 引用 broadcast_messages 的内容（message 为空），旧记录仍使用 message 字段
+        c.execute('ALTER TABLE broadcast_queue ADD COLUMN message_id INTEGER')
+    except: pass
+    try:
+        c.execute('ALTER TABLE broadcast_queue ADD COLUMN message_version INTEGER')
+    except: pass
+    c.execute('CREATE INDEX IF NOT EXISTS idx_broadcast_queue_status ON broadcast_queue(status, lease_until)')
+    conn.commit()
+    conn.close()
+
+def upgrade_notify_outbox_table():
+    """升级notify_outbox表结构：领取租约（见 notify_outbox.py）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('ALTER TABLE notify_outbox ADD COLUMN claimed_by TEXT')
+    except: pass
+    try:
+        c.execute('ALTER TABLE notify_outbox ADD COLUMN lease_until REAL')
+    except: pass
+    conn.commit()
+    conn.close()
+
+def upgrade_send_suppressions_table():
+    """升级send_suppressions表结构：写入序号（见 send_suppression.py）"""
+    conn = get_db_conn()
+    c = conn.cursor()
+    try:
+        c.execute('ALTER TABLE send_suppressions ADD COLUMN seq INTEGER')
+    except: pass
+    c.execute('UPDATE send_suppressions SET seq = rowid WHERE seq IS NULL')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_send_suppressions_seq ON send_suppressions(seq)')
+    conn.commit()
+    conn.close()
+
+def run_migrations():
+    """
+    建表并执行所有升级（幂等）
+    由启动入口显式调用，导入本模块不会触碰数据库
+    """
+    init_db()
+    upgrade_members_table()
+    upgrade_member_groups_table()
+    upgrade_broadcast_table()
+    upgrade_fallback_accounts_table()
+    upgrade_recharge_records_table()
+    upgrade_broadcast_assignments_table()
+    upgrade_broadcast_queue_table()
+    upgrade_notify_outbox_table()
+    upgrade_send_suppressions_table()
@@ -0,0 +1,278 @@
+"""
+会员私信群发活动 - 后台「向全体会员发送」按 telegram_id 分批发送，可暂停 / 继续，重启后断点续发
+1. 后台只写一条 dm_campaigns 记录（database.create_dm_campaign），不再把全部会员读进内存
+2. 机器人进程领取活动（租约，多个进程不会同时发送同一活动），
+   按 telegram_id > cursor 每次读取 DM_CAMPAIGN_CHUNK 个会员（键集分页，走 telegram_id 唯一索引）
+3. 每批按 每机器人速度 × 在线机器人数 匀速发出，经 SendDispatcher 分摊到各机器人
+4. 每批完成后保存 cursor 与计数；发送期间每 LEASE_SECONDS / 3 秒续租一次（单条发送可能因 FloodWait 等待数分钟），
+   进程退出后租约到期，从 cursor 继续（最多重发最后一批中已发出的部分）
+5. 用户拉黑 / 注销计为失败；其他错误转入通知发件箱（notify_outbox）按退避重试，计为延后
+6. 所有机器人都在 FloodWait（或没有在线机器人）时停止本批：已发出的部分保存进度，
+   活动暂停等待后从下一个会员继续，不把剩余会员都转入发件箱
+"""
+import asyncio
+import time
+
+from telethon import errors
+
+from .database import get_db_conn, get_cn_time, enqueue_notification
+from .send_suppression import PeerSuppressedError
+from .send_dispatcher import NoBotAvailableError
+from .broadcast_queue import make_worker_id
+
+# 租约时长（秒）：发送期间每 LEASE_SECONDS / 3 秒续租
+LEASE_SECONDS = 120
+# 没有进行中的活动时的轮询间隔（秒）
+POLL_INTERVAL = 5
+# 没有在线机器人时的暂停时间（秒）；FloodWait 按 Telegram 给出的秒数暂停
+BLOCKED_PAUSE = 60
+MAX_BLOCKED_PAUSE = 600
+
+STATUS_RUNNING = 'running'
+STATUS_PAUSED = 'paused'
+STATUS_COMPLETED = 'completed'
+STATUS_CANCELLED = 'cancelled'
+
+# 这些错误说明所有机器人暂时都发不出去
+_BLOCKED_ERRORS = (errors.FloodWaitError, NoBotAvailableError)
+
+# 这些错误重试也不会成功
+_PERMANENT_ERRORS = (
+    errors.UserIsBlockedError,
+    errors.InputUserDeactivatedError,
+    errors.UserDeactivatedError,
+    errors.PeerIdInvalidError,
+    PeerSuppressedError,
+)
+
+
+class DmCampaignRunner:
+    """逐个领取进行中的活动并分批发送"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self._loop = None
+        self._wake = None
+        self.stats = {'sent': 0, 'failed': 0, 'deferred': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self, send, get_bot_count, rate_per_bot=20, chunk_size=200):
+        """
+        send: async send(member_id, message)
+        get_bot_count: 返回当前在线机器人数，用于计算总发送速度
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                campaign = self._claim()
+                if campaign:
+                    await self._run_campaign(campaign, send, get_bot_count, rate_per_bot, chunk_size)
+                    continue
+            except Exception as e:
+                print(f'[私信群发] 错误: {e}')
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _run_campaign(self, campaign, send, get_bot_count, rate_per_bot, chunk_size):
+        campaign_id, message, cursor = campaign
+        print(f'[私信群发] 活动 #{campaign_id} 开始发送（从 telegram_id > {cursor} 继续）')
+        while True:
+            member_ids = self._next_chunk(cursor, chunk_size)
+            if not member_ids:
+                self._complete(campaign_id)
+                print(f'[私信群发] 活动 #{campaign_id} 发送完成')
+                return
+            rate = max(1.0, rate_per_bot * max(1, get_bot_count()))
+            lease_lost = asyncio.Event()
+            keeper = asyncio.create_task(self._keep_lease(campaign_id, lease_lost))
+            try:
+                counts, last_sent, pause = await self._send_chunk(
+                    campaign_id, member_ids, message, send, rate, lease_lost)
+                if last_sent is not None:
+                    cursor = last_sent
+                status = self._save_progress(campaign_id, cursor, counts)
+                if status != STATUS_RUNNING:
+                    print(f'[私信群发] 活动 #{campaign_id} 已停止（{status}）')
+                    return
+                if pause:
+                    print(f'[私信群发] 活动 #{campaign_id} 所有机器人暂时无法发送，暂停 {int(pause)} 秒')
+                    await self._wait_or_lease_lost(pause, lease_lost)
+                    if lease_lost.is_set():
+                        return
+            finally:
+                keeper.cancel()
+
+    async def _send_chunk(self, campaign_id, member_ids, message, send, rate, lease_lost):
+        """
+        按 rate 条/秒匀速发出一批
+        返回 (计数 {'sent', 'failed', 'deferred'}, 已发出的最后一个会员ID, 需要暂停的秒数)
+        所有机器人都发不出去 / 租约丢失 / 活动被暂停时停止发出后续会员
+        """
+        counts = {'sent': 0, 'failed': 0, 'deferred': 0}
+        blocked = []
+
+        async def send_one(member_id):
+            try:
+                await send(member_id, message)
+                result = 'sent'
+            except _PERMANENT_ERRORS:
+                result = 'failed'
+            except _BLOCKED_ERRORS as e:
+                blocked.append(e)
+                # 已发出的这一条交给发件箱，本批剩余会员留到暂停结束后
+                try:
+                    enqueue_notification(member_id, message, source=f'dm_campaign:{campaign_id}')
+                    result = 'deferred'
+                except Exception:
+                    result = 'failed'
+            except Exception as e:
+                # 临时错误交给通知发件箱按退避重试
+                try:
+                    enqueue_notification(member_id, message, source=f'dm_campaign:{campaign_id}')
+                    result = 'deferred'
+                except Exception:
+                    print(f'[私信群发] 用户 {member_id} 发送失败: {e}')
+                    result = 'failed'
+            counts[result] += 1
+            self.stats[result] += 1
+
+        interval = 1.0 / rate
+        tasks = []
+        last_sent = None
+        next_at = time.monotonic()
+        for member_id in member_ids:
+            delay = next_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if blocked or lease_lost.is_set():
+                break
+            tasks.append(asyncio.create_task(send_one(member_id)))
+            last_sent = member_id
+            next_at += interval
+        await asyncio.gather(*tasks)
+        pause = 0
+        if blocked:
+            waits = [e.seconds for e in blocked if isinstance(e, errors.FloodWaitError)]
+            pause = min(MAX_BLOCKED_PAUSE, max(waits) if waits else BLOCKED_PAUSE)
+        return counts, last_sent, pause
+
+    # ---------- 租约 ----------
+
+    async def _keep_lease(self, campaign_id, lease_lost):
+        """发送期间定期续租；租约被接管或活动不再进行时通知停止"""
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            if not self._renew(campaign_id):
+                lease_lost.set()
+                return
+
+    @staticmethod
+    async def _wait_or_lease_lost(seconds, lease_lost):
+        try:
+            await asyncio.wait_for(lease_lost.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    # ---------- 数据库 ----------
+
+    def _claim(self):
+        """领取一个进行中且未被其他进程持有（或租约已过期）的活动，返回 (id, message, cursor)"""
+        now = time.time()
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute(
+                'SELECT id, message, cursor FROM dm_campaigns WHERE status = ? '
+                'AND (claimed_by IS NULL OR claimed_by = ? OR lease_until < ?) ORDER BY id LIMIT 1',
+                (STATUS_RUNNING, self.worker_id, now))
+            row = c.fetchone()
+            if not row:
+                return None
+            c.execute(
+                'UPDATE dm_campaigns SET claimed_by = ?, lease_until = ?, '
+                'started_at = COALESCE(started_at, ?) WHERE id = ? AND status = ? '
+                'AND (claimed_by IS NULL OR claimed_by = ? OR lease_until < ?)',
+                (self.worker_id, now + LEASE_SECONDS, now, row[0], STATUS_RUNNING,
+                 self.worker_id, now))
+            conn.commit()
+            return row if c.rowcount == 1 else None
+        finally:
+            conn.close()
+
+    def _renew(self, campaign_id):
+        """续租；活动已暂停 / 取消或被其他进程接管返回 False"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE dm_campaigns SET lease_until = ? WHERE id = ? AND claimed_by = ? AND status = ?',
+                      (time.time() + LEASE_SECONDS, campaign_id, self.worker_id, STATUS_RUNNING))
+            conn.commit()
+            return c.rowcount == 1
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _next_chunk(cursor, chunk_size):
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(
+                'SELECT telegram_id FROM members WHERE telegram_id > ? ORDER BY telegram_id LIMIT ?',
+                (cursor or 0, chunk_size)).fetchall()
+        finally:
+            conn.close()
+        return [row[0] for row in rows]
+
+    def _save_progress(self, campaign_id, cursor, counts):
+        """保存进度并续租，返回活动当前状态（后台暂停 / 取消后停止发送）"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute(
+                'UPDATE dm_campaigns SET cursor = ?, sent_count = sent_count + ?, '
+                'failed_count = failed_count + ?, deferred_count = deferred_count + ?, '
+                'lease_until = ? WHERE id = ? AND claimed_by = ?',
+                (cursor, counts['sent'], counts['failed'], counts['deferred'],
+                 time.time() + LEASE_SECONDS, campaign_id, self.worker_id))
+            if c.rowcount != 1:
+                conn.commit()
+                return None  # 租约已被其他进程接管
+            c.execute('SELECT status FROM dm_campaigns WHERE id = ?', (campaign_id,))
+            status = c.fetchone()[0]
+            if status != STATUS_RUNNING:
+                # 释放活动，继续时任意进程都可立即领取
+                c.execute('UPDATE dm_campaigns SET claimed_by = NULL, lease_until = NULL WHERE id = ?',
+                          (campaign_id,))
+            conn.commit()
+            return status
+        finally:
+            conn.close()
+
+    def _complete(self, campaign_id):
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'UPDATE dm_campaigns SET status = ?, finish_time = ?, claimed_by = NULL, lease_until = NULL '
+                'WHERE id = ? AND claimed_by = ? AND status = ?',
+                (STATUS_COMPLETED, get_cn_time(), campaign_id, self.worker_id, STATUS_RUNNING))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+dm_campaign_runner = DmCampaignRunner()
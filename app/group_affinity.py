@@ -0,0 +1,126 @@
+"""
+群组 -> 管理员机器人 对应关系 - 群发从群内实际是管理员的机器人发出
+1. 群组健康检测 / 绑定检测确认某个机器人是群管理员时写入 member_groups.bot_id
+2. 内存中保存 群用户名 / 群ID -> bot_id（只取 is_bot_admin = 1 的记录），发送群发时作为首选机器人
+3. 对应关系变化时递增版本号，其他进程每 VERSION_CHECK_INTERVAL 秒检测一次并重新加载
+4. 首选机器人不可用时仍由 SendDispatcher 切换到其他机器人
+"""
+import threading
+import time
+
+from .database import get_db_conn, get_cache_version, bump_cache_version
+from .send_dispatcher import peer_key
+from .group_peers import group_peers, bare_id
+
+CACHE_NAME = 'group_bot_affinity'
+VERSION_CHECK_INTERVAL = 5
+
+
+def _keys(group_link=None, group_id=None):
+    keys = []
+    if group_link and 't.me/+' not in group_link and 'joinchat/' not in group_link:
+        keys.append(peer_key(group_link))
+    group_id = bare_id(group_id)
+    if group_id:
+        keys.append(group_id)
+    return keys
+
+
+class GroupAffinity:
+    """群用户名 / 群ID -> 管理员 bot_id"""
+
+    def __init__(self):
+        self._owners = {}
+        self._version = None
+        self._version_checked = 0
+        self._lock = threading.Lock()
+
+    def _sync_version(self):
+        now = time.time()
+        if self._version is not None and now - self._version_checked < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        try:
+            version = get_cache_version(CACHE_NAME)
+        except Exception:
+            return
+        if version != self._version:
+            self._reload()
+            self._version = version
+
+    def _reload(self):
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(
+                'SELECT group_link, group_id, bot_id FROM member_groups '
+                'WHERE is_bot_admin = 1 AND bot_id IS NOT NULL').fetchall()
+        finally:
+            conn.close()
+        owners = {}
+        for group_link, group_id, bot_id in rows:
+            for key in _keys(group_link, group_id):
+                owners[key] = bot_id
+        with self._lock:
+            self._owners = owners
+
+    def _bump(self):
+        """本进程写入后递增版本号；期间其他进程也有写入时立即重新加载"""
+        version = bump_cache_version(CACHE_NAME)
+        if self._version is None:  # 尚未加载过时保持 None，首次查询时整表加载
+            return
+        if version == self._version + 1:
+            self._version = version
+            self._version_checked = time.time()
+        else:
+            self._version_checked = 0
+
+    # ---------- 查询 ----------
+
+    def owner(self, group):
+        """
+        群链接 / 用户名 / 群ID 对应的管理员 bot_id，未知返回 None
+        私有邀请链接（t.me/+xxx）本身不作为键，按 group_peers 记录的群ID查找
+        """
+        self._sync_version()
+        if isinstance(group, str) and group.lstrip('-').isdigit():
+            group = int(group)
+        if isinstance(group, int):
+            return self._owners.get(bare_id(group))
+        if isinstance(group, str) and ('t.me/+' in group or 'joinchat/' in group):
+            group_id = group_peers.group_id(group)
+            return self._owners.get(group_id) if group_id else None
+        return self._owners.get(peer_key(group))
+
+    # ---------- 更新 ----------
+
+    def set_owner(self, bot_id, group_link=None, group_id=None, row_id=None):
+        """记录管理员机器人：有 row_id 时只更新该行，否则按群链接更新所有绑定该群的记录"""
+        keys = _keys(group_link, group_id)
+        if not bot_id or not keys:
+            return
+        with self._lock:
+            if all(self._owners.get(key) == bot_id for key in keys):
+                return
+            for key in keys:
+                self._owners[key] = bot_id
+        conn = get_db_conn()
+        try:
+            if row_id is not None:
+                conn.execute('UPDATE member_groups SET bot_id = ? WHERE id = ?', (bot_id, row_id))
+            else:
+                conn.execute('UPDATE member_groups SET bot_id = ? WHERE group_link = ?',
+                             (bot_id, group_link))
+            conn.commit()
+        finally:
+            conn.close()
+        self._bump()
+
+    def forget(self, group_link=None, group_id=None):
+        """机器人失去管理员权限：不再优先使用（数据库中 is_bot_admin = 0 的记录重新加载时不会载入）"""
+        with self._lock:
+            removed = [self._owners.pop(key, None) for key in _keys(group_link, group_id)]
+        if any(removed):
+            self._bump()
+
+
+group_affinity = GroupAffinity()
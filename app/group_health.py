@@ -0,0 +1,290 @@
+"""
+群组健康调度器 - 替代每30秒全量轮询所有绑定群组
+1. 事件驱动：Raw 权限变更 / ChatAction 事件把对应群标记为立即检测
+   （调度器不在本进程运行时，例如分角色部署的 bot 进程，标记写入 cache_events，由 worker 进程读取）
+2. 兜底轮询：按「最久未检测」优先级出队，状态稳定的群逐步放宽检测间隔
+3. 预算控制：每个机器人每分钟最多调用 N 次检测 API，并优先使用已在群内的机器人
+"""
+import asyncio
+import heapq
+import random
+import time
+
+# 单次检测超时（秒）
+CHECK_TIMEOUT = 15
+# 重新从数据库加载群组列表的间隔（秒）
+RELOAD_INTERVAL = 300
+# 检测其他进程标记事件的间隔（秒）
+EVENT_POLL_INTERVAL = 5
+EVENT_NAME = 'group_health_dirty'
+
+
+def chat_key(chat_id):
+    """统一群ID格式（去掉 -100 前缀和符号），用于匹配事件与数据库记录"""
+    try:
+        text = str(chat_id)
+        if text.startswith('-100'):
+            text = text[4:]
+        return abs(int(text))
+    except (TypeError, ValueError):
+        return None
+
+
+class GroupHealthScheduler:
+    """按优先级队列调度群组检测，检测结果通过回调交给业务层处理"""
+
+    def __init__(self, budget_per_bot=20, min_interval=60, max_interval=3600):
+        self.budget_per_bot = max(1, budget_per_bot)
+        self.min_interval = min_interval
+        self.max_interval = max(min_interval, max_interval)
+        self._heap = []          # (due_ts, row_id)
+        self._groups = {}        # row_id -> 群组状态
+        self._by_chat = {}       # chat_key -> set(row_id)
+        self._buckets = {}       # bot_id -> [tokens, last_refill_ts]
+        self._wakeup = None
+        self._loaded_at = 0
+        self._event_version = None
+        self._event_id = None
+        self._events_checked = 0
+        self.stats = {'checks': 0, 'events': 0, 'changes': 0, 'budget_waits': 0, 'errors': 0}
+
+    # ---------- 群组列表 ----------
+
+    def load(self, rows):
+        """
+        同步数据库中的群组列表
+        rows: [(member_groups.id, telegram_id, group_id, group_link, is_bot_admin, bot_id)]
+        """
+        now = time.time()
+        seen = set()
+        for row_id, uid, gid, link, is_admin, bot_id in rows:
+            if not gid and not link:
+                continue
+            seen.add(row_id)
+            entry = self._groups.get(row_id)
+            if entry is None:
+                entry = {
+                    'id': row_id, 'uid': uid, 'gid': gid, 'link': link,
+                    'is_admin': is_admin or 0, 'interval': self.min_interval,
+                    'due': 0, 'present': set(), 'tried': set()
+                }
+                self._groups[row_id] = entry
+                # 新加载的群在一个最小间隔内打散，避免启动时集中检测
+                self._schedule(entry, now + random.uniform(0, self.min_interval))
+            else:
+                if entry['gid'] != gid or entry['link'] != link:
+                    self._unindex(entry)
+                    entry['present'].clear()
+                    self._schedule(entry, now)
+                entry.update(uid=uid, gid=gid, link=link, is_admin=is_admin or 0)
+            if bot_id:
+                entry['present'].add(bot_id)
+            key = chat_key(gid)
+            if key:
+                self._by_chat.setdefault(key, set()).add(row_id)
+        for row_id in list(self._groups):
+            if row_id not in seen:
+                self._unindex(self._groups.pop(row_id))
+        self._loaded_at = now
+
+    def needs_reload(self):
+        return time.time() - self._loaded_at >= RELOAD_INTERVAL
+
+    def _unindex(self, entry):
+        key = chat_key(entry['gid'])
+        ids = self._by_chat.get(key)
+        if ids:
+            ids.discard(entry['id'])
+            if not ids:
+                del self._by_chat[key]
+
+    def _schedule(self, entry, due):
+        entry['due'] = due
+        heapq.heappush(self._heap, (due, entry['id']))
+
+    # ---------- 事件入口 ----------
+
+    def mark_dirty(self, chat_id, bot_id=None, present=None):
+        """
+        群内发生权限 / 成员变更事件时调用，对应群立即进入检测
+        present: 事件已能确定机器人是否在群内时传入 True / False
+        调度器不在本进程运行时发布事件，由运行调度器的进程处理
+        """
+        if self._wakeup is None:
+            try:
+                from .database import publish_cache_event
+                publish_cache_event(EVENT_NAME, [chat_id, bot_id, present])
+            except Exception as e:
+                print(f"[群组健康] 发布检测事件失败: {e}")
+            return False
+        return self._mark_dirty(chat_id, bot_id, present)
+
+    def _mark_dirty(self, chat_id, bot_id=None, present=None):
+        row_ids = self._by_chat.get(chat_key(chat_id))
+        if not row_ids:
+            return False
+        now = time.time()
+        for row_id in row_ids:
+            entry = self._groups[row_id]
+            if bot_id and present is not None:
+                if present:
+                    entry['present'].add(bot_id)
+                else:
+                    entry['present'].discard(bot_id)
+            entry['interval'] = self.min_interval
+            entry['tried'].clear()
+            self._schedule(entry, now)
+        self.stats['events'] += 1
+        self.wake()
+        return True
+
+    def wake(self):
+        if self._wakeup:
+            self._wakeup.set()
+
+    def _poll_events(self):
+        """读取其他进程发布的检测事件"""
+        now = time.time()
+        if now - self._events_checked < EVENT_POLL_INTERVAL:
+            return
+        self._events_checked = now
+        try:
+            from .database import get_cache_version, get_cache_events
+            version = get_cache_version(EVENT_NAME)
+            if version == self._event_version:
+                return
+            self._event_id, marks = get_cache_events(EVENT_NAME, self._event_id)
+            self._event_version = version
+        except Exception as e:
+            print(f"[群组健康] 读取检测事件失败: {e}")
+            return
+        for chat_id, bot_id, present in marks:
+            self._mark_dirty(chat_id, bot_id, present)
+
+    # ---------- API 预算 ----------
+
+    def _take_token(self, bot_id):
+        now = time.time()
+        bucket = self._buckets.get(bot_id)
+        if bucket is None:
+            bucket = self._buckets[bot_id] = [float(self.budget_per_bot), now]
+        bucket[0] = min(self.budget_per_bot,
+                        bucket[0] + (now - bucket[1]) * self.budget_per_bot / 60.0)
+        bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True
+        return False
+
+    def _pick_client(self, entry, registry, clients):
+        """优先选择已知在群内的机器人，其次选择本轮未尝试过的机器人"""
+        candidates = []
+        for client in clients:
+            bot_id = registry.get_id(client)
+            if bot_id is None or bot_id in entry['tried']:
+                continue
+            candidates.append((bot_id not in entry['present'], random.random(), bot_id, client))
+        candidates.sort()
+        for _, _, bot_id, client in candidates:
+            if self._take_token(bot_id):
+                return bot_id, client
+        return None, None
+
+    # ---------- 调度主循环 ----------
+
+    async def run(self, registry, get_clients, load_rows, on_result):
+        """
+        registry: BotRegistry
+        get_clients: 返回当前在线客户端列表的函数
+        load_rows: 返回 member_groups 行的函数（见 load）
+        on_result: async (entry, is_in_group, admin_bot_id) -> None
+        """
+        from .core_functions import check_bot_membership
+
+        self._wakeup = asyncio.Event()
+        while True:
+            try:
+                if self.needs_reload():
+                    self.load(load_rows())
+                self._poll_events()
+
+                # 丢弃已被重新调度的过期堆项
+                while self._heap and (
+                        self._heap[0][1] not in self._groups
+                        or self._groups[self._heap[0][1]]['due'] != self._heap[0][0]):
+                    heapq.heappop(self._heap)
+
+                now = time.time()
+                timeout = RELOAD_INTERVAL - (now - self._loaded_at)
+                if self._heap:
+                    timeout = min(timeout, self._heap[0][0] - now)
+                timeout = min(timeout, EVENT_POLL_INTERVAL)
+                if timeout > 0:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                if not self._heap:
+                    continue
+                entry = self._groups[self._heap[0][1]]
+                clients = get_clients()
+                bot_id, client = self._pick_client(entry, registry, clients)
+                if client is None:
+                    if clients and len(entry['tried']) >= len(clients):
+                        # 所有机器人都不是该群管理员
+                        heapq.heappop(self._heap)
+                        await self._finish(entry, any(entry['present']), None, on_result)
+                    else:
+                        # 预算耗尽，等待令牌恢复
+                        self.stats['budget_waits'] += 1
+                        await asyncio.sleep(60.0 / self.budget_per_bot)
+                    continue
+
+                heapq.heappop(self._heap)
+                target = entry['gid'] if entry['gid'] else entry['link']
+                if isinstance(target, int) and target > 0:
+                    target = int(f"-100{target}")
+                self.stats['checks'] += 1
+                try:
+                    is_in, is_admin = await asyncio.wait_for(
+                        check_bot_membership(client, target), CHECK_TIMEOUT)
+                except Exception as e:
+                    # 临时错误（超时 / FloodWait），稍后重试
+                    self.stats['errors'] += 1
+                    print(f"[群组健康] 检测 {target} 失败，稍后重试: {e}")
+                    self._schedule(entry, time.time() + self.min_interval)
+                    continue
+
+                if is_in:
+                    entry['present'].add(bot_id)
+                else:
+                    entry['present'].discard(bot_id)
+                if is_admin:
+                    await self._finish(entry, True, bot_id, on_result)
+                else:
+                    # 该机器人不是管理员，立即换下一个机器人确认
+                    entry['tried'].add(bot_id)
+                    self._schedule(entry, time.time())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[群组健康] 调度异常: {e}")
+                await asyncio.sleep(5)
+
+    async def _finish(self, entry, is_in, admin_bot_id, on_result):
+        healthy = 1 if admin_bot_id else 0
+        if healthy != entry['is_admin']:
+            # 状态变化：恢复最小检测间隔
+            self.stats['changes'] += 1
+            entry['interval'] = self.min_interval
+        else:
+            entry['interval'] = min(entry['interval'] * 2, self.max_interval)
+        entry['tried'].clear()
+        self._schedule(entry, time.time() + entry['interval'])
+        try:
+            await on_result(entry, is_in, admin_bot_id)
+        finally:
+            entry['is_admin'] = healthy
@@ -0,0 +1,222 @@
+"""
+群组 InputPeer 存储 - 群发按 群ID + 各机器人的 access_hash 直接发送，不再每次解析 @用户名
+1. 绑定群、检测群成员身份、发送成功时记录机器人看到的群实体（group_peers 表，按机器人分开：
+   超级群 / 频道的 access_hash 对每个机器人不同）
+2. 群链接 -> 群ID 取自 member_groups.group_id（没有群ID的记录在首次按用户名发送成功后补上）
+3. 发送时 SendDispatcher 按选中的机器人换成 InputPeerChannel / InputPeerChat，
+   不需要 ResolveUsername，私有邀请链接（t.me/+xxx）的群也能发送
+4. access_hash 失效（机器人被移出 / 群被删除）时删除该机器人的记录，改用其他机器人或用户名
+"""
+import threading
+import time
+
+from telethon import utils
+from telethon.tl.types import InputPeerChannel, InputPeerChat
+
+from .database import get_db_conn, get_cn_time, get_cache_version, bump_cache_version
+
+CACHE_NAME = 'group_peers'
+VERSION_CHECK_INTERVAL = 5
+
+
+def link_key(link):
+    """群链接 / @用户名 -> 统一键（与 send_dispatcher.peer_key 一致）"""
+    text = link.strip()
+    if 't.me/' in text:
+        text = text.split('t.me/')[-1].split('/')[0].split('?')[0]
+    return text.lstrip('@').lower()
+
+
+def bare_id(group_id):
+    """-100xxx / -xxx / xxx -> 不带前缀的群ID"""
+    try:
+        group_id = int(group_id)
+    except (TypeError, ValueError):
+        return None
+    if group_id < 0:
+        return utils.resolve_id(group_id)[0]
+    return group_id or None
+
+
+def _input_peer(entity):
+    """群实体 -> 可长期保存的 InputPeerChannel / InputPeerChat；取不到 access_hash 返回 None"""
+    try:
+        peer = utils.get_input_peer(entity, allow_self=False)
+    except (TypeError, ValueError):
+        return None
+    if isinstance(peer, InputPeerChannel):
+        return peer if peer.access_hash else None
+    if isinstance(peer, InputPeerChat):
+        return peer
+    return None
+
+
+def _peer_id(peer):
+    return peer.channel_id if isinstance(peer, InputPeerChannel) else peer.chat_id
+
+
+class GroupPeerStore:
+    """(群ID, bot_id) -> InputPeer，群链接 -> 群ID"""
+
+    def __init__(self):
+        self._peers = {}       # (群ID, bot_id) -> InputPeerChannel / InputPeerChat
+        self._group_ids = {}   # 群链接键 -> 群ID
+        self._bots = {}        # 群ID -> {bot_id}（有记录的机器人，即已知在群内）
+        self._version = None
+        self._version_checked = 0
+        self._lock = threading.Lock()
+        self.stats = {'direct': 0, 'learned': 0, 'invalidated': 0}
+
+    def _sync_version(self):
+        now = time.time()
+        if self._version is not None and now - self._version_checked < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        try:
+            version = get_cache_version(CACHE_NAME)
+        except Exception:
+            return
+        if version != self._version:
+            self._reload()
+            self._version = version
+
+    def _reload(self):
+        conn = get_db_conn()
+        try:
+            peer_rows = conn.execute(
+                'SELECT group_id, bot_id, peer_type, access_hash FROM group_peers').fetchall()
+            link_rows = conn.execute(
+                "SELECT group_link, group_id FROM member_groups "
+                "WHERE group_id IS NOT NULL AND group_link IS NOT NULL AND group_link != ''").fetchall()
+        finally:
+            conn.close()
+        peers = {}
+        bots = {}
+        for group_id, bot_id, peer_type, access_hash in peer_rows:
+            if peer_type == 'channel':
+                peers[(group_id, bot_id)] = InputPeerChannel(group_id, int(access_hash))
+            else:
+                peers[(group_id, bot_id)] = InputPeerChat(group_id)
+            bots.setdefault(group_id, set()).add(bot_id)
+        group_ids = {}
+        for group_link, group_id in link_rows:
+            group_id = bare_id(group_id)
+            if group_id:
+                group_ids[link_key(group_link)] = group_id
+        with self._lock:
+            self._peers = peers
+            self._group_ids = group_ids
+            self._bots = bots
+
+    def _bump(self):
+        """本进程写入后递增版本号；期间其他进程也有写入时立即重新加载"""
+        version = bump_cache_version(CACHE_NAME)
+        if self._version is None:  # 尚未加载过时保持 None，首次查询时整表加载
+            return
+        if version == self._version + 1:
+            self._version = version
+            self._version_checked = time.time()
+        else:
+            self._version_checked = 0
+
+    # ---------- 查询 ----------
+
+    def group_id(self, peer):
+        """群链接 / 用户名 / 群ID -> 不带前缀的群ID，未知返回 None"""
+        if isinstance(peer, int):
+            return bare_id(peer)
+        if isinstance(peer, str):
+            self._sync_version()
+            return self._group_ids.get(link_key(peer))
+        return None
+
+    def input_peer(self, bot_id, peer):
+        """该机器人可直接使用的 InputPeer，没有记录返回 None（调用方按原样发送）"""
+        if bot_id is None or not isinstance(peer, (int, str)):
+            return None
+        self._sync_version()
+        group_id = self.group_id(peer)
+        if group_id is None:
+            return None
+        peer = self._peers.get((group_id, bot_id))
+        if peer is not None:
+            self.stats['direct'] += 1
+        return peer
+
+    def bots_for(self, peer):
+        """记录过该群 InputPeer 的机器人（即已知在群内的机器人）"""
+        self._sync_version()
+        group_id = self.group_id(peer)
+        if group_id is None:
+            return set()
+        return set(self._bots.get(group_id, ()))
+
+    # ---------- 记录 ----------
+
+    def remember(self, bot_id, entity, group_link=None):
+        """记录机器人看到的群实体（Channel / Chat / InputPeer 均可）"""
+        peer = _input_peer(entity) if entity is not None else None
+        if bot_id is None or peer is None:
+            return
+        group_id = _peer_id(peer)
+        key = link_key(group_link) if group_link else None
+        with self._lock:
+            known = self._peers.get((group_id, bot_id)) == peer and \
+                (key is None or self._group_ids.get(key) == group_id)
+            if known:
+                return
+            self._peers[(group_id, bot_id)] = peer
+            self._bots.setdefault(group_id, set()).add(bot_id)
+            if key:
+                self._group_ids[key] = group_id
+        is_channel = isinstance(peer, InputPeerChannel)
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO group_peers (group_id, bot_id, peer_type, access_hash, update_time) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (group_id, bot_id, 'channel' if is_channel else 'chat',
+                 str(peer.access_hash) if is_channel else None, get_cn_time()))
+            if group_link:
+                # 早期绑定 / 后台添加的群没有群ID，补上后私有链接也能按ID发送
+                conn.execute(
+                    "UPDATE member_groups SET group_id = ? WHERE group_link IN (?, ?) "
+                    "AND (group_id IS NULL OR group_id = '')",
+                    (utils.get_peer_id(peer), group_link, f'https://t.me/{key}'))
+            conn.commit()
+        finally:
+            conn.close()
+        self.stats['learned'] += 1
+        self._bump()
+
+    def remember_sent(self, bot_id, peer, message):
+        """按用户名 / 链接发送成功后，从返回的消息里记录 InputPeer"""
+        if not isinstance(peer, str):
+            return
+        try:
+            input_chat = getattr(message, 'input_chat', None)
+        except Exception:
+            return
+        if input_chat is not None:
+            self.remember(bot_id, input_chat, peer)
+
+    def forget(self, bot_id, peer):
+        """access_hash 失效：删除该机器人的记录"""
+        group_id = self.group_id(peer) if isinstance(peer, (int, str)) else None
+        if bot_id is None or group_id is None:
+            return
+        with self._lock:
+            if self._peers.pop((group_id, bot_id), None) is None:
+                return
+            self._bots.get(group_id, set()).discard(bot_id)
+        conn = get_db_conn()
+        try:
+            conn.execute('DELETE FROM group_peers WHERE group_id = ? AND bot_id = ?', (group_id, bot_id))
+            conn.commit()
+        finally:
+            conn.close()
+        self.stats['invalidated'] += 1
+        self._bump()
+
+
+group_peers = GroupPeerStore()
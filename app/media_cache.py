@@ -0,0 +1,147 @@
+"""
+已上传媒体缓存 - 同一个本地文件只上传一次
+1. 按 文件内容 SHA-256 + 机器人ID 记录 Telegram 返回的 Photo / Document（id、access_hash、file_reference）
+   （文件引用只对上传它的机器人有效，所以按机器人分开记录）
+2. 之后发送同一文件直接引用已上传的媒体，不再上传文件内容
+3. 文件引用过期 / 失效时自动重新上传并更新缓存
+4. 缓存写入 media_cache 表，重启后仍可复用
+文件哈希按 (路径, 修改时间, 大小) 缓存，同一文件不会重复计算
+"""
+import hashlib
+import os
+import threading
+
+from telethon import errors
+from telethon.tl.types import (
+    InputPhoto, InputDocument, MessageMediaPhoto, MessageMediaDocument
+)
+
+from .database import get_db_conn, get_cn_time
+
+HASH_CHUNK = 1024 * 1024
+
+# 这些错误说明缓存的引用不可再用，需要重新上传
+_STALE_REFERENCE_ERRORS = (
+    errors.FileReferenceExpiredError,
+    errors.FileReferenceInvalidError,
+    errors.FileReferenceEmptyError,
+    errors.MediaEmptyError,
+)
+
+
+def _input_media_from_message(message):
+    """从发送成功的消息中取出可复用的 InputPhoto / InputDocument"""
+    media = getattr(message, 'media', None)
+    if isinstance(media, MessageMediaPhoto) and media.photo:
+        photo = media.photo
+        return 'photo', InputPhoto(photo.id, photo.access_hash, photo.file_reference)
+    if isinstance(media, MessageMediaDocument) and media.document:
+        doc = media.document
+        return 'document', InputDocument(doc.id, doc.access_hash, doc.file_reference)
+    return None, None
+
+
+class MediaCache:
+    """(文件哈希, 机器人ID) -> InputPhoto / InputDocument"""
+
+    def __init__(self):
+        self._hashes = {}    # 路径 -> (修改时间, 大小, 哈希)
+        self._entries = {}   # (哈希, bot_id) -> InputPhoto / InputDocument
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'uploads': 0, 'reuploads': 0}
+
+    # ---------- 文件哈希 ----------
+
+    def file_hash(self, path):
+        stat = os.stat(path)
+        cached = self._hashes.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                digest.update(chunk)
+        value = digest.hexdigest()
+        self._hashes[path] = (stat.st_mtime, stat.st_size, value)
+        return value
+
+    # ---------- 缓存读写 ----------
+
+    def get(self, file_hash, bot_id):
+        key = (file_hash, bot_id)
+        media = self._entries.get(key)
+        if media is not None:
+            return media
+        conn = get_db_conn()
+        try:
+            row = conn.execute(
+                'SELECT media_type, media_id, access_hash, file_reference FROM media_cache '
+                'WHERE file_hash = ? AND bot_id = ?', (file_hash, bot_id)).fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        media_type, media_id, access_hash, file_reference = row
+        cls = InputPhoto if media_type == 'photo' else InputDocument
+        media = cls(int(media_id), int(access_hash), bytes(file_reference or b''))
+        with self._lock:
+            self._entries[key] = media
+        return media
+
+    def put(self, file_hash, bot_id, message):
+        media_type, media = _input_media_from_message(message)
+        if media is None:
+            return
+        with self._lock:
+            self._entries[(file_hash, bot_id)] = media
+        conn = get_db_conn()
+        try:
+            # id / access_hash 是 64 位有符号整数，按文本保存避免溢出问题
+            conn.execute(
+                'INSERT OR REPLACE INTO media_cache '
+                '(file_hash, bot_id, media_type, media_id, access_hash, file_reference, update_time) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (file_hash, bot_id, media_type, str(media.id), str(media.access_hash),
+                 media.file_reference, get_cn_time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def drop(self, file_hash, bot_id):
+        with self._lock:
+            self._entries.pop((file_hash, bot_id), None)
+        conn = get_db_conn()
+        try:
+            conn.execute('DELETE FROM media_cache WHERE file_hash = ? AND bot_id = ?',
+                         (file_hash, bot_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- 发送 ----------
+
+    async def send_file(self, client, bot_id, entity, path, *args, **kwargs):
+        """发送本地文件：有缓存时引用已上传的媒体，否则上传并记录"""
+        if bot_id is None:
+            return await client.send_file(entity, path, *args, **kwargs)
+        file_hash = self.file_hash(path)
+        cached = self.get(file_hash, bot_id)
+        if cached is not None:
+            try:
+                message = await client.send_file(entity, cached, *args, **kwargs)
+                self.stats['hits'] += 1
+                return message
+            except _STALE_REFERENCE_ERRORS as e:
+                print(f'[媒体缓存] 引用失效，重新上传 {os.path.basename(path)}: {type(e).__name__}')
+                self.drop(file_hash, bot_id)
+                self.stats['reuploads'] += 1
+        message = await client.send_file(entity, path, *args, **kwargs)
+        self.stats['uploads'] += 1
+        try:
+            self.put(file_hash, bot_id, message)
+        except Exception as e:
+            print(f'[媒体缓存] 记录失败: {e}')
+        return message
+
+
+media_cache = MediaCache()
@@ -0,0 +1,349 @@
+"""
+运行指标 - 耗时直方图与计数器，以 Prometheus 文本格式输出（不依赖 prometheus_client）
+1. 机器人处理器：multi_bot_on 注册的处理器与路由中的每个处理器
+2. Web 接口：每个 Flask 路由（按 url_rule 归类）
+3. 数据库：get_db_conn 连接上的每次 execute（按调用位置 模块.函数 归类）
+4. Telegram 请求：按请求类型（如 SendMessageRequest）
+METRICS_ENABLED 关闭时装饰器原样返回函数、数据库和客户端使用原始类，几乎没有额外开销
+"""
+import os
+import sqlite3
+import sys
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+
+from .config import METRICS_ENABLED, METRICS_TOKEN
+
+# 耗时直方图默认分桶（秒）
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_INF_LABEL = 'le="+Inf"'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增计数器"""
+
+    type_name = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}   # labels tuple -> 数值
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def set_total(self, *labels, value):
+        """由外部累计的计数（如路由丢弃次数）在输出前同步进来"""
+        with _lock:
+            self._values[labels] = value
+
+    def collect(self):
+        with _lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            yield f'{self.name}{_format_labels(self.labelnames, labels)} {_format_number(value)}'
+
+
+class Histogram:
+    """耗时直方图：每组标签保存各分桶计数、总和与次数"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._values = {}   # labels tuple -> [分桶计数..., sum, count]
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+        with _lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [0] * len(self.buckets) + [0.0, 0]
+            if index < len(self.buckets):
+                entry[index] += 1
+            entry[-2] += value
+            entry[-1] += 1
+
+    def collect(self):
+        with _lock:
+            items = sorted((labels, list(entry)) for labels, entry in self._values.items())
+        for labels, entry in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, entry):
+                cumulative += count
+                le = f'le="{_format_number(bound)}"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}'
+            yield f'{self.name}_bucket{_format_labels(self.labelnames, labels, _INF_LABEL)} {entry[-1]}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {entry[-2]:.6f}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {entry[-1]}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []   # 输出前调用，用于同步外部统计
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                print(f'[指标] 收集失败: {e}')
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type_name}')
+            lines.extend(metric.collect())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+handler_seconds = registry.register(Histogram(
+    'bot_handler_seconds', '机器人处理器耗时', ('handler',)))
+handler_errors = registry.register(Counter(
+    'bot_handler_errors_total', '机器人处理器异常次数', ('handler',)))
+updates_dropped = registry.register(Counter(
+    'bot_updates_dropped_total', '快速过滤丢弃的消息数', ('reason',)))
+http_seconds = registry.register(Histogram(
+    'http_request_seconds', 'Web 接口耗时', ('method', 'endpoint')))
+http_requests = registry.register(Counter(
+    'http_requests_total', 'Web 请求次数', ('method', 'endpoint', 'status')))
+db_seconds = registry.register(Histogram(
+    'db_query_seconds', '数据库语句耗时（按调用位置）', ('site',)))
+db_errors = registry.register(Counter(
+    'db_query_errors_total', '数据库语句异常次数', ('site',)))
+telegram_seconds = registry.register(Histogram(
+    'telegram_request_seconds', 'Telegram API 请求耗时', ('request',)))
+telegram_errors = registry.register(Counter(
+    'telegram_request_errors_total', 'Telegram API 请求异常次数', ('request', 'error')))
+
+
+# ==================== 机器人处理器 ====================
+
+def timed_handler(name=None):
+    """异步处理器计时装饰器（未启用指标时原样返回）"""
+    def decorator(handler):
+        if not METRICS_ENABLED:
+            return handler
+        label = name or handler.__name__
+
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                handler_errors.inc(label)
+                raise
+            finally:
+                handler_seconds.observe(time.perf_counter() - start, label)
+        return wrapper
+    return decorator
+
+
+def observe_route(route, seconds, error):
+    """UpdateRouter 计时钩子：按路由记录处理器耗时"""
+    handler_seconds.observe(seconds, route)
+    if error is not None:
+        handler_errors.inc(route)
+
+
+# ==================== 数据库 ====================
+
+_site_names = {}   # 文件路径 -> 模块名
+
+
+def _call_site():
+    """跳过本模块内的栈帧，返回 '模块.函数'"""
+    frame = sys._getframe(1)
+    while frame is not None and frame.f_code.co_filename == __file__:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    code = frame.f_code
+    module = _site_names.get(code.co_filename)
+    if module is None:
+        module = _site_names[code.co_filename] = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f'{module}.{code.co_name}'
+
+
+def _timed_db_call(method, *args):
+    site = _call_site()
+    start = time.perf_counter()
+    try:
+        return method(*args)
+    except Exception:
+        db_errors.inc(site)
+        raise
+    finally:
+        db_seconds.observe(time.perf_counter() - start, site)
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return _timed_db_call(super().execute, *args)
+
+    def executemany(self, *args):
+        return _timed_db_call(super().executemany, *args)
+
+    def executescript(self, *args):
+        return _timed_db_call(super().executescript, *args)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3.connect(..., factory=InstrumentedConnection)：所有语句按调用位置计时"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def executemany(self, *args):
+        return self.cursor().executemany(*args)
+
+    def executescript(self, *args):
+        return self.cursor().executescript(*args)
+
+
+def connection_factory():
+    """get_db_conn 使用的连接类"""
+    return InstrumentedConnection if METRICS_ENABLED else sqlite3.Connection
+
+
+# ==================== Telegram 请求 ====================
+
+_client_class = None
+
+
+def telegram_client_class():
+    """未启用指标时返回 TelegramClient，否则返回按请求类型计时的子类（首次调用时创建）"""
+    global _client_class
+    from telethon import TelegramClient
+    if not METRICS_ENABLED:
+        return TelegramClient
+    if _client_class is None:
+        class InstrumentedTelegramClient(TelegramClient):
+            async def _call(self, sender, request, ordered=False, flood_sleep_threshold=None):
+                label = type(request).__name__
+                start = time.perf_counter()
+                try:
+                    return await super()._call(sender, request, ordered=ordered,
+                                               flood_sleep_threshold=flood_sleep_threshold)
+                except Exception as e:
+                    telegram_errors.inc(label, type(e).__name__)
+                    raise
+                finally:
+                    telegram_seconds.observe(time.perf_counter() - start, label)
+        _client_class = InstrumentedTelegramClient
+    return _client_class
+
+
+# ==================== Web ====================
+
+def _authorized(token, authorization):
+    """?token= 或 Authorization: Bearer 与 METRICS_TOKEN 一致；未配置令牌时一律拒绝"""
+    if not METRICS_TOKEN:
+        return False
+    return token == METRICS_TOKEN or authorization == f'Bearer {METRICS_TOKEN}'
+
+
+def init_app(app):
+    """为 Flask app 注册请求计时与 /metrics 接口（未启用指标时不做任何事）"""
+    if not METRICS_ENABLED:
+        return
+    from flask import Response, g, request
+
+    @app.before_request
+    def _metrics_start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _metrics_record(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            http_seconds.observe(time.perf_counter() - start, request.method, endpoint)
+            http_requests.inc(request.method, endpoint, str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        # 令牌（供 Prometheus 抓取）或已登录的管理员
+        from flask_login import current_user
+        if not current_user.is_authenticated and \
+                not _authorized(request.args.get('token'), request.headers.get('Authorization', '')):
+            return Response('unauthorized\n', status=401, mimetype='text/plain')
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+
+def start_http_server(port, host='0.0.0.0'):
+    """单独运行 bot / worker 角色时（没有 Flask）在后台线程提供 /metrics"""
+    if not METRICS_ENABLED or not port:
+        return None
+    if not METRICS_TOKEN:
+        print('[指标] 未配置 METRICS_TOKEN，不在独立端口提供 /metrics')
+        return None
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from urllib.parse import parse_qs, urlparse
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path != '/metrics':
+                self.send_error(404)
+                return
+            token = parse_qs(url.query).get('token', [None])[0]
+            if not _authorized(token, self.headers.get('Authorization', '')):
+                self.send_error(401)
+                return
+            body = registry.render().encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f'[指标] /metrics 已在端口 {port} 提供')
+    return server
@@ -0,0 +1,213 @@
+"""
+通知发件箱 - 发给单个用户的通知（提现审核、后台群发会员、内部通知接口）先写入 notify_outbox 表
+1. 任意进程 / 线程调用 database.enqueue_notification 入队，重启不丢失
+2. 机器人进程内：轮询任务把到期的记录放进 asyncio.Queue，N 个发送协程并发投递
+   （同进程入队时立即唤醒轮询，其他进程入队的记录在下一次轮询时取到）
+3. 发送统一经由 SendDispatcher，受 SendRateLimiter 限速
+4. 失败按指数退避重试，超过次数或遇到永久错误（用户拉黑 / 注销）标记为 failed
+5. 领取时记录 claimed_by / lease_until；进程退出后租约到期的记录由任意进程放回待发送，
+   不影响其他仍在运行的进程正在发送的记录
+"""
+import asyncio
+import time
+
+from telethon import errors
+
+from .database import get_db_conn, get_cn_time
+from .send_suppression import PeerSuppressedError
+from .broadcast_queue import make_worker_id
+
+# 轮询间隔（秒）：兜底取其他进程写入的记录
+POLL_INTERVAL = 2
+# 每次轮询最多取出的记录数
+FETCH_BATCH = 200
+# 重试间隔：RETRY_BASE_DELAY * 2^(attempts-1)，最多 RETRY_MAX_DELAY
+RETRY_BASE_DELAY = 10
+RETRY_MAX_DELAY = 1800
+# 已发送记录保留时间（秒）
+SENT_RETENTION = 7 * 86400
+CLEANUP_INTERVAL = 3600
+# 租约时长（秒）：需长于单条发送的最长耗时（SendDispatcher 最多等待 FloodWait 300 秒）
+LEASE_SECONDS = 600
+# 检查租约过期记录的间隔（秒）
+RECOVER_INTERVAL = 60
+
+STATUS_PENDING = 'pending'
+STATUS_SENDING = 'sending'
+STATUS_SENT = 'sent'
+STATUS_FAILED = 'failed'
+
+# 这些错误重试也不会成功
+_PERMANENT_ERRORS = (
+    errors.UserIsBlockedError,
+    errors.InputUserDeactivatedError,
+    errors.UserDeactivatedError,
+    errors.PeerIdInvalidError,
+    PeerSuppressedError,
+)
+
+
+class NotifyOutbox:
+    """notify_outbox 表的投递端"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self._queue = None
+        self._wake = None
+        self._loop = None
+        self._queued = set()   # 已放进队列 / 正在发送的记录ID
+        self.stats = {'sent': 0, 'retried': 0, 'failed': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self, send, workers=4, max_attempts=5):
+        """
+        send: async send(member_id, message)
+        启动 workers 个发送协程，本协程负责轮询数据库
+        """
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._wake = asyncio.Event()
+        for _ in range(workers):
+            asyncio.create_task(self._worker(send, max_attempts))
+        print(f'[通知发件箱] 已启动 {workers} 个发送协程')
+
+        last_cleanup = 0
+        last_recover = 0
+        while True:
+            try:
+                if time.time() - last_recover > RECOVER_INTERVAL:
+                    self._recover_expired()
+                    last_recover = time.time()
+                self._fill_queue()
+                if time.time() - last_cleanup > CLEANUP_INTERVAL:
+                    self._cleanup()
+                    last_cleanup = time.time()
+            except Exception as e:
+                print(f'[通知发件箱] 轮询失败: {e}')
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    def _fill_queue(self):
+        conn = get_db_conn()
+        try:
+            rows = conn.execute(
+                'SELECT id FROM notify_outbox WHERE status = ? AND next_attempt_at <= ? '
+                'ORDER BY next_attempt_at, id LIMIT ?',
+                (STATUS_PENDING, time.time(), FETCH_BATCH + len(self._queued))).fetchall()
+        finally:
+            conn.close()
+        for (outbox_id,) in rows:
+            if outbox_id not in self._queued:
+                self._queued.add(outbox_id)
+                self._queue.put_nowait(outbox_id)
+
+    async def _worker(self, send, max_attempts):
+        while True:
+            outbox_id = await self._queue.get()
+            try:
+                item = self._claim(outbox_id)
+                if item:
+                    await self._deliver(send, outbox_id, item, max_attempts)
+            except Exception as e:
+                print(f'[通知发件箱] 处理 #{outbox_id} 出错: {e}')
+            finally:
+                self._queued.discard(outbox_id)
+                if self._queue.empty():
+                    self._wake.set()  # 队列取空后立即查下一批
+
+    async def _deliver(self, send, outbox_id, item, max_attempts):
+        member_id, message, attempts = item
+        try:
+            await send(member_id, message)
+        except Exception as e:
+            attempts += 1
+            error = f'{type(e).__name__}: {e}'[:500]
+            if isinstance(e, _PERMANENT_ERRORS) or attempts >= max_attempts:
+                self._finish(outbox_id, STATUS_FAILED, attempts, error)
+                self.stats['failed'] += 1
+                print(f'[通知发件箱] 通知 #{outbox_id} 发送失败（用户{member_id}）: {error}')
+            else:
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempts - 1))
+                self._finish(outbox_id, STATUS_PENDING, attempts, error, time.time() + delay)
+                self.stats['retried'] += 1
+            return
+        self._finish(outbox_id, STATUS_SENT, attempts + 1)
+        self.stats['sent'] += 1
+
+    # ---------- 状态更新 ----------
+
+    def _claim(self, outbox_id):
+        """pending -> sending（带租约）；返回 (member_id, message, attempts)，已被其他进程领取返回 None"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE notify_outbox SET status = ?, claimed_by = ?, lease_until = ? '
+                      'WHERE id = ? AND status = ?',
+                      (STATUS_SENDING, self.worker_id, time.time() + LEASE_SECONDS,
+                       outbox_id, STATUS_PENDING))
+            if c.rowcount != 1:
+                conn.commit()
+                return None
+            c.execute('SELECT member_id, message, attempts FROM notify_outbox WHERE id = ?',
+                      (outbox_id,))
+            row = c.fetchone()
+            conn.commit()
+            return row
+        finally:
+            conn.close()
+
+    def _finish(self, outbox_id, status, attempts, error=None, next_attempt_at=None):
+        conn = get_db_conn()
+        try:
+            if status == STATUS_SENT:
+                conn.execute(
+                    'UPDATE notify_outbox SET status = ?, attempts = ?, sent_at = ?, sent_time = ?, '
+                    'claimed_by = NULL, lease_until = NULL WHERE id = ?',
+                    (status, attempts, time.time(), get_cn_time(), outbox_id))
+            else:
+                conn.execute(
+                    'UPDATE notify_outbox SET status = ?, attempts = ?, last_error = ?, '
+                    'next_attempt_at = COALESCE(?, next_attempt_at), claimed_by = NULL, lease_until = NULL '
+                    'WHERE id = ?',
+                    (status, attempts, error, next_attempt_at, outbox_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _recover_expired(self):
+        """租约已过期（领取它的进程已退出）的发送中记录重新放回待发送"""
+        conn = get_db_conn()
+        try:
+            conn.execute('UPDATE notify_outbox SET status = ?, claimed_by = NULL, lease_until = NULL '
+                         'WHERE status = ? AND (lease_until IS NULL OR lease_until < ?)',
+                         (STATUS_PENDING, STATUS_SENDING, time.time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _cleanup(self):
+        conn = get_db_conn()
+        try:
+            conn.execute('DELETE FROM notify_outbox WHERE status = ? AND sent_at < ?',
+                         (STATUS_SENT, time.time() - SENT_RETENTION))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+notify_outbox = NotifyOutbox()
@@ -370,9 +370,9 @@ async def create_recharge_order(bot, event, amount, is_vip_order=False):
         }
         payment_orders[order_number] = order_info
         
-        # 启动支付检查任务
-        payment_task = bot.loop.create_task(check_payment_task(bot, order_info))
-        timeout_task = bot.loop.create_task(payment_timeout_handler(bot, order_info))
+        # 启动支付检查任务（bot 为 SendDispatcher，没有 loop 属性，使用当前事件循环）
+        payment_task = asyncio.get_event_loop().create_task(check_payment_task(bot, order_info))
+        timeout_task = asyncio.get_event_loop().create_task(payment_timeout_handler(bot, order_info))
         payment_tasks[order_number] = (payment_task, timeout_task)
     else:
         # 如果无法解析到USDT地址，提示错误
@@ -0,0 +1,248 @@
+"""
+置顶公告活动 - 发布置顶公告时每个群一行结果（pinned_campaign_results），并发发送、逐群记录
+1. 后台发布时写入活动与各群结果（database.create_pinned_campaign），同一个群只发一次
+2. 机器人进程领取活动（租约），每次取一批到期的待发送群，多个发送协程并发处理：
+   由群的管理员机器人发出（见 group_affinity.py）并置顶，整体仍受 SendRateLimiter 限速
+3. 每个群的结果立即写回：pinned（已置顶）/ sent（已发送但置顶失败，不再重发避免重复）/ failed
+4. 临时错误按退避重试，超过 MAX_ATTEMPTS 或遇到永久错误（机器人被踢 / 无发言权限）标记为 failed；
+   后台可对失败的群重新发送
+5. 发送期间每 LEASE_SECONDS / 3 秒续租一次（单个群的发送可能因 FloodWait 等待数分钟）；
+   进程退出后租约到期，未完成的群由下一次领取继续
+"""
+import asyncio
+import time
+
+from telethon import errors
+
+from .database import get_db_conn, get_cn_time
+from .send_suppression import PeerSuppressedError
+from .broadcast_queue import make_worker_id
+
+LEASE_SECONDS = 120
+POLL_INTERVAL = 5
+# 每次领取的群数
+FETCH_BATCH = 100
+MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 30
+
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+
+RESULT_PENDING = 'pending'
+RESULT_PINNED = 'pinned'
+RESULT_SENT = 'sent'
+RESULT_FAILED = 'failed'
+
+# 这些错误说明所有机器人都无法在该群发言，重试也不会成功
+_PERMANENT_ERRORS = (
+    errors.ChannelPrivateError,
+    errors.ChannelInvalidError,
+    errors.ChatWriteForbiddenError,
+    errors.UserBannedInChannelError,
+    errors.ChatAdminRequiredError,
+    PeerSuppressedError,
+)
+
+
+class PinnedCampaignRunner:
+    """领取进行中的置顶公告活动并并发发送"""
+
+    def __init__(self):
+        self.worker_id = make_worker_id()
+        self._loop = None
+        self._wake = None
+        self.stats = {'pinned': 0, 'sent': 0, 'failed': 0, 'retried': 0}
+
+    # ---------- 唤醒（可在任意线程调用） ----------
+
+    def wake(self):
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._wake.set)
+        except RuntimeError:
+            pass
+
+    # ---------- 运行 ----------
+
+    async def run(self, send, workers=4):
+        """
+        send: async send(group_link, content) -> (是否已置顶, message_id)
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        while True:
+            try:
+                campaign = self._claim()
+                if campaign:
+                    await self._run_batch(campaign, send, workers)
+                    continue
+            except Exception as e:
+                print(f'[置顶公告] 错误: {e}')
+            try:
+                await asyncio.wait_for(self._wake.wait(), POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _run_batch(self, campaign, send, workers):
+        """发送一批到期的群；没有待发送的群时结束活动"""
+        campaign_id, content = campaign
+        links, has_pending = self._due_groups(campaign_id, time.time())
+        if not links:
+            if has_pending:
+                self._release(campaign_id)  # 只剩等待重试的群
+            else:
+                self._complete(campaign_id)
+                print(f'[置顶公告] 活动 #{campaign_id} 发送完成')
+            return
+
+        semaphore = asyncio.Semaphore(max(1, workers))
+        lease_lost = asyncio.Event()
+
+        async def send_one(group_link, attempts):
+            async with semaphore:
+                # 续租并确认活动未被取消 / 接管
+                if lease_lost.is_set() or not self._renew(campaign_id):
+                    lease_lost.set()
+                    return
+                try:
+                    pinned, message_id = await send(group_link, content)
+                except Exception as e:
+                    self._record_failure(campaign_id, group_link, attempts + 1, e)
+                    return
+                status = RESULT_PINNED if pinned else RESULT_SENT
+                self._record(campaign_id, group_link, status, attempts + 1, message_id=message_id)
+                self.stats[status] += 1
+
+        keeper = asyncio.create_task(self._keep_lease(campaign_id, lease_lost))
+        try:
+            await asyncio.gather(*(send_one(link, attempts) for link, attempts in links))
+        finally:
+            keeper.cancel()
+
+    # ---------- 结果 ----------
+
+    def _record_failure(self, campaign_id, group_link, attempts, error):
+        message = f'{type(error).__name__}: {error}'[:200]
+        if isinstance(error, _PERMANENT_ERRORS) or attempts >= MAX_ATTEMPTS:
+            print(f'[置顶公告] 发送到 {group_link} 失败: {message}')
+            self._record(campaign_id, group_link, RESULT_FAILED, attempts, error=message)
+            self.stats['failed'] += 1
+        else:
+            retry_at = time.time() + RETRY_BASE_DELAY * 2 ** (attempts - 1)
+            if isinstance(error, errors.FloodWaitError):
+                retry_at = max(retry_at, time.time() + error.seconds)
+            self._record(campaign_id, group_link, RESULT_PENDING, attempts, error=message,
+                         next_attempt_at=retry_at)
+            self.stats['retried'] += 1
+
+    @staticmethod
+    def _record(campaign_id, group_link, status, attempts, message_id=None, error=None,
+                next_attempt_at=0):
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'UPDATE pinned_campaign_results SET status = ?, attempts = ?, message_id = ?, '
+                'error = ?, next_attempt_at = ? WHERE campaign_id = ? AND group_link = ?',
+                (status, attempts, message_id, error, next_attempt_at, campaign_id, group_link))
+            conn.commit()
+        finally:
+            conn.close()
+
+    # ---------- 活动租约 ----------
+
+    def _claim(self):
+        """
+        领取一个进行中且未被其他进程持有的活动，返回 (id, content)
+        只领取有到期群（或已没有待发送群、需要结束）的活动，等待重试的活动不阻塞其他活动
+        """
+        now = time.time()
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute(
+                'SELECT id, content FROM pinned_campaigns p WHERE status = ? '
+                'AND (claimed_by IS NULL OR claimed_by = ? OR lease_until < ?) '
+                'AND (EXISTS (SELECT 1 FROM pinned_campaign_results r WHERE r.campaign_id = p.id '
+                '             AND r.status = ? AND r.next_attempt_at <= ?) '
+                '     OR NOT EXISTS (SELECT 1 FROM pinned_campaign_results r WHERE r.campaign_id = p.id '
+                '                    AND r.status = ?)) '
+                'ORDER BY id LIMIT 1',
+                (STATUS_RUNNING, self.worker_id, now, RESULT_PENDING, now, RESULT_PENDING))
+            row = c.fetchone()
+            if not row:
+                return None
+            c.execute(
+                'UPDATE pinned_campaigns SET claimed_by = ?, lease_until = ?, '
+                'started_at = COALESCE(started_at, ?) WHERE id = ? AND status = ? '
+                'AND (claimed_by IS NULL OR claimed_by = ? OR lease_until < ?)',
+                (self.worker_id, now + LEASE_SECONDS, now, row[0], STATUS_RUNNING,
+                 self.worker_id, now))
+            conn.commit()
+            return row if c.rowcount == 1 else None
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _due_groups(campaign_id, now):
+        """到期的待发送群 [(group_link, attempts)]，以及是否还有待发送（含等待重试）的群"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute(
+                'SELECT group_link, attempts FROM pinned_campaign_results '
+                'WHERE campaign_id = ? AND status = ? AND next_attempt_at <= ? LIMIT ?',
+                (campaign_id, RESULT_PENDING, now, FETCH_BATCH))
+            links = c.fetchall()
+            has_pending = bool(links) or c.execute(
+                'SELECT 1 FROM pinned_campaign_results WHERE campaign_id = ? AND status = ? LIMIT 1',
+                (campaign_id, RESULT_PENDING)).fetchone() is not None
+        finally:
+            conn.close()
+        return links, has_pending
+
+    async def _keep_lease(self, campaign_id, lease_lost):
+        """发送期间定期续租；租约被接管或活动已取消时通知停止"""
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            if not self._renew(campaign_id):
+                lease_lost.set()
+                return
+
+    def _renew(self, campaign_id):
+        """续租；活动已取消或被其他进程接管返回 False"""
+        conn = get_db_conn()
+        try:
+            c = conn.cursor()
+            c.execute('UPDATE pinned_campaigns SET lease_until = ? WHERE id = ? AND claimed_by = ? AND status = ?',
+                      (time.time() + LEASE_SECONDS, campaign_id, self.worker_id, STATUS_RUNNING))
+            conn.commit()
+            return c.rowcount == 1
+        finally:
+            conn.close()
+
+    def _release(self, campaign_id):
+        """只剩等待重试的群：释放活动，到期后再领取"""
+        conn = get_db_conn()
+        try:
+            conn.execute('UPDATE pinned_campaigns SET claimed_by = NULL, lease_until = NULL '
+                         'WHERE id = ? AND claimed_by = ?', (campaign_id, self.worker_id))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _complete(self, campaign_id):
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'UPDATE pinned_campaigns SET status = ?, finish_time = ?, claimed_by = NULL, lease_until = NULL '
+                'WHERE id = ? AND claimed_by = ? AND status = ?',
+                (STATUS_COMPLETED, get_cn_time(), campaign_id, self.worker_id, STATUS_RUNNING))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+pinned_campaign_runner = PinnedCampaignRunner()
@@ -0,0 +1,265 @@
+"""
+频率限制
+1. SendRateLimiter：令牌桶，按 Telegram 官方限制分层控制主动发送速度
+   - 单个机器人：每秒 BOT_RATE 条（Telegram 按机器人限速，总速度随在线机器人数增加）
+   - 单个私聊：每秒 1 条（允许少量突发）
+   - 单个群组：每分钟 20 条
+   触发 FloodWait 时暂停对应的机器人 / 会话，并降低该机器人的速率，之后随成功发送逐步恢复
+   acquire 可传入 max_wait：需要等待更久时抛出 RateLimitWaitError（交互场景不阻塞处理器）
+2. ButtonRateLimiter：用户按钮点击限制（5秒3次封1分钟，1分钟20次封5分钟）
+"""
+import asyncio
+import time
+from collections import OrderedDict, deque
+
+BOT_RATE = 30             # 条/秒（单个机器人）
+CHAT_RATE = 1             # 条/秒（单个私聊）
+CHAT_BURST = 3
+GROUP_RATE = 20 / 60.0    # 条/秒（单个群组，即每分钟20条）
+GROUP_BURST = 5
+
+# FloodWait 后机器人速率降为原来的比例，之后每次成功发送恢复一点
+FLOOD_BACKOFF = 0.5
+RECOVERY = 1.02
+MIN_RATE_RATIO = 0.1
+
+# 空闲会话令牌桶清理
+PRUNE_EVERY = 1000
+PRUNE_IDLE_SECONDS = 600
+
+
+class RateLimitWaitError(Exception):
+    """取得令牌需要等待的时间超过 max_wait"""
+
+    def __init__(self, seconds):
+        super().__init__(f'需要等待 {seconds:.1f} 秒')
+        self.seconds = seconds
+
+
+class TokenBucket:
+    """令牌桶：rate 条/秒，最多积攒 capacity 个令牌；paused_until 之前不发放令牌"""
+
+    __slots__ = ('base_rate', 'rate', 'capacity', 'tokens', 'updated', 'paused_until')
+
+    def __init__(self, rate, capacity):
+        self.base_rate = rate
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """距离可取得一个令牌还需等待的秒数"""
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def slow_down(self):
+        self.rate = max(self.base_rate * MIN_RATE_RATIO, self.rate * FLOOD_BACKOFF)
+
+    def recover(self):
+        if self.rate < self.base_rate:
+            self.rate = min(self.base_rate, self.rate * RECOVERY)
+
+    def idle(self, now):
+        return self.paused_until < now and self.tokens >= self.capacity - 1 \
+            and now - self.updated > PRUNE_IDLE_SECONDS
+
+
+class SendRateLimiter:
+    """分层令牌桶：机器人 / 私聊 / 群组"""
+
+    def __init__(self):
+        self._bots = {}    # bot_id -> TokenBucket
+        self._chats = {}   # (bot_id, chat_key) -> TokenBucket
+        self._acquired = 0
+        self.stats = {'acquired': 0, 'waited_seconds': 0.0, 'flood_waits': 0}
+
+    def _bot_bucket(self, bot_id):
+        bucket = self._bots.get(bot_id)
+        if bucket is None:
+            bucket = self._bots[bot_id] = TokenBucket(BOT_RATE, BOT_RATE)
+        return bucket
+
+    def _chat_bucket(self, bot_id, chat_key, is_group):
+        key = (bot_id, chat_key)
+        bucket = self._chats.get(key)
+        if bucket is None:
+            if is_group:
+                bucket = TokenBucket(GROUP_RATE, GROUP_BURST)
+            else:
+                bucket = TokenBucket(CHAT_RATE, CHAT_BURST)
+            self._chats[key] = bucket
+        return bucket
+
+    def bot_pause_remaining(self, bot_id):
+        bucket = self._bots.get(bot_id)
+        if not bucket:
+            return 0.0
+        return max(0.0, bucket.paused_until - time.monotonic())
+
+    async def acquire(self, bot_id, chat_key, is_group=False, max_wait=None):
+        """
+        等待直到机器人、会话两层都有令牌，然后各取一个
+        max_wait: 累计需要等待超过该秒数时抛出 RateLimitWaitError（不取令牌）
+        """
+        buckets = (self._bot_bucket(bot_id), self._chat_bucket(bot_id, chat_key, is_group))
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            wait = max(bucket.wait_time(now) for bucket in buckets)
+            if wait <= 0:
+                break
+            if max_wait is not None and waited + wait > max_wait:
+                raise RateLimitWaitError(waited + wait)
+            self.stats['waited_seconds'] += wait
+            waited += wait
+            await asyncio.sleep(wait)
+        for bucket in buckets:
+            bucket.take()
+        self.stats['acquired'] += 1
+        self._acquired += 1
+        if self._acquired % PRUNE_EVERY == 0:
+            self._prune()
+
+    def record_success(self, bot_id):
+        self._bot_bucket(bot_id).recover()
+
+    def record_flood_wait(self, bot_id, chat_key, seconds, is_group=False):
+        """
+        学习 FloodWait：暂停该会话与该机器人 seconds 秒，并降低该机器人速率
+        （Telegram 不告知限制的具体层级，这里按保守策略两层都处理）
+        """
+        now = time.monotonic()
+        self.stats['flood_waits'] += 1
+        chat_bucket = self._chat_bucket(bot_id, chat_key, is_group)
+        chat_bucket.pause(seconds, now)
+        chat_bucket.slow_down()
+        bot_bucket = self._bot_bucket(bot_id)
+        bot_bucket.pause(seconds, now)
+        bot_bucket.slow_down()
+
+    def record_slow_mode(self, bot_id, chat_key, seconds):
+        """群组开启慢速模式：只暂停该群"""
+        self._chat_bucket(bot_id, chat_key, True).pause(seconds, time.monotonic())
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, bucket in self._chats.items() if bucket.idle(now)]:
+            del self._chats[key]
+
+
+send_rate_limiter = SendRateLimiter()
+
+
+# ==================== 按钮点击频率限制 ====================
+
+# 规则A：BURST_WINDOW 秒内第 BURST_CLICKS 次点击 -> 封 BURST_PENALTY 秒
+BURST_WINDOW = 5
+BURST_CLICKS = 3
+BURST_PENALTY = 60
+# 规则B：FLOOD_WINDOW 秒内第 FLOOD_CLICKS 次点击 -> 封 FLOOD_PENALTY 秒
+FLOOD_WINDOW = 60
+FLOOD_CLICKS = 20
+FLOOD_PENALTY = 300
+
+# 最多跟踪的用户数（超出后淘汰最久未点击的用户）
+MAX_TRACKED_USERS = 100000
+# 每 N 次点击清理一次长时间未点击的用户
+SWEEP_EVERY = 500
+
+
+class ButtonRateLimiter:
+    """
+    每个用户只保存最近 FLOOD_CLICKS-1 次点击时间（定长环形队列），判定为 O(1)
+    用户按最近点击时间排序，清理时只需从最旧的一端弹出
+    """
+
+    def __init__(self, max_users=MAX_TRACKED_USERS):
+        self.max_users = max_users
+        self._users = OrderedDict()  # user_id -> [deque(点击时间), 解封时间]
+        self._checks = 0
+        self.stats = {'allowed': 0, 'blocked': 0, 'burst_limited': 0,
+                      'flood_limited': 0, 'evicted': 0}
+
+    @staticmethod
+    def _restriction_message(remaining):
+        if remaining > 60:
+            mins = int(remaining / 60)
+            secs = remaining % 60
+            return f"🚫 操作频率过高！\n系统限制中，需等待 {mins}分{secs}秒 后解除"
+        return f"⏰ 操作太快了\n请休息 {remaining} 秒后再试"
+
+    def check(self, user_id, now=None):
+        """
+        返回值:
+        - None: 允许点击（并记录本次点击）
+        - (剩余秒数, 提示消息): 被限制
+        """
+        now = now or time.time()
+        self._checks += 1
+        if self._checks % SWEEP_EVERY == 0:
+            self._sweep(now)
+
+        record = self._users.get(user_id)
+        if record is None:
+            record = self._users[user_id] = [deque(maxlen=FLOOD_CLICKS - 1), 0.0]
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+                self.stats['evicted'] += 1
+        else:
+            self._users.move_to_end(user_id)
+        clicks = record[0]
+
+        # 惩罚期内
+        if record[1]:
+            if now < record[1]:
+                self.stats['blocked'] += 1
+                return (int(record[1] - now), self._restriction_message(int(record[1] - now)))
+            # 惩罚结束，清空历史重新计算
+            record[1] = 0.0
+            clicks.clear()
+
+        # 规则A：过去5秒内已有2次点击，本次是第3次
+        if len(clicks) >= BURST_CLICKS - 1 and now - clicks[-(BURST_CLICKS - 1)] <= BURST_WINDOW:
+            record[1] = now + BURST_PENALTY
+            self.stats['burst_limited'] += 1
+            return (BURST_PENALTY, "⏰ 点击太快了！\n检测到5秒内连续操作\n系统限制 1分钟 后解除")
+
+        # 规则B：过去60秒内已有19次点击，本次是第20次
+        if len(clicks) == clicks.maxlen and now - clicks[0] < FLOOD_WINDOW:
+            record[1] = now + FLOOD_PENALTY
+            self.stats['flood_limited'] += 1
+            return (FLOOD_PENALTY, "🚫 操作频率过高！\n1分钟内操作超20次\n系统限制 5分钟 后解除")
+
+        clicks.append(now)
+        self.stats['allowed'] += 1
+        return None
+
+    def _sweep(self, now):
+        """从最久未点击的一端清理：最后点击超过60秒且不在惩罚期的用户"""
+        while self._users:
+            user_id, (clicks, restricted_until) = next(iter(self._users.items()))
+            last_click = clicks[-1] if clicks else 0
+            if now - last_click < FLOOD_WINDOW or restricted_until > now:
+                break
+            self._users.popitem(last=False)
+
+    def tracked_users(self):
+        return len(self._users)
+
+
+button_rate_limiter = ButtonRateLimiter()
@@ -0,0 +1,119 @@
+"""
+加群任务群组列表缓存 - 缓存每个用户「需要加入的群组」列表（群裂变列表 / 验证加群共用）
+只在以下情况失效:
+1. 某个上级的达标状态、群组状态或推荐人变化 -> 只失效该用户本人及依赖他的下级
+   （跨进程通过 cache_events 事件同步：后台任务 / Web 进程的变化也会失效机器人进程的缓存）
+2. 捡漏群配置变化 -> 全部失效（跨进程通过 system_config 中的版本号同步）
+"""
+import time
+
+# 跨进程版本号检查间隔（秒）
+VERSION_CHECK_INTERVAL = 5
+# 最多缓存的用户数，超出后整体清空重建
+MAX_ENTRIES = 50000
+
+CACHE_NAME = 'required_groups'
+# 「上级失效」事件名
+UPLINE_EVENT = 'required_groups_upline'
+
+
+class RequiredGroupsCache:
+    """用户 -> 群组列表缓存，带上级反向依赖索引"""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = {}     # telegram_id -> (level_count, slots, upline_ids)
+        self._dependents = {}  # upline_id -> set(telegram_id)
+        self._version = None
+        self._event_version = None
+        self._event_id = None
+        self._version_checked = 0
+
+    def get(self, telegram_id, level_count):
+        """返回缓存的群组列表，未命中返回 None"""
+        self._sync_version()
+        entry = self._entries.get(telegram_id)
+        if entry and entry[0] == level_count:
+            return entry[1]
+        return None
+
+    def set(self, telegram_id, level_count, slots, upline_ids):
+        if telegram_id not in self._entries and len(self._entries) >= self.max_entries:
+            self._clear()
+        self.invalidate_user(telegram_id)
+        self._entries[telegram_id] = (level_count, slots, tuple(upline_ids))
+        for upline_id in upline_ids:
+            self._dependents.setdefault(upline_id, set()).add(telegram_id)
+
+    def invalidate_user(self, telegram_id):
+        """失效单个用户的列表"""
+        entry = self._entries.pop(telegram_id, None)
+        if not entry:
+            return
+        for upline_id in entry[2]:
+            deps = self._dependents.get(upline_id)
+            if deps:
+                deps.discard(telegram_id)
+                if not deps:
+                    del self._dependents[upline_id]
+
+    def invalidate_upline(self, upline_id, propagate=True):
+        """
+        上级达标状态 / 群组状态 / 推荐人变化：失效本人及所有以其为上级的用户
+        （推荐人变化时本人和下级的上级链都变了）
+        propagate=True 时同时发布事件，通知其他进程
+        """
+        self._drop_upline(upline_id)
+        if propagate:
+            try:
+                from .database import publish_cache_event
+                publish_cache_event(UPLINE_EVENT, upline_id)
+            except Exception as e:
+                print(f'[群组列表缓存] 发布失效事件失败: {e}')
+
+    def _drop_upline(self, upline_id):
+        self.invalidate_user(upline_id)
+        for telegram_id in list(self._dependents.pop(upline_id, ())):
+            self.invalidate_user(telegram_id)
+
+    def invalidate_all(self, propagate=False):
+        """
+        全部失效（捡漏群配置变化等）
+        propagate=True 时同时递增数据库版本号，通知其他进程
+        """
+        self._clear()
+        if propagate:
+            try:
+                from .database import bump_cache_version
+                self._version = bump_cache_version(CACHE_NAME)
+            except Exception as e:
+                print(f'[群组列表缓存] 更新版本号失败: {e}')
+
+    def _clear(self):
+        self._entries.clear()
+        self._dependents.clear()
+
+    def _sync_version(self):
+        now = time.time()
+        if now - self._version_checked < VERSION_CHECK_INTERVAL:
+            return
+        self._version_checked = now
+        try:
+            from .database import get_cache_version, get_cache_events
+            version = get_cache_version(CACHE_NAME)
+            event_version = get_cache_version(UPLINE_EVENT)
+            if event_version != self._event_version:
+                self._event_id, upline_ids = get_cache_events(UPLINE_EVENT, self._event_id)
+                self._event_version = event_version
+            else:
+                upline_ids = []
+        except Exception:
+            return
+        if self._version is not None and version != self._version:
+            self._clear()
+        self._version = version
+        for upline_id in upline_ids:
+            self._drop_upline(upline_id)
+
+
+required_groups_cache = RequiredGroupsCache()
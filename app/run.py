@@ -1,12 +1,76 @@
 """
-启动入口 - 统一启动Bot和Web后台
+启动入口 - 统一启动Bot和Web后台，也可以按角色分进程部署
+    python -m app.run            Web + 机器人 + 后台任务（单进程）
+    python -m app.run web        仅Web后台
+    python -m app.run bot        仅机器人（处理用户消息）
+    python -m app.run worker     仅后台任务（所有基于数据库的消费者：定时群发、群发队列、置顶公告、
+                                 通知发件箱、会员私信群发、后台操作、群组检测、群名刷新）
+分进程部署时 web / bot / worker 三个角色都要运行（worker 可以多个，靠数据库租约分工）：
+web 只写数据库，用户消息触发的通知也经由数据库交给 worker 发送
+各角色的工厂函数只在调用时才导入对应模块，导入本模块没有副作用
 """
+import sys
 import threading
 import time
+from functools import partial
 # 【注意】这里必须加点 . 表示从当前包导入
-from .database import init_db, sync_member_groups_from_members
-from .bot_logic import run_bot
-from .config import PUBLIC_BASE_URL
+from .config import PUBLIC_BASE_URL, METRICS_PORT
+
+_migrated = False
+
+
+def migrate():
+    """建表 + 数据库升级（每个进程只执行一次）"""
+    global _migrated
+    if not _migrated:
+        from .database import run_migrations
+        run_migrations()
+        _migrated = True
+
+
+def create_web_app():
+    """Web 后台：返回 Flask app（可交给 gunicorn 等 WSGI 服务器）"""
+    migrate()
+    from .web_app import configure_web
+    return configure_web()
+
+
+def create_bot_runtime():
+    """机器人进程：返回启动函数，只接收和处理用户消息"""
+    migrate()
+    from .bot_logic import run_bot
+    return partial(run_bot, handle_updates=True, run_workers=False)
+
+
+def create_worker():
+    """后台任务进程：返回启动函数，运行所有数据库队列的消费者，机器人只用于发送，不接收更新"""
+    migrate()
+    from .bot_logic import run_bot
+    return partial(run_bot, handle_updates=False, run_workers=True)
+
+
+def _serve_metrics():
+    """没有 Flask 的角色在 METRICS_PORT 上单独提供 /metrics"""
+    if METRICS_PORT:
+        from .metrics import start_http_server
+        start_http_server(METRICS_PORT)
+
+
+def run_role(role):
+    """单独运行某个角色"""
+    if role == 'web':
+        from .web_app import run_web
+        migrate()
+        run_web()
+    elif role == 'bot':
+        _serve_metrics()
+        create_bot_runtime()()
+    elif role == 'worker':
+        _serve_metrics()
+        create_worker()()
+    else:
+        raise SystemExit(f'未知角色: {role}（可选 web / bot / worker）')
+
 
 def main():
     print("=" * 60)
@@ -16,7 +80,7 @@ def main():
     
     # 1. 初始化数据库
     print("📊 初始化数据库...")
-    init_db()
+    migrate()
     print("✅ 数据库初始化完成")
     
     # 同步已有会员群链接到 member_groups
@@ -50,6 +114,7 @@ def main():
     print()
     
     try:
+        from .bot_logic import run_bot
         run_bot()
 
         # 保活逻辑
@@ -76,4 +141,7 @@ def main():
             print("❌ 所有服务启动失败，请检查配置和网络连接")
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if len(sys.argv) > 1:
+        run_role(sys.argv[1])
+    else:
+        main()
\ No newline at end of file
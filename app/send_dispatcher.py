@@ -0,0 +1,257 @@
+"""
+多机器人发送调度 - 后台主动发送（通知、群发、分红提醒、支付消息）统一从这里出
+1. 优先使用能触达对方的机器人（用户最近私聊过的 / 上次发送成功的）
+2. 其余机器人按当前并发数分摊
+3. 某个机器人触发 FloodWait 后在等待期内跳过它，改用其他机器人
+4. 每次发送前从 SendRateLimiter 取令牌（机器人 / 会话两层限速）
+5. 发送本地文件时经由 MediaCache，同一文件每个机器人只上传一次
+6. 群组按 GroupPeerStore 中该机器人的 InputPeer 直接发送，不再解析 @用户名
+7. 发送前查询发送抑制名单；所有机器人都因拉黑 / 注销 / 被踢等原因失败时写入名单（见 send_suppression.py）
+8. 交互模式（max_wait / interactive()）：处理用户操作时顺带发出的通知最多等待 max_wait 秒，
+   限速 / FloodWait 需要等更久时换其他机器人，都不行就立即失败（interactive() 转入通知发件箱）
+"""
+import asyncio
+import os
+import random
+from collections import OrderedDict
+
+from telethon import errors
+
+from .rate_limiter import send_rate_limiter, RateLimitWaitError
+from .media_cache import media_cache as default_media_cache
+from .send_suppression import send_suppressions as default_suppressions, suppression_reason
+
+# 记住的「对方 -> 机器人」对应关系数量上限
+MAX_PEER_AFFINITY = 100000
+# 所有机器人都在 FloodWait 时，最多等待的秒数（超过则直接抛出）
+MAX_FLOOD_SLEEP = 300
+# 交互模式下最多等待的秒数（限速 + FloodWait）
+INTERACTIVE_MAX_WAIT = 3
+
+# 这些错误只说明「这个机器人」发不出去，换其他机器人可能成功
+_CLIENT_SPECIFIC_ERRORS = (
+    errors.UserIsBlockedError,
+    errors.PeerIdInvalidError,
+    errors.ChatWriteForbiddenError,
+    errors.ChannelPrivateError,
+    errors.UserBannedInChannelError,
+    errors.ChatAdminRequiredError,
+    errors.ChannelInvalidError,
+    errors.ChatIdInvalidError,
+    ValueError,  # 机器人无法解析该实体
+)
+
+# 按保存的 InputPeer 发送时出现这些错误，说明该机器人的 access_hash 已不可用
+_STALE_PEER_ERRORS = (
+    errors.ChannelInvalidError,
+    errors.ChannelPrivateError,
+    errors.ChatIdInvalidError,
+    errors.PeerIdInvalidError,
+)
+
+
+class NoBotAvailableError(RuntimeError):
+    """没有在线机器人，或所有机器人都在 FloodWait 中，本次发送暂时发不出去"""
+
+
+def peer_key(peer):
+    """统一对方标识：数字ID 或 小写用户名"""
+    if isinstance(peer, int):
+        return peer
+    if isinstance(peer, str):
+        text = peer.strip()
+        if 't.me/' in text:
+            text = text.split('t.me/')[-1].split('/')[0].split('?')[0]
+        return text.lstrip('@').lower()
+    return getattr(peer, 'user_id', None) or getattr(peer, 'channel_id', None) \
+        or getattr(peer, 'chat_id', None) or id(peer)
+
+
+def is_group_peer(peer):
+    """负数ID / 公开用户名 / 频道、群组实体按群组限速，其余按私聊限速"""
+    if isinstance(peer, int):
+        return peer < 0
+    if isinstance(peer, str):
+        return True
+    return getattr(peer, 'user_id', None) is None
+
+
+class SendDispatcher:
+    """把发送请求分配给合适的机器人客户端"""
+
+    def __init__(self, get_clients, registry, limiter=None, media_cache=None, peer_store=None,
+                 suppressions=None):
+        self._get_clients = get_clients
+        self._registry = registry
+        self._limiter = limiter or send_rate_limiter
+        self._media_cache = media_cache or default_media_cache
+        self._peer_store = peer_store
+        self._suppressions = suppressions or default_suppressions
+        self._inflight = {}             # bot_id -> 正在发送的数量
+        self._affinity = OrderedDict()  # peer_key -> bot_id
+        self.stats = {'sent': 0, 'failed': 0, 'failovers': 0, 'flood_waits': 0}
+
+    # ---------- 对方与机器人的对应关系 ----------
+
+    def note_peer(self, peer, client):
+        """记录该机器人可以触达对方（收到私聊 / 发送成功时调用）"""
+        bot_id = self._registry.get_id(client)
+        if bot_id is None:
+            return
+        key = peer_key(peer)
+        self._affinity[key] = bot_id
+        self._affinity.move_to_end(key)
+        if len(self._affinity) > MAX_PEER_AFFINITY:
+            self._affinity.popitem(last=False)
+
+    def preferred_bot(self, peer):
+        return self._affinity.get(peer_key(peer))
+
+    def flood_remaining(self, client):
+        return self._limiter.bot_pause_remaining(self._registry.get_id(client))
+
+    def _candidates(self, peer, prefer=None):
+        clients = list(self._get_clients() or [])
+        if not clients:
+            return []
+        affinity_bot = self.preferred_bot(peer)
+
+        def rank(client):
+            bot_id = self._registry.get_id(client)
+            return (
+                self._limiter.bot_pause_remaining(bot_id) > 0,  # FloodWait 中的排最后
+                client is not prefer,
+                bot_id != affinity_bot,
+                self._inflight.get(bot_id, 0),
+                random.random(),
+            )
+        return sorted(clients, key=rank)
+
+    # ---------- 发送 ----------
+
+    async def _dispatch(self, method, peer, args, kwargs, prefer=None, max_wait=None):
+        key = peer_key(peer)
+        # 抑制期内直接抛出 PeerSuppressedError，不调用 Telegram
+        self._suppressions.check(key)
+
+        candidates = self._candidates(peer, prefer)
+        if not candidates:
+            raise NoBotAvailableError('没有可用的机器人客户端')
+
+        is_group = is_group_peer(peer)
+        last_error = None
+        client_errors = []
+        flood_limit = MAX_FLOOD_SLEEP if max_wait is None else max_wait
+        for attempt, client in enumerate(candidates):
+            wait = self.flood_remaining(client)
+            if wait > 0:
+                # 排在后面的都在 FloodWait：只在第一个候选上等待一次
+                if attempt > 0 or wait > flood_limit:
+                    break
+                await asyncio.sleep(wait)
+
+            bot_id = self._registry.get_id(client)
+            self._inflight[bot_id] = self._inflight.get(bot_id, 0) + 1
+            try:
+                await self._limiter.acquire(bot_id, key, is_group, max_wait=max_wait)
+                result = await self._call(client, bot_id, method, peer, args, kwargs)
+                self._limiter.record_success(bot_id)
+                self.note_peer(peer, client)
+                self._suppressions.clear(key)
+                self.stats['sent'] += 1
+                return result
+            except errors.FloodWaitError as e:
+                self.stats['flood_waits'] += 1
+                self._limiter.record_flood_wait(bot_id, key, e.seconds, is_group)
+                print(f"[发送调度] 机器人 {bot_id} 触发 FloodWait {e.seconds}s，切换其他机器人")
+                last_error = e
+            except RateLimitWaitError as e:
+                # 交互模式：该机器人需要排队太久，换其他机器人
+                last_error = e
+            except errors.SlowModeWaitError as e:
+                # 慢速模式针对群本身，换机器人也一样；等待期内的发送由限速器排队
+                self._limiter.record_slow_mode(bot_id, key, e.seconds)
+                self.stats['failed'] += 1
+                raise
+            except _CLIENT_SPECIFIC_ERRORS as e:
+                last_error = e
+                client_errors.append(e)
+            finally:
+                self._inflight[bot_id] -= 1
+            self.stats['failovers'] += 1
+
+        self.stats['failed'] += 1
+        # 每个机器人都试过且都是拉黑 / 注销 / 被踢等错误：加入抑制名单
+        if len(client_errors) == len(candidates) and all(map(suppression_reason, client_errors)):
+            self._suppressions.record(key, client_errors)
+        raise last_error or NoBotAvailableError('所有机器人都在 FloodWait 中')
+
+    async def _call(self, client, bot_id, method, peer, args, kwargs):
+        direct = None
+        if self._peer_store is not None and is_group_peer(peer):
+            direct = self._peer_store.input_peer(bot_id, peer)
+        if direct is not None:
+            try:
+                return await self._send(client, bot_id, method, direct, args, kwargs)
+            except _STALE_PEER_ERRORS:
+                self._peer_store.forget(bot_id, peer)
+                if not isinstance(peer, str) or peer_key(peer).startswith('+'):
+                    raise
+            # 保存的 access_hash 已失效，公开群按用户名重试一次
+        result = await self._send(client, bot_id, method, peer, args, kwargs)
+        if self._peer_store is not None and is_group_peer(peer):
+            self._peer_store.remember_sent(bot_id, peer, result)
+        return result
+
+    async def _send(self, client, bot_id, method, target, args, kwargs):
+        if method == 'send_file' and args and isinstance(args[0], str) and os.path.isfile(args[0]):
+            return await self._media_cache.send_file(client, bot_id, target, *args, **kwargs)
+        return await getattr(client, method)(target, *args, **kwargs)
+
+    async def send_message(self, entity, *args, prefer=None, max_wait=None, **kwargs):
+        return await self._dispatch('send_message', entity, args, kwargs, prefer, max_wait)
+
+    async def send_file(self, entity, *args, prefer=None, max_wait=None, **kwargs):
+        return await self._dispatch('send_file', entity, args, kwargs, prefer, max_wait)
+
+    def interactive(self, max_wait=INTERACTIVE_MAX_WAIT):
+        """处理器中使用的发送对象：不会因限速 / FloodWait 阻塞处理器"""
+        return InteractiveSender(self, max_wait)
+
+
+class InteractiveSender:
+    """
+    处理用户操作时顺带发出的通知（推荐人提醒、分红通知等）
+    最多等待 max_wait 秒；发给会员的纯文本消息发不出去时转入通知发件箱稍后重试，其余情况抛出
+    """
+
+    # 这些错误说明只是暂时发不出去
+    _BUSY_ERRORS = (RateLimitWaitError, errors.FloodWaitError, NoBotAvailableError)
+
+    def __init__(self, dispatcher, max_wait):
+        self._dispatcher = dispatcher
+        self._max_wait = max_wait
+
+    async def send_message(self, entity, *args, prefer=None, **kwargs):
+        try:
+            return await self._dispatcher.send_message(
+                entity, *args, prefer=prefer, max_wait=self._max_wait, **kwargs)
+        except self._BUSY_ERRORS:
+            if not self._defer(entity, args, kwargs):
+                raise
+        return None
+
+    async def send_file(self, entity, *args, prefer=None, **kwargs):
+        return await self._dispatcher.send_file(
+            entity, *args, prefer=prefer, max_wait=self._max_wait, **kwargs)
+
+    @staticmethod
+    def _defer(entity, args, kwargs):
+        """发件箱按默认格式（markdown）发送纯文本，其他参数无法保留时不转入"""
+        if not isinstance(entity, int) or entity <= 0 or len(args) != 1 or not isinstance(args[0], str):
+            return False
+        if set(kwargs) - {'parse_mode'} or kwargs.get('parse_mode', 'md') not in ('md', 'markdown'):
+            return False
+        from .database import enqueue_notification
+        enqueue_notification(entity, args[0], source='interactive')
+        return True
@@ -0,0 +1,177 @@
+"""
+发送抑制名单 - 已拉黑机器人 / 已注销的用户、机器人被踢或无法发言的群，在到期前不再发送
+1. SendDispatcher 对某个对象的发送在所有可用机器人上都以下列错误失败时写入 send_suppressions 表：
+   用户拉黑（UserIsBlocked）、用户注销（UserDeactivated）、无法访问（PeerIdInvalid）、
+   群无发言权限 / 被封禁（ChatWriteForbidden / UserBannedInChannel）、群私有 / 不存在（ChannelPrivate / ChannelInvalid）
+2. 发送前先查内存中的名单（O(1)），在抑制期内直接抛出 PeerSuppressedError，不调用 Telegram
+3. 到期后的下一次发送即为重新探测：成功则移出名单，再次失败则抑制时长翻倍（最长 MAX_TTL）
+4. 其他进程写入的记录按 seq 增量同步（每 SYNC_INTERVAL 秒一次）：seq 在写入语句内取 MAX(seq) + 1，
+   SQLite 写入串行执行，序号单调递增，不受各进程时钟误差影响
+"""
+import threading
+import time
+
+from telethon import errors
+
+from .database import get_db_conn, get_cn_time
+
+SYNC_INTERVAL = 5
+MAX_TTL = 30 * 86400
+# 已解除 / 过期很久的记录保留时间（秒）
+RETENTION = 30 * 86400
+CLEANUP_INTERVAL = 3600
+
+# (错误类型, 原因, 首次抑制时长（秒）)
+_REASONS = (
+    ((errors.InputUserDeactivatedError, errors.UserDeactivatedError), 'user_deactivated', 30 * 86400),
+    ((errors.UserIsBlockedError,), 'user_blocked', 3 * 86400),
+    ((errors.PeerIdInvalidError,), 'peer_invalid', 86400),
+    ((errors.ChatWriteForbiddenError, errors.UserBannedInChannelError), 'chat_forbidden', 86400),
+    ((errors.ChannelPrivateError, errors.ChannelInvalidError), 'chat_private', 86400),
+)
+
+
+class PeerSuppressedError(Exception):
+    """对方在抑制名单中，本次发送未调用 Telegram"""
+
+    def __init__(self, key, reason):
+        super().__init__(f'{key} 在发送抑制名单中（{reason}）')
+        self.key = key
+        self.reason = reason
+
+
+def suppression_reason(error):
+    """错误 -> (原因, 首次抑制时长)；不需要抑制的错误返回 None"""
+    for error_types, reason, ttl in _REASONS:
+        if isinstance(error, error_types):
+            return reason, ttl
+    return None
+
+
+def _strongest(errors_seen):
+    """各机器人的错误不同时（如一个被拉黑、一个从未对话）取 _REASONS 中靠前的原因"""
+    for error_types, _, _ in _REASONS:
+        for error in errors_seen:
+            if isinstance(error, error_types):
+                return error
+    return None
+
+
+def _encode(key):
+    return str(key)
+
+
+def _decode(value):
+    return int(value) if value.lstrip('-').isdigit() else value
+
+
+class SendSuppressions:
+    """peer_key -> (到期时间, 原因, 次数)"""
+
+    def __init__(self):
+        self._entries = {}
+        self._synced_seq = 0      # 已同步到的 seq
+        self._sync_checked = 0
+        self._last_cleanup = 0
+        self._lock = threading.Lock()
+        self.stats = {'skipped': 0, 'suppressed': 0, 'recovered': 0}
+
+    # ---------- 同步 ----------
+
+    def _sync(self):
+        now = time.time()
+        if now - self._sync_checked < SYNC_INTERVAL:
+            return
+        self._sync_checked = now
+        try:
+            conn = get_db_conn()
+            try:
+                rows = conn.execute(
+                    'SELECT peer_key, reason, strikes, suppressed_until, seq FROM send_suppressions '
+                    'WHERE seq > ? ORDER BY seq', (self._synced_seq,)).fetchall()
+                if now - self._last_cleanup > CLEANUP_INTERVAL:
+                    # 保留 seq 最大的一条，删除后新写入的序号不会回退
+                    conn.execute('DELETE FROM send_suppressions WHERE suppressed_until < ? '
+                                 'AND seq < (SELECT MAX(seq) FROM send_suppressions)',
+                                 (now - RETENTION,))
+                    conn.commit()
+                    self._last_cleanup = now
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f'[发送抑制] 同步失败: {e}')
+            return
+        with self._lock:
+            for peer_key, reason, strikes, until, seq in rows:
+                key = _decode(peer_key)
+                if strikes:
+                    self._entries[key] = (until, reason, strikes)
+                else:
+                    self._entries.pop(key, None)
+                self._synced_seq = max(self._synced_seq, seq)
+
+    # ---------- 查询 ----------
+
+    def check(self, key):
+        """在抑制期内抛出 PeerSuppressedError（到期后放行一次作为重新探测）"""
+        self._sync()
+        entry = self._entries.get(key)
+        if entry and entry[0] > time.time():
+            self.stats['skipped'] += 1
+            raise PeerSuppressedError(key, entry[1])
+
+    def is_suppressed(self, key):
+        try:
+            self.check(key)
+        except PeerSuppressedError:
+            return True
+        return False
+
+    # ---------- 更新 ----------
+
+    def record(self, key, errors_seen):
+        """所有机器人都以可抑制的错误失败时调用（errors_seen 为各机器人的错误）；返回是否写入名单"""
+        error = _strongest(errors_seen)
+        if error is None:
+            return False
+        reason, ttl = suppression_reason(error)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            strikes = (entry[2] if entry else 0) + 1
+            until = now + min(MAX_TTL, ttl * 2 ** (strikes - 1))
+            self._entries[key] = (until, reason, strikes)
+        self._write(key, reason, strikes, until, f'{type(error).__name__}: {error}'[:200])
+        self.stats['suppressed'] += 1
+        print(f'[发送抑制] {key} 加入抑制名单（{reason}，第 {strikes} 次，'
+              f'{int((until - now) / 3600)} 小时后重新探测）')
+        return True
+
+    def clear(self, key):
+        """发送成功：曾在名单中的对象移出名单（不在名单中时不访问数据库）"""
+        if key not in self._entries:
+            return
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+        self._write(key, None, 0, 0, None)
+        self.stats['recovered'] += 1
+
+    def _write(self, key, reason, strikes, until, last_error):
+        now = time.time()
+        conn = get_db_conn()
+        try:
+            conn.execute(
+                'INSERT INTO send_suppressions '
+                '(peer_key, reason, strikes, suppressed_until, last_error, updated_at, update_time, seq) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, (SELECT COALESCE(MAX(seq), 0) + 1 FROM send_suppressions)) '
+                'ON CONFLICT(peer_key) DO UPDATE SET reason = excluded.reason, strikes = excluded.strikes, '
+                'suppressed_until = excluded.suppressed_until, last_error = excluded.last_error, '
+                'updated_at = excluded.updated_at, update_time = excluded.update_time, seq = excluded.seq',
+                (_encode(key), reason, strikes, until, last_error, now, get_cn_time()))
+            conn.commit()
+        finally:
+            conn.close()
+
+
+send_suppressions = SendSuppressions()
@@ -0,0 +1,139 @@
+"""
+更新分发路由 - 替代每个处理器各自注册 NewMessage(pattern=...) / CallbackQuery(pattern=...)
+1. 消息：命令按第一个词（去掉 @机器人名）、菜单按钮按完整文字查字典，都不匹配时交给兜底处理器
+2. 按钮：callback data 先完整匹配，再按已注册的前缀长度逐个查字典（前缀只有几种长度）
+3. 每个更新只调用一个处理器，调用前统一执行一次 prepare（记录对方、解析主账号）
+4. 按路由统计调用次数 / 耗时 / 异常，并支持外部计时钩子
+5. 快速过滤：只会落到兜底处理器的消息先经过 fallback_filter，确定无事可做的直接丢弃
+   （不执行 prepare，不访问 Telegram），丢弃原因计入 dropped
+"""
+import time
+
+
+class UpdateRouter:
+    """把消息与按钮回调分发到唯一的处理器"""
+
+    def __init__(self, prepare=None, fallback_filter=None):
+        self._prepare = prepare
+        self._fallback_filter = fallback_filter  # filter(event) -> 丢弃原因，None 表示继续处理
+        self._commands = {}      # '/start' -> (route, handler)
+        self._texts = {}         # 按钮文字 -> (route, handler)
+        self._callbacks = {}     # callback data -> (route, handler)
+        self._prefixes = {}      # callback data 前缀 -> (route, handler)
+        self._prefix_lengths = []  # 已注册前缀的长度，从长到短
+        self._fallback = None
+        self._hooks = []
+        self.stats = {}          # route -> {'calls', 'errors', 'total', 'max'}
+        self.dropped = {}        # 丢弃原因 -> 次数
+
+    # ---------- 注册 ----------
+
+    def command(self, name):
+        """注册命令（如 '/start'），匹配消息的第一个词"""
+        def decorator(handler):
+            self._commands[name] = (name, handler)
+            return handler
+        return decorator
+
+    def text(self, text):
+        """注册菜单按钮（完整文字匹配）"""
+        def decorator(handler):
+            self._texts[text] = (f'text:{handler.__name__}', handler)
+            return handler
+        return decorator
+
+    def callback(self, data):
+        """注册按钮回调（callback data 完整匹配）"""
+        def decorator(handler):
+            self._callbacks[data] = (f'cb:{data.decode(errors="replace")}', handler)
+            return handler
+        return decorator
+
+    def callback_prefix(self, prefix):
+        """注册按钮回调（callback data 前缀匹配，如 b'flv_'）"""
+        def decorator(handler):
+            self._prefixes[prefix] = (f'cb:{prefix.decode(errors="replace")}*', handler)
+            self._prefix_lengths = sorted({len(p) for p in self._prefixes}, reverse=True)
+            return handler
+        return decorator
+
+    def fallback(self, handler):
+        """注册兜底消息处理器（没有命令 / 按钮匹配时调用）"""
+        self._fallback = ('message', handler)
+        return handler
+
+    def add_hook(self, hook):
+        """hook(route, seconds, error) 在每次处理完成后调用"""
+        self._hooks.append(hook)
+
+    # ---------- 查找 ----------
+
+    def match_message(self, text):
+        if text:
+            if text[0] == '/':
+                token = text.split(None, 1)[0].split('@', 1)[0]
+                route = self._commands.get(token)
+                if route:
+                    return route
+            else:
+                route = self._texts.get(text.strip())
+                if route:
+                    return route
+        return self._fallback
+
+    def match_callback(self, data):
+        if not data:
+            return None
+        route = self._callbacks.get(data)
+        if route:
+            return route
+        for length in self._prefix_lengths:
+            if length <= len(data):
+                route = self._prefixes.get(data[:length])
+                if route:
+                    return route
+        return None
+
+    # ---------- 分发 ----------
+
+    async def dispatch_message(self, event):
+        route = self.match_message(event.raw_text)
+        if route is not None and route is self._fallback and self._fallback_filter:
+            reason = self._fallback_filter(event)
+            if reason:
+                self.dropped[reason] = self.dropped.get(reason, 0) + 1
+                return
+        await self._run(event, route)
+
+    async def dispatch_callback(self, event):
+        await self._run(event, self.match_callback(event.data))
+
+    async def _run(self, event, route):
+        if self._prepare:
+            self._prepare(event)
+        if route is None:
+            return
+        name, handler = route
+        start = time.perf_counter()
+        error = None
+        try:
+            await handler(event)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {'calls': 0, 'errors': 0, 'total': 0.0, 'max': 0.0}
+            stat['calls'] += 1
+            stat['total'] += elapsed
+            if elapsed > stat['max']:
+                stat['max'] = elapsed
+            if error is not None:
+                stat['errors'] += 1
+            for hook in self._hooks:
+                try:
+                    hook(name, elapsed, error)
+                except Exception as hook_err:
+                    print(f'[路由] 计时钩子异常: {hook_err}')
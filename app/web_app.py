@@ -4,27 +4,18 @@ Web后台层 - 统一管理所有Flask路由
 """
 import os
 import uuid
+import time
 import json  # 确保导入json
 from datetime import datetime, timedelta
 from flask import Flask, render_template, jsonify, request, redirect, url_for
 from flask_login import LoginManager, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 
-from .database import DB, WebDB, AdminUser, get_system_config, get_db_conn, get_cn_time, update_system_config
+from .database import DB, WebDB, AdminUser, get_system_config, get_db_conn, get_cn_time, update_system_config, invalidate_required_groups, invalidate_account_map, enqueue_notification, enqueue_notifications, enqueue_bot_action, notify_bot_configs_changed, notify_broadcast_schedule_changed, enqueue_broadcasts, create_dm_campaign, get_dm_campaigns, set_dm_campaign_status, create_pinned_campaign, get_pinned_campaigns, get_pinned_campaign_failures, retry_pinned_campaign, cancel_pinned_campaign
 from .config import UPLOAD_DIR, BASE_DIR, PUBLIC_BASE_URL
+from .metrics import init_app as init_metrics
 
-# 延迟导入bot，避免循环依赖
-try:
-    from .bot_logic import bot, process_recharge, admin_manual_vip_handler, notify_queue, pending_broadcasts
-except ImportError:
-    # 如果导入失败，设置为None，后续使用时再导入
-    bot = None
-    process_recharge = None
-    admin_manual_vip_handler = None
-    notify_queue = []
-    # 注意：这里不应该重新赋值pending_broadcasts，否则会覆盖导入的变量
-    if 'pending_broadcasts' not in globals():
-        pending_broadcasts = []
+# bot_logic 只在需要与机器人交互的接口内延迟导入，Web 进程启动不加载机器人模块
 
 # 初始化Flask
 template_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'templates')
@@ -35,6 +26,9 @@ app.config['REMEMBER_COOKIE_DURATION'] = timedelta(days=90)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.jinja_env.auto_reload = True
 
+# 运行指标：请求计时 + /metrics（METRICS_ENABLED 关闭时不注册）
+init_metrics(app)
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
@@ -356,9 +350,8 @@ def payment_notify():
 
                     print(f'[支付回调] 订单 {out_trade_no} 处理成功，充值 {amount} U')
 
-                    # 触发后续逻辑 (推入Bot队列)
+                    # 触发后续逻辑（写入后台操作队列，由 worker 进程执行）
                     try:
-                        from . import bot_logic
                         # 判断是否为VIP开通意向
                         is_vip_order = (remark == '开通')
                         # 如果没有备注但金额足够VIP价格，也可以视为VIP订单
@@ -367,14 +360,10 @@ def payment_notify():
                             if amount >= float(config.get('vip_price', 10)):
                                 is_vip_order = True
 
-                        if hasattr(bot_logic, 'process_recharge_queue'):
-                            bot_logic.process_recharge_queue.append({
-                                'member_id': member_id,
-                                'amount': amount,
-                                'is_vip_order': is_vip_order
-                            })
+                        enqueue_bot_action('recharge', member_id=member_id, amount=amount,
+                                           is_vip_order=is_vip_order)
                     except Exception as e:
-                        print(f'[支付回调] 推送Bot队列失败: {e}')
+                        print(f'[支付回调] 写入后台操作队列失败: {e}')
             else:
                 print(f'[支付回调] 未找到订单: {out_trade_no}')
 
@@ -402,7 +391,7 @@ def internal_notify():
         data = request.json
         member_id = data['member_id']
         message = data['message']
-        notify_queue.append({'member_id': member_id, 'message': message})
+        enqueue_notification(member_id, message, source='internal')
         print(f"✅ 通知已加入队列: 用户{member_id}")
         return jsonify({'success': True})
     except Exception as e:
@@ -545,6 +534,7 @@ def api_assign_broadcast_to_group(group_id):
                 (group_id, message_id, is_active, now))
         conn.commit()
         conn.close()
+        notify_broadcast_schedule_changed()
         return jsonify({'success': True, 'message': '分配已保存'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -560,6 +550,7 @@ def api_unassign_broadcast_from_group(group_id, message_id):
         c.execute('DELETE FROM broadcast_assignments WHERE group_id = ? AND message_id = ?', (group_id, message_id))
         conn.commit()
         conn.close()
+        notify_broadcast_schedule_changed()
         return jsonify({'success': True, 'message': '已取消分配'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -593,22 +584,13 @@ def api_group_send_broadcasts(group_id):
 
         # 获取待发送消息内容并写入 broadcast_queue
         placeholders = ','.join(['?' for _ in message_ids])
-        c.execute(f'SELECT id, title, content, image_url, video_url, buttons FROM broadcast_messages WHERE id IN ({placeholders}) ORDER BY id ASC', message_ids)
+        c.execute(f'SELECT id, version FROM broadcast_messages WHERE id IN ({placeholders}) ORDER BY id ASC', message_ids)
         rows = c.fetchall()
         now = get_cn_time()
         for row in rows:
-            # build a JSON payload containing content and media
-            msg_obj = {
-                'content': row[2] or '',
-                'image_url': row[3] or '',
-                'video_url': row[4] or '',
-                'buttons': row[5] or '',
-            }
-            import json
-            msg_json = json.dumps(msg_obj, ensure_ascii=False)
-            # 写入队列；Bot 线程会解析 JSON 并发送媒体/按钮等
-            c.execute('INSERT INTO broadcast_queue (group_link, group_name, message, status, create_time) VALUES (?, ?, ?, ?, ?)',
-                      (group_link, group_name, msg_json, 'pending', now))
+            # 写入队列：只引用消息ID和版本，Bot 端按版本复用编译好的内容
+            c.execute('INSERT INTO broadcast_queue (group_link, group_name, message_id, message_version, status, create_time) VALUES (?, ?, ?, ?, ?, ?)',
+                      (group_link, group_name, row[0], row[1] or 1, 'pending', now))
 
         conn.commit()
         conn.close()
@@ -985,27 +967,8 @@ def api_broadcast_to_groups():
         if not groups:
             return jsonify({'success': False, 'message': '未找到对应的群组'}), 404
 
-        # 【修复点】正确引用 bot_logic 中的变量
-        from . import bot_logic
-        # 确保列表存在
-        if not hasattr(bot_logic, 'pending_broadcasts'):
-            bot_logic.pending_broadcasts = []
-
-        sent_count = 0
-        for group in groups:
-            group_link = group[1]
-            if group_link and 't.me/' in group_link:
-                try:
-                    # 直接追加到 bot_logic 模块的列表中
-                    bot_logic.pending_broadcasts.append({
-                        'type': 'broadcast',
-                        'group_links': [group_link],
-                        'message_content': message
-                    })
-                    sent_count += 1
-                except Exception as e:
-                    print(f'[群发API] 添加群组 {group[0]} 失败: {e}')
-                    continue
+        # 写入数据库群发队列（Web 与机器人可能不在同一进程）
+        sent_count = enqueue_broadcasts([(group[1], group[2]) for group in groups], message)
 
         if sent_count == 0:
             return jsonify({'success': False, 'message': '没有有效的群组链接可以发送'}), 400
@@ -1118,6 +1081,8 @@ def api_fallback_accounts():
 
             conn.commit()
             conn.close()
+            invalidate_required_groups(propagate=True)
+            invalidate_account_map(propagate=True)
 
             return jsonify({'success': True, 'message': '捡漏账号添加成功'})
 
@@ -1521,20 +1486,8 @@ def api_broadcast_send():
         if not groups:
             return jsonify({'success': False, 'message': '没有找到群组'}), 400
 
-        # 加入发送队列
-        sent = 0
-        for g in groups:
-            group_link = g[1]
-            if group_link and 't.me/' in group_link:
-                try:
-                    pending_broadcasts.append({
-                        'type': 'broadcast',
-                        'group_links': [group_link],
-                        'message_content': message
-                    })
-                    sent += 1
-                except Exception:
-                    pass
+        # 加入发送队列（写入数据库，由机器人进程发送）
+        sent = enqueue_broadcasts([(g[1], g[2]) for g in groups], message)
 
         return jsonify({'success': True, 'sent': sent, 'message': f'已加入发送队列: {sent}个群组'})
     except Exception as e:
@@ -1587,15 +1540,9 @@ def api_create_bot_config():
         conn.commit()
         conn.close()
 
-        try:
-            from .bot_logic import bot, add_bot_dynamically
-            if bot and getattr(bot, 'loop', None):
-                bot.loop.create_task(add_bot_dynamically(new_id, token))
-                print(f"[Web] 已触发新机器人动态启动: ID {new_id}")
-            else:
-                print("[Web] 主Bot未运行，无法动态启动，需重启生效")
-        except Exception as e:
-            print(f"[Web] 动态启动触发失败 (需手动重启): {e}")
+        # 运行机器人的进程（bot / worker，可能不是本进程）检测到版本号变化后启动新机器人
+        notify_bot_configs_changed()
+        print(f"[Web] 已通知机器人进程启动新机器人: ID {new_id}")
 
         return jsonify({'success': True, 'message': '机器人已添加 (尝试自动启动中...)'})
     except Exception as e:
@@ -1693,11 +1640,13 @@ def api_update_broadcast_message(id):
         c = conn.cursor()
         c.execute('''
             UPDATE broadcast_messages
-            SET title = ?, content = ?, image_url = ?, video_url = ?, buttons = ?, buttons_per_row = ?, broadcast_interval = ?, is_active = ?
+            SET title = ?, content = ?, image_url = ?, video_url = ?, buttons = ?, buttons_per_row = ?, broadcast_interval = ?, is_active = ?,
+                version = COALESCE(version, 1) + 1
             WHERE id = ?
         ''', (title, content, image_url, video_url, buttons, buttons_per_row, broadcast_interval, is_active, id))
         conn.commit()
         conn.close()
+        notify_broadcast_schedule_changed(message_id=id)
         return jsonify({'success': True, 'message': '更新成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -1712,6 +1661,7 @@ def api_delete_broadcast_message(id):
         c.execute('DELETE FROM broadcast_messages WHERE id = ?', (id,))
         conn.commit()
         conn.close()
+        notify_broadcast_schedule_changed()
         return jsonify({'success': True, 'message': '删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -2203,21 +2153,13 @@ def api_update_recharge_status(recharge_id):
         conn.close()
 
         # 3. 【核心】告诉机器人去处理业务（开VIP、分红、发通知）
-        # 这会触发 bot_logic.process_recharge，它会自动识别余额是否足够开VIP
+        # 写入后台操作队列，由 worker 进程调用 bot_logic.process_recharge，它会自动识别余额是否足够开VIP
         try:
-            from . import bot_logic
-            if hasattr(bot_logic, 'process_recharge_queue'):
-                # 推入队列，让机器人线程去扣款、开通VIP、发分红
-                bot_logic.process_recharge_queue.append({
-                    'member_id': member_id,
-                    'amount': amount,
-                    'is_vip_order': is_vip_order  # 传递正确的标志
-                })
-                print(f"[Web后台手动通过] 已将订单 {order_id} 推送给机器人处理VIP逻辑，VIP订单: {is_vip_order}")
-            else:
-                print("[Web后台手动通过] 推送机器人队列失败: bot_logic.process_recharge_queue 不存在")
+            enqueue_bot_action('recharge', member_id=member_id, amount=amount,
+                               is_vip_order=is_vip_order)  # 传递正确的标志
+            print(f"[Web后台手动通过] 已将订单 {order_id} 写入后台操作队列，VIP订单: {is_vip_order}")
         except Exception as e:
-            print(f"[Web后台手动通过] 推送机器人队列失败: {e}")
+            print(f"[Web后台手动通过] 写入后台操作队列失败: {e}")
 
         return jsonify({'success': True, 'message': '已手动通过，VIP开通和分红将在几秒内自动处理'})
     except Exception as e:
@@ -2226,7 +2168,6 @@ def api_update_recharge_status(recharge_id):
 @app.route('/api/members/broadcast', methods=['POST'])
 @login_required
 def api_members_broadcast():
-    global notify_queue
     """向会员发送群发消息"""
     try:
         data = request.get_json() or {}
@@ -2237,44 +2178,140 @@ def api_members_broadcast():
         if not message:
             return jsonify({'success': False, 'message': '消息内容不能为空'})
 
-        conn = get_db_conn()
-        c = conn.cursor()
-
-        targets = []
         if send_all:
-            c.execute('SELECT telegram_id FROM members')
-            targets = [row[0] for row in c.fetchall()]
-        else:
-            ids = []
-            for mid in member_ids:
-                try:
-                    ids.append(int(mid))
-                except (TypeError, ValueError):
-                    continue
-            if not ids:
-                conn.close()
-                return jsonify({'success': False, 'message': '请选择要发送的会员'})
-            placeholders = ','.join(['?' for _ in ids])
-            c.execute(f'SELECT telegram_id FROM members WHERE telegram_id IN ({placeholders})', ids)
-            targets = [row[0] for row in c.fetchall()]
+            # 全体会员：创建活动，由机器人进程分批发送（可暂停 / 断点续发）
+            campaign_id, total = create_dm_campaign(message)
+            if not total:
+                return jsonify({'success': False, 'message': '未找到对应的会员'})
+            return jsonify({'success': True, 'count': total, 'campaign_id': campaign_id,
+                            'message': f'已创建群发任务，将分批向 {total} 位会员发送'})
+
+        ids = []
+        for mid in member_ids:
+            try:
+                ids.append(int(mid))
+            except (TypeError, ValueError):
+                continue
+        if not ids:
+            return jsonify({'success': False, 'message': '请选择要发送的会员'})
 
+        conn = get_db_conn()
+        c = conn.cursor()
+        placeholders = ','.join(['?' for _ in ids])
+        c.execute(f'SELECT telegram_id FROM members WHERE telegram_id IN ({placeholders})', ids)
+        targets = [row[0] for row in c.fetchall()]
         conn.close()
 
         if not targets:
             return jsonify({'success': False, 'message': '未找到对应的会员'})
 
-        # 确保notify_queue已初始化
-        if not notify_queue:
-            from .bot_logic import notify_queue
-        
-        for mid in targets:
-            notify_queue.append({'member_id': mid, 'message': message})
-
-        count = len(targets)
+        count = enqueue_notifications(targets, message, source='members_broadcast')
         return jsonify({'success': True, 'count': count, 'message': f'已加入发送队列，将向 {count} 位会员发送'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
+@app.route('/api/members/broadcast/campaigns', methods=['GET'])
+@login_required
+def api_member_broadcast_campaigns():
+    """全体会员群发任务进度"""
+    try:
+        campaigns = get_dm_campaigns()
+        now = time.time()
+        for item in campaigns:
+            done = item['sent_count'] + item['failed_count'] + item['deferred_count']
+            total = max(item['total_count'], done)
+            item['processed'] = done
+            item['progress'] = round(done * 100.0 / total, 1) if total else 100.0
+            item['eta_seconds'] = None
+            if item['status'] == 'running' and item['started_at'] and done:
+                speed = done / max(1.0, now - item['started_at'])
+                item['eta_seconds'] = int((total - done) / speed) if speed else None
+            item.pop('message', None)
+            item.pop('started_at', None)
+        return jsonify({'success': True, 'campaigns': campaigns})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/members/broadcast/campaigns/<int:campaign_id>/<action>', methods=['POST'])
+@login_required
+def api_member_broadcast_campaign_action(campaign_id, action):
+    """暂停 / 继续 / 取消全体会员群发任务"""
+    status = {'pause': 'paused', 'resume': 'running', 'cancel': 'cancelled'}.get(action)
+    if not status:
+        return jsonify({'success': False, 'message': '未知操作'}), 400
+    try:
+        if not set_dm_campaign_status(campaign_id, status):
+            return jsonify({'success': False, 'message': '任务状态不允许该操作'})
+        return jsonify({'success': True})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/publish-pinned-ad', methods=['POST'])
+@login_required
+def api_publish_pinned_ad():
+    """发布置顶广告：保存内容，并创建置顶公告活动发送到所有机器人为管理员的会员群"""
+    try:
+        data = request.get_json() or {}
+        content = (data.get('content') or '').strip()
+        if not content:
+            return jsonify({'success': False, 'message': '广告内容不能为空'}), 400
+        update_system_config('pinned_ad', content)
+        campaign_id, count = create_pinned_campaign(content)
+        if not count:
+            return jsonify({'success': False, 'message': '没有机器人为管理员的会员群'})
+        return jsonify({'success': True, 'campaign_id': campaign_id, 'count': count,
+                        'message': f'已创建发布任务，将发送到 {count} 个群并置顶'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/pinned-campaigns', methods=['GET'])
+@login_required
+def api_pinned_campaigns():
+    """置顶公告活动进度（已置顶 / 已发送未置顶 / 失败 / 待发送 与预计剩余时间）"""
+    try:
+        campaigns = get_pinned_campaigns()
+        now = time.time()
+        for item in campaigns:
+            counts = item['counts']
+            pending = counts.get('pending', 0)
+            done = item['total_count'] - pending
+            item['processed'] = done
+            item['progress'] = round(done * 100.0 / item['total_count'], 1) if item['total_count'] else 100.0
+            item['eta_seconds'] = None
+            if item['status'] == 'running' and item['started_at'] and done:
+                speed = done / max(1.0, now - item['started_at'])
+                item['eta_seconds'] = int(pending / speed) if speed else None
+            item.pop('started_at', None)
+        return jsonify({'success': True, 'campaigns': campaigns})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/pinned-campaigns/<int:campaign_id>/failures', methods=['GET'])
+@login_required
+def api_pinned_campaign_failures(campaign_id):
+    try:
+        return jsonify({'success': True, 'failures': get_pinned_campaign_failures(campaign_id)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+@app.route('/api/pinned-campaigns/<int:campaign_id>/<action>', methods=['POST'])
+@login_required
+def api_pinned_campaign_action(campaign_id, action):
+    """重新发送失败的群 / 取消活动"""
+    try:
+        if action == 'retry':
+            count = retry_pinned_campaign(campaign_id)
+            if not count:
+                return jsonify({'success': False, 'message': '没有可重新发送的群'})
+            return jsonify({'success': True, 'message': f'已重新发送 {count} 个失败的群'})
+        if action == 'cancel':
+            if not cancel_pinned_campaign(campaign_id):
+                return jsonify({'success': False, 'message': '任务已结束'})
+            return jsonify({'success': True, 'message': '已取消'})
+        return jsonify({'success': False, 'message': '未知操作'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
 @app.route('/api/settings', methods=['GET'])
 @login_required
 def api_get_settings():
@@ -2523,6 +2560,8 @@ def api_delete_fallback_account(id):
         c.execute('DELETE FROM fallback_accounts WHERE id = ?', (id,))
         conn.commit()
         conn.close()
+        invalidate_required_groups(propagate=True)
+        invalidate_account_map(propagate=True)
         return jsonify({'success': True, 'message': '删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
@@ -2545,6 +2584,8 @@ def api_update_fallback_account(id):
         if 'group_link' in data:
             updates.append('group_link = ?')
             params.append(data['group_link'])
+            # 群链接变更后让后台任务尽快刷新群名缓存
+            updates.append('title_update_time = NULL')
         if 'is_active' in data:
             updates.append('is_active = ?')
             params.append(1 if data['is_active'] else 0)
@@ -2553,6 +2594,7 @@ def api_update_fallback_account(id):
             params.append(id)
             c.execute(f'UPDATE fallback_accounts SET {", ".join(updates)} WHERE id = ?', params)
             conn.commit()
+            invalidate_required_groups(propagate=True)
         
         conn.close()
         return jsonify({'success': True, 'message': '更新成功'})
@@ -2569,16 +2611,8 @@ def api_manual_vip(telegram_id):
     删除所有手写分红逻辑
     """
     try:
-        config = get_system_config()
-        
-        # 【核心修复】使用bot的事件循环创建异步任务
-        # Flask是同步的，所以通过事件循环创建任务，不等待结果
-        if bot:
-            bot.loop.create_task(admin_manual_vip_handler(telegram_id, config))
-        else:
-            # 如果bot未初始化，延迟导入
-            from .bot_logic import bot, admin_manual_vip_handler
-            bot.loop.create_task(admin_manual_vip_handler(telegram_id, config))
+        # 写入后台操作队列，由 worker 进程执行（Web 可能是不运行机器人的独立进程）
+        enqueue_bot_action('manual_vip', telegram_id=telegram_id)
         
         return jsonify({
             'success': True,
@@ -2587,10 +2621,8 @@ def api_manual_vip(telegram_id):
     except Exception as e:
         return jsonify({'success': False, 'message': str(e)}), 500
 
-def run_web():
-    """Web 启动入口"""
-    global PAYMENT_CONFIG
-
+def configure_web():
+    """加载运行期配置（支付参数），由 run_web / create_web_app 调用"""
     # Load payment config from database - 完全依赖数据库配置
     try:
         config = get_system_config()
@@ -2616,22 +2648,12 @@ def run_web():
             'payment_rate': 1.0,
         })
 
-    # Ensure recharge_records has a remark column for admin notes
-    try:
-        conn = get_db_conn()
-        c = conn.cursor()
-        c.execute("PRAGMA table_info(recharge_records)")
-        cols = [r[1] for r in c.fetchall()]
-        if 'remark' not in cols:
-            try:
-                c.execute("ALTER TABLE recharge_records ADD COLUMN remark TEXT")
-                conn.commit()
-            except Exception:
-                pass
-        conn.close()
-    except Exception:
-        pass
+    return app
+
 
+def run_web():
+    """Web 启动入口"""
+    configure_web()
     print("🌐 Web管理后台启动中...")
     try:
         app.run(debug=False, host='0.0.0.0', port=5051, use_reloader=False)
@@ -2,7 +2,7 @@
 启动入口 - 统一启动Bot和Web后台
 """
 import threading
-from app.database import init_db, sync_member_groups_from_members
+from app.database import run_migrations, sync_member_groups_from_members
 from app.bot_logic import run_bot
 
 def main():
@@ -13,7 +13,7 @@ def main():
     
     # 1. 初始化数据库
     print("📊 初始化数据库...")
-    init_db()
+    run_migrations()
     print("✅ 数据库初始化完成")
     
     # 同步已有会员群链接到 member_groups
@@ -0,0 +1,34 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    """每个测试使用独立的临时数据库"""
+    import app.database as database
+    monkeypatch.setattr(database, 'DB_PATH', str(tmp_path / 'bot.db'))
+    database.run_migrations()
+    return database
+
+
+def add_members(db, *telegram_ids):
+    conn = db.get_db_conn()
+    try:
+        for telegram_id in telegram_ids:
+            conn.execute('INSERT INTO members (telegram_id, username) VALUES (?, ?)',
+                         (telegram_id, f'user{telegram_id}'))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def query(db, sql, params=()):
+    conn = db.get_db_conn()
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
@@ -0,0 +1,81 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import bot_logic
+from app.account_map import AccountMap
+
+
+def _event(sender_id, username=None):
+    return SimpleNamespace(sender_id=sender_id, sender=SimpleNamespace(username=username))
+
+
+@pytest.fixture
+def accounts(db, monkeypatch):
+    accounts = AccountMap()
+    monkeypatch.setattr(bot_logic, 'account_map', accounts)
+    return accounts
+
+
+def test_backup_account_resolves_to_main(accounts):
+    accounts.set_backup(100, '200', propagate=False)
+    event = _event(200)
+    assert bot_logic.resolve_event_account(event) == 100
+    # 原始发送者不被改写
+    assert event.sender_id == 200
+    assert bot_logic.get_resolved_sender_info(event) == (200, 100)
+
+
+def test_backup_username_resolves_to_main(accounts):
+    accounts.set_backup(100, '@Backup', propagate=False)
+    assert bot_logic.resolve_event_account(_event(300, 'backup')) == 100
+
+
+def test_fallback_account_resolves_to_main(accounts):
+    accounts.set_fallback(400, 100, propagate=False)
+    assert bot_logic.resolve_event_account(_event(400)) == 100
+
+
+def test_unlinked_account_resolves_to_itself(accounts):
+    assert bot_logic.resolve_event_account(_event(500, 'someone')) == 500
+
+
+def test_resolved_once_per_event(accounts, monkeypatch):
+    calls = []
+
+    def resolve(telegram_id, username=None):
+        calls.append(telegram_id)
+        return 100
+
+    monkeypatch.setattr(bot_logic, 'get_main_account_id', resolve)
+    event = _event(200)
+    assert [bot_logic.resolve_event_account(event) for _ in range(3)] == [100, 100, 100]
+    assert calls == [200]
+
+
+def test_publish_reloads_when_another_process_wrote_in_between(db):
+    from app.account_map import CACHE_NAME
+
+    accounts = AccountMap()
+    assert accounts.resolve(200) == 200
+    # 另一个进程写入了备用号关联并递增版本号
+    conn = db.get_db_conn()
+    conn.execute("INSERT INTO members (telegram_id, username, backup_account) VALUES (100, 'main', '200')")
+    conn.commit()
+    conn.close()
+    db.bump_cache_version(CACHE_NAME)
+    # 本进程的增量更新不能把对方的修改当作已加载
+    accounts.set_fallback(400, 300)
+    assert accounts.resolve(200) == 100
+
+
+def test_publish_keeps_map_when_no_one_else_wrote(db, monkeypatch):
+    accounts = AccountMap()
+    accounts.resolve(1)
+    loads = []
+    original_load = accounts._load
+    monkeypatch.setattr(accounts, '_load', lambda: loads.append(1) or original_load())
+    accounts.set_fallback(400, 300)
+    accounts._version_checked = 0
+    assert accounts.resolve(400) == 300
+    assert loads == []
@@ -0,0 +1,57 @@
+import asyncio
+import time
+
+from app.bot_actions import BotActionRunner
+
+from conftest import query
+
+
+def test_enqueue_and_execute_once(db):
+    calls = []
+
+    async def manual_vip(telegram_id):
+        calls.append(telegram_id)
+        return 'ok'
+
+    async def failing(member_id, amount, is_vip_order=False):
+        raise ValueError('boom')
+
+    db.enqueue_bot_action('manual_vip', telegram_id=5)
+    db.enqueue_bot_action('recharge', member_id=1, amount=10.0, is_vip_order=True)
+    db.enqueue_bot_action('unknown')
+    runner = BotActionRunner()
+    handlers = {'manual_vip': manual_vip, 'recharge': failing}
+
+    async def main():
+        for action_id, action, payload in runner._claim(10):
+            await runner._execute(handlers, action_id, action, payload)
+
+    asyncio.run(main())
+    assert calls == [5]
+    assert [row[:2] for row in query(db, 'SELECT action, status, result FROM bot_actions ORDER BY id')] == \
+        [('manual_vip', 'done'), ('recharge', 'failed'), ('unknown', 'failed')]
+    # 已执行的记录不会再次领取
+    assert runner._claim(10) == []
+
+
+def test_claim_is_exclusive(db):
+    db.enqueue_bot_action('manual_vip', telegram_id=5)
+    a, b = BotActionRunner(), BotActionRunner()
+    assert len(a._claim(10)) == 1
+    assert b._claim(10) == []
+
+
+def test_interrupted_actions_are_failed_not_retried(db):
+    db.enqueue_bot_action('recharge', member_id=1, amount=10.0)
+    db.enqueue_bot_action('recharge', member_id=2, amount=10.0)
+    crashed, other = BotActionRunner(), BotActionRunner()
+    crashed._claim(1)
+    other._claim(1)
+    conn = db.get_db_conn()
+    conn.execute('UPDATE bot_actions SET lease_until = ? WHERE claimed_by = ?',
+                 (time.time() - 1, crashed.worker_id))
+    conn.commit()
+    conn.close()
+    other._expire_stale()
+    assert query(db, 'SELECT id, status FROM bot_actions ORDER BY id') == [(1, 'failed'), (2, 'running')]
+    assert other._claim(10) == []
@@ -0,0 +1,94 @@
+import json
+
+import pytest
+from telethon.tl.types import MessageEntityBold
+
+from app.broadcast_payload import PayloadCache, compile_payload
+
+
+def _message(db, content, **fields):
+    conn = db.get_db_conn()
+    try:
+        columns = ['content'] + list(fields)
+        c = conn.execute(f'INSERT INTO broadcast_messages ({", ".join(columns)}) '
+                         f'VALUES ({", ".join("?" for _ in columns)})',
+                         [content] + list(fields.values()))
+        conn.commit()
+        return c.lastrowid
+    finally:
+        conn.close()
+
+
+def _edit(db, message_id, content):
+    """后台修改群发内容时版本号加一"""
+    conn = db.get_db_conn()
+    try:
+        conn.execute('UPDATE broadcast_messages SET content = ?, version = version + 1 WHERE id = ?',
+                     (content, message_id))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_markdown_is_parsed_at_compile_time():
+    payload = compile_payload('**hi** there')
+    assert payload.text == 'hi there'
+    assert [type(e) for e in payload.entities] == [MessageEntityBold]
+    with pytest.raises(AttributeError):
+        payload.text = 'changed'
+
+
+def test_buttons_only_on_text_messages():
+    buttons = json.dumps([{'name': 'a', 'url': 'https://a.example'},
+                          {'name': 'b', 'url': 'https://b.example'},
+                          {'name': 'c', 'url': 'https://c.example'}])
+    markup = compile_payload('hi', buttons=buttons, buttons_per_row=2).markup
+    assert [len(row.buttons) for row in markup.rows] == [2, 1]
+    with_media = compile_payload('hi', image_url='https://img.example/a.jpg', buttons=buttons)
+    assert with_media.markup is None
+    # 外链媒体附在文字后面
+    assert with_media.text == 'hi\nhttps://img.example/a.jpg'
+    assert with_media.media_path is None
+
+
+def test_each_version_is_compiled_once(db):
+    message_id = _message(db, 'hello')
+    cache = PayloadCache()
+    first = cache.for_message(message_id, 1)
+    assert cache.for_message(message_id, 1) is first
+    assert cache.stats == {'hits': 1, 'compiled': 1}
+    _edit(db, message_id, 'edited')
+    assert cache.for_message(message_id, 2).text == 'edited'
+    assert cache.stats['compiled'] == 2
+
+
+def test_row_queued_before_an_edit_sends_the_new_content(db):
+    message_id = _message(db, 'hello')
+    cache = PayloadCache()
+    assert cache.for_message(message_id, 1).text == 'hello'
+    _edit(db, message_id, 'edited')
+    # 队列记录中的版本号是入队时的版本
+    assert cache.for_message(message_id, 1).text == 'edited'
+
+
+def test_deleted_message_returns_none(db):
+    assert PayloadCache().for_message(12345, 1) is None
+
+
+def test_legacy_rows_are_compiled_from_the_raw_message():
+    cache = PayloadCache()
+    raw = json.dumps({'content': '**hi**', 'image_url': '', 'video_url': '', 'buttons': ''})
+    assert cache.for_row(raw).text == 'hi'
+    assert cache.for_row(raw) is cache.for_row(raw)
+    assert cache.for_row('plain text').text == 'plain text'
+    assert cache.stats['compiled'] == 2
+
+
+def test_least_recently_used_payload_is_evicted():
+    cache = PayloadCache(max_entries=2)
+    a = cache.for_raw('a')
+    cache.for_raw('b')
+    cache.for_raw('a')
+    cache.for_raw('c')
+    assert cache.for_raw('a') is a
+    assert ('raw', 'b') not in cache._entries
@@ -0,0 +1,68 @@
+import time
+
+from app import broadcast_queue
+from app.broadcast_queue import BroadcastQueueConsumer
+
+from conftest import query
+
+
+def _enqueue(db, count):
+    conn = db.get_db_conn()
+    try:
+        for i in range(count):
+            conn.execute("INSERT INTO broadcast_queue (group_link, group_name, message, status) "
+                         "VALUES (?, ?, 'hi', 'pending')", (f'https://t.me/g{i}', f'g{i}'))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _expire_leases(db):
+    conn = db.get_db_conn()
+    try:
+        conn.execute("UPDATE broadcast_queue SET lease_until = ? WHERE status = 'sending'",
+                     (time.time() - 1,))
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def test_claim_is_exclusive(db):
+    _enqueue(db, 3)
+    a, b = BroadcastQueueConsumer(), BroadcastQueueConsumer()
+    assert len(a._claim(10)) == 3
+    assert b._claim(10) == []
+    assert query(db, 'SELECT DISTINCT claimed_by FROM broadcast_queue') == [(a.worker_id,)]
+
+
+def test_claim_respects_limit(db):
+    _enqueue(db, 5)
+    a, b = BroadcastQueueConsumer(), BroadcastQueueConsumer()
+    first = a._claim(2)
+    second = b._claim(10)
+    assert len(first) == 2 and len(second) == 3
+    assert not {row[0] for row in first} & {row[0] for row in second}
+
+
+def test_expired_lease_is_reclaimed_and_old_owner_loses_it(db):
+    _enqueue(db, 1)
+    a, b = BroadcastQueueConsumer(), BroadcastQueueConsumer()
+    task_id = a._claim(1)[0][0]
+    _expire_leases(db)
+    assert [row[0] for row in b._claim(1)] == [task_id]
+    assert not a._renew(task_id)
+    a._finish(task_id, 'sent', 'late')
+    assert query(db, 'SELECT status, claimed_by FROM broadcast_queue') == [('sending', b.worker_id)]
+    b._finish(task_id, 'sent', 'ok')
+    assert query(db, 'SELECT status FROM broadcast_queue') == [('sent',)]
+
+
+def test_repeatedly_expired_row_is_failed(db):
+    _enqueue(db, 1)
+    consumer = BroadcastQueueConsumer()
+    for _ in range(broadcast_queue.MAX_ATTEMPTS):
+        assert len(consumer._claim(1)) == 1
+        _expire_leases(db)
+    assert consumer._claim(1) == []
+    assert query(db, 'SELECT status, attempts FROM broadcast_queue') == \
+        [('failed', broadcast_queue.MAX_ATTEMPTS)]
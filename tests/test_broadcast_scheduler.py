@@ -0,0 +1,109 @@
+import asyncio
+import time
+
+from app import broadcast_scheduler
+from app.broadcast_scheduler import BroadcastScheduler
+
+from conftest import query
+
+
+def _assign(db, link, due_at, interval=60, message_active=1, group_scheduled=1, assign_active=1):
+    """建一个群、一条群发消息和它们的分配，返回分配ID"""
+    conn = db.get_db_conn()
+    try:
+        c = conn.cursor()
+        c.execute('INSERT INTO member_groups (group_name, group_link, schedule_broadcast) VALUES (?, ?, ?)',
+                  (link, link, group_scheduled))
+        group_id = c.lastrowid
+        c.execute('INSERT INTO broadcast_messages (content, is_active, broadcast_interval) VALUES (?, ?, ?)',
+                  ('hi', message_active, interval))
+        message_id = c.lastrowid
+        c.execute('INSERT INTO broadcast_assignments (group_id, message_id, is_active, next_due_at) '
+                  'VALUES (?, ?, ?, ?)', (group_id, message_id, assign_active, due_at))
+        conn.commit()
+        return c.lastrowid
+    finally:
+        conn.close()
+
+
+def _queued_links(db):
+    return [row[0] for row in query(db, 'SELECT group_link FROM broadcast_queue ORDER BY id')]
+
+
+def test_reload_keeps_only_enabled_assignments(db):
+    active = _assign(db, 'https://t.me/a', 0)
+    _assign(db, 'https://t.me/b', 0, message_active=0)
+    _assign(db, 'https://t.me/c', 0, group_scheduled=0)
+    _assign(db, 'https://t.me/d', 0, assign_active=0)
+    scheduler = BroadcastScheduler()
+    scheduler._reload()
+    assert scheduler._due == {active: 0}
+
+
+def test_pop_due_skips_superseded_heap_entries():
+    scheduler = BroadcastScheduler()
+    scheduler._push(1, 100)
+    scheduler._push(2, 200)
+    # 重新计算到期时间后旧的堆项作废
+    scheduler._push(1, 300)
+    assert scheduler._pop_due(250) == [2]
+    assert scheduler._pop_due(250) == []
+    assert scheduler._pop_due(300) == [1]
+    assert scheduler._heap == []
+
+
+def test_fire_enqueues_and_reschedules_by_interval(db):
+    assign_id = _assign(db, 'https://t.me/a', 0, interval=30)
+    scheduler = BroadcastScheduler()
+    before = int(time.time())
+    scheduler._fire([assign_id])
+    assert _queued_links(db) == ['https://t.me/a']
+    next_due_at = query(db, 'SELECT next_due_at FROM broadcast_assignments')[0][0]
+    assert before + 30 * 60 <= next_due_at <= int(time.time()) + 30 * 60
+    assert scheduler._due == {assign_id: next_due_at}
+
+
+def test_run_fires_only_due_assignments(db):
+    _assign(db, 'https://t.me/due', int(time.time()) - 1)
+    _assign(db, 'https://t.me/later', int(time.time()) + 3600)
+
+    async def main():
+        task = asyncio.create_task(BroadcastScheduler().run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+
+    asyncio.run(main())
+    assert _queued_links(db) == ['https://t.me/due']
+
+
+def test_run_picks_up_changes_after_a_version_bump(db, monkeypatch):
+    monkeypatch.setattr(broadcast_scheduler, 'VERSION_CHECK_INTERVAL', 0.1)
+    scheduler = BroadcastScheduler()
+
+    async def main():
+        task = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.2)
+        _assign(db, 'https://t.me/new', 0)
+        db.notify_broadcast_schedule_changed()
+        await asyncio.sleep(0.3)
+        task.cancel()
+
+    asyncio.run(main())
+    assert _queued_links(db) == ['https://t.me/new']
+    assert scheduler.stats['reloads'] == 2
+
+
+def test_disabled_broadcasts_are_not_fired(db):
+    _assign(db, 'https://t.me/a', 0)
+    conn = db.get_db_conn()
+    conn.execute("INSERT OR REPLACE INTO system_config (key, value) VALUES ('broadcast_enabled', '0')")
+    conn.commit()
+    conn.close()
+
+    async def main():
+        task = asyncio.create_task(BroadcastScheduler().run())
+        await asyncio.sleep(0.3)
+        task.cancel()
+
+    asyncio.run(main())
+    assert _queued_links(db) == []
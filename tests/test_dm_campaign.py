@@ -0,0 +1,128 @@
+import asyncio
+
+from telethon import errors
+
+from app import dm_campaign
+from app.dm_campaign import DmCampaignRunner
+from app.send_dispatcher import NoBotAvailableError
+
+from conftest import add_members, query
+
+
+async def _run_for(runner, send, seconds, **kwargs):
+    task = asyncio.create_task(runner.run(send, lambda: 1, **kwargs))
+    await asyncio.sleep(seconds)
+    task.cancel()
+
+
+def test_create_without_members_inserts_nothing(db):
+    assert db.create_dm_campaign('hi') == (None, 0)
+    assert query(db, 'SELECT COUNT(*) FROM dm_campaigns') == [(0,)]
+
+
+def test_claim_is_exclusive(db):
+    add_members(db, 1, 2)
+    campaign_id, total = db.create_dm_campaign('hi')
+    assert total == 2
+    a, b = DmCampaignRunner(), DmCampaignRunner()
+    assert a._claim()[0] == campaign_id
+    assert b._claim() is None
+
+
+def test_run_sends_to_every_member_and_completes(db):
+    add_members(db, *range(1, 6))
+    db.create_dm_campaign('hi')
+    sent = []
+
+    async def send(member_id, message):
+        sent.append(member_id)
+
+    asyncio.run(_run_for(DmCampaignRunner(), send, 1, rate_per_bot=100, chunk_size=2))
+    assert sent == [1, 2, 3, 4, 5]
+    assert query(db, 'SELECT status, cursor, sent_count FROM dm_campaigns') == [('completed', 5, 5)]
+
+
+def test_lease_is_renewed_while_a_send_is_slow(db, monkeypatch):
+    monkeypatch.setattr(dm_campaign, 'LEASE_SECONDS', 0.3)
+    add_members(db, 1, 2)
+    db.create_dm_campaign('hi')
+    owner, other = DmCampaignRunner(), DmCampaignRunner()
+    claimed_by_other = []
+
+    async def slow_send(member_id, message):
+        await asyncio.sleep(1)
+
+    async def main():
+        task = asyncio.create_task(owner.run(slow_send, lambda: 1, rate_per_bot=50))
+        await asyncio.sleep(0.7)
+        claimed_by_other.append(other._claim())
+        await asyncio.sleep(1)
+        task.cancel()
+
+    asyncio.run(main())
+    assert claimed_by_other == [None]
+    assert query(db, 'SELECT status, sent_count FROM dm_campaigns') == [('completed', 2)]
+
+
+def test_flood_wait_pauses_instead_of_deferring_the_rest(db, monkeypatch):
+    monkeypatch.setattr(dm_campaign, 'MAX_BLOCKED_PAUSE', 0.2)
+    add_members(db, *range(1, 11))
+    db.create_dm_campaign('hi')
+    flooded = []
+    sent = []
+
+    async def send(member_id, message):
+        if member_id == 3 and not flooded:
+            flooded.append(member_id)
+            raise errors.FloodWaitError(request=None, capture=300)
+        sent.append(member_id)
+
+    asyncio.run(_run_for(DmCampaignRunner(), send, 1.5, rate_per_bot=100))
+    assert sent == [1, 2] + list(range(4, 11))
+    # 只有遇到 FloodWait 的那一条转入发件箱
+    assert query(db, 'SELECT member_id FROM notify_outbox') == [(3,)]
+    assert query(db, 'SELECT status, cursor, sent_count, deferred_count FROM dm_campaigns') == \
+        [('completed', 10, 9, 1)]
+
+
+def test_no_bot_available_pauses_the_campaign(db, monkeypatch):
+    monkeypatch.setattr(dm_campaign, 'BLOCKED_PAUSE', 0.2)
+    add_members(db, *range(1, 6))
+    db.create_dm_campaign('hi')
+    sent = []
+
+    async def send(member_id, message):
+        if member_id == 2 and 2 not in sent:
+            sent.append(member_id)
+            raise NoBotAvailableError('没有可用的机器人客户端')
+        sent.append(member_id)
+
+    asyncio.run(_run_for(DmCampaignRunner(), send, 1.5, rate_per_bot=100))
+    assert query(db, 'SELECT member_id FROM notify_outbox') == [(2,)]
+    assert query(db, 'SELECT status, sent_count, deferred_count FROM dm_campaigns') == [('completed', 4, 1)]
+
+
+def test_unrelated_runtime_error_does_not_pause(db):
+    add_members(db, *range(1, 6))
+    db.create_dm_campaign('hi')
+    sent = []
+
+    async def send(member_id, message):
+        if member_id == 2:
+            raise RuntimeError('bug')
+        sent.append(member_id)
+
+    asyncio.run(_run_for(DmCampaignRunner(), send, 1, rate_per_bot=100))
+    assert sent == [1, 3, 4, 5]
+    assert query(db, 'SELECT status, sent_count, deferred_count FROM dm_campaigns') == [('completed', 4, 1)]
+
+
+def test_paused_campaign_is_released(db):
+    add_members(db, 1, 2, 3)
+    campaign_id, _ = db.create_dm_campaign('hi')
+
+    async def send(member_id, message):
+        db.set_dm_campaign_status(campaign_id, 'paused')
+
+    asyncio.run(_run_for(DmCampaignRunner(), send, 0.5, chunk_size=1))
+    assert query(db, 'SELECT status, cursor, claimed_by FROM dm_campaigns') == [('paused', 1, None)]
@@ -0,0 +1,96 @@
+import asyncio
+from types import SimpleNamespace
+
+from telethon import errors
+from telethon.tl.types import InputPhoto, MessageMediaPhoto
+
+from app.media_cache import MediaCache
+
+from conftest import query
+
+
+class _Client:
+    """记录每次 send_file 传入的文件；按需让缓存的引用失效"""
+
+    def __init__(self, expired=False):
+        self.sent = []
+        self.expired = expired
+        self._next_id = 1
+
+    async def send_file(self, entity, file, *args, **kwargs):
+        self.sent.append(file)
+        if isinstance(file, InputPhoto):
+            if self.expired:
+                raise errors.FileReferenceExpiredError(request=None)
+            photo = file
+        else:
+            photo = SimpleNamespace(id=self._next_id, access_hash=-self._next_id,
+                                    file_reference=b'ref%d' % self._next_id)
+            self._next_id += 1
+        return SimpleNamespace(media=MessageMediaPhoto(photo=photo))
+
+
+def _image(tmp_path, content=b'image'):
+    path = tmp_path / 'a.jpg'
+    path.write_bytes(content)
+    return str(path)
+
+
+def _send(cache, client, bot_id, path):
+    return asyncio.run(cache.send_file(client, bot_id, -100, path, caption='hi'))
+
+
+def test_file_is_uploaded_once_per_bot(db, tmp_path):
+    path = _image(tmp_path)
+    cache = MediaCache()
+    client = _Client()
+    _send(cache, client, 1, path)
+    _send(cache, client, 1, path)
+    _send(cache, client, 2, path)
+    assert client.sent[0] == path
+    assert isinstance(client.sent[1], InputPhoto) and client.sent[1].id == 1
+    # 文件引用只对上传它的机器人有效：另一个机器人重新上传
+    assert client.sent[2] == path
+    assert cache.stats == {'hits': 1, 'uploads': 2, 'reuploads': 0}
+
+
+def test_cached_reference_survives_restart(db, tmp_path):
+    path = _image(tmp_path)
+    _send(MediaCache(), _Client(), 1, path)
+    client = _Client()
+    _send(MediaCache(), client, 1, path)
+    assert client.sent == [InputPhoto(1, -1, b'ref1')]
+
+
+def test_expired_reference_is_uploaded_again(db, tmp_path):
+    path = _image(tmp_path)
+    cache = MediaCache()
+    _send(cache, _Client(), 1, path)
+    client = _Client(expired=True)
+    client._next_id = 7
+    _send(cache, client, 1, path)
+    assert client.sent[1] == path
+    assert cache.stats['reuploads'] == 1
+    assert query(db, 'SELECT media_id, access_hash FROM media_cache') == [('7', '-7')]
+
+
+def test_changed_file_is_not_served_from_cache(db, tmp_path):
+    cache = MediaCache()
+    client = _Client()
+    path = _image(tmp_path, b'old')
+    old_hash = cache.file_hash(path)
+    _send(cache, client, 1, path)
+    _image(tmp_path, b'new content')
+    assert cache.file_hash(path) != old_hash
+    _send(cache, client, 1, path)
+    assert client.sent == [path, path]
+
+
+def test_unknown_bot_sends_without_cache(db, tmp_path):
+    path = _image(tmp_path)
+    client = _Client()
+    cache = MediaCache()
+    _send(cache, client, None, path)
+    _send(cache, client, None, path)
+    assert client.sent == [path, path]
+    assert query(db, 'SELECT COUNT(*) FROM media_cache') == [(0,)]
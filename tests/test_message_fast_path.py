@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app import bot_logic
+
+
+def _message(text, private=True, sender_id=100):
+    return SimpleNamespace(raw_text=text, is_private=private, sender_id=sender_id,
+                           sender=SimpleNamespace(username=None))
+
+
+@pytest.fixture
+def resolved(db, monkeypatch):
+    """记录快速过滤解析过账号的消息"""
+    calls = []
+
+    def resolve(event):
+        calls.append(event.raw_text)
+        return event.sender_id
+
+    monkeypatch.setattr(bot_logic, 'resolve_event_account', resolve)
+    return calls
+
+
+def test_group_messages_drop_without_resolving_account(resolved):
+    assert bot_logic._message_fast_path(_message('hello', private=False)) == 'group_idle'
+    assert bot_logic._message_fast_path(_message('/cancel', private=False)) == 'group_idle'
+    assert resolved == []
+
+
+def test_unknown_commands_drop_without_resolving_account(resolved):
+    assert bot_logic._message_fast_path(_message('/unknown')) == 'unknown_command'
+    assert bot_logic._message_fast_path(_message(' /cancel ')) is None
+    assert resolved == []
+
+
+def test_private_text_checks_conversation_state(resolved, monkeypatch):
+    monkeypatch.setattr(bot_logic.conversation_store, 'has_active', lambda telegram_id: telegram_id == 100)
+    assert bot_logic._message_fast_path(_message('12.5')) is None
+    assert bot_logic._message_fast_path(_message('hi', sender_id=200)) == 'private_idle'
+    assert resolved == ['12.5', 'hi']
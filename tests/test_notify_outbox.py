@@ -0,0 +1,108 @@
+import asyncio
+import time
+
+from telethon import errors
+
+from app import notify_outbox
+from app.notify_outbox import NotifyOutbox
+
+from conftest import query
+
+
+def _deliver_once(outbox, send, outbox_id=1, max_attempts=5):
+    item = outbox._claim(outbox_id)
+    assert item is not None
+    asyncio.run(outbox._deliver(send, outbox_id, item, max_attempts))
+
+
+async def _fail(member_id, message):
+    raise ConnectionError('network down')
+
+
+def _row(db):
+    return query(db, 'SELECT status, attempts, next_attempt_at, claimed_by FROM notify_outbox')[0]
+
+
+def _make_due(db):
+    conn = db.get_db_conn()
+    conn.execute('UPDATE notify_outbox SET next_attempt_at = 0')
+    conn.commit()
+    conn.close()
+
+
+def test_temporary_failures_back_off_exponentially(db):
+    db.enqueue_notification(1, 'hi')
+    outbox = NotifyOutbox()
+    for attempt in (1, 2, 3):
+        before = time.time()
+        _deliver_once(outbox, _fail)
+        status, attempts, next_attempt_at, claimed_by = _row(db)
+        delay = notify_outbox.RETRY_BASE_DELAY * 2 ** (attempt - 1)
+        assert (status, attempts, claimed_by) == ('pending', attempt, None)
+        assert before + delay <= next_attempt_at <= time.time() + delay
+        _make_due(db)
+
+
+def test_backoff_is_capped(db, monkeypatch):
+    monkeypatch.setattr(notify_outbox, 'RETRY_MAX_DELAY', 15)
+    db.enqueue_notification(1, 'hi')
+    outbox = NotifyOutbox()
+    for _ in range(3):
+        _deliver_once(outbox, _fail)
+        _make_due(db)
+    before = time.time()
+    _deliver_once(outbox, _fail)
+    assert _row(db)[2] <= before + 15 + 1
+
+
+def test_permanent_error_fails_immediately(db):
+    db.enqueue_notification(1, 'hi')
+
+    async def blocked(member_id, message):
+        raise errors.UserIsBlockedError(request=None)
+
+    _deliver_once(NotifyOutbox(), blocked)
+    assert _row(db)[:2] == ('failed', 1)
+
+
+def test_gives_up_after_max_attempts(db):
+    db.enqueue_notification(1, 'hi')
+    outbox = NotifyOutbox()
+    _deliver_once(outbox, _fail, max_attempts=2)
+    _make_due(db)
+    _deliver_once(outbox, _fail, max_attempts=2)
+    assert _row(db)[:2] == ('failed', 2)
+
+
+def test_success_marks_sent(db):
+    db.enqueue_notification(1, 'hi')
+    sent = []
+
+    async def send(member_id, message):
+        sent.append((member_id, message))
+
+    _deliver_once(NotifyOutbox(), send)
+    assert sent == [(1, 'hi')]
+    assert _row(db)[:2] == ('sent', 1)
+
+
+def test_claim_is_exclusive(db):
+    db.enqueue_notification(1, 'hi')
+    a, b = NotifyOutbox(), NotifyOutbox()
+    assert a._claim(1) == (1, 'hi', 0)
+    assert b._claim(1) is None
+
+
+def test_only_expired_leases_are_recovered(db):
+    db.enqueue_notification(1, 'live')
+    db.enqueue_notification(2, 'dead')
+    live, starting = NotifyOutbox(), NotifyOutbox()
+    live._claim(1)
+    live._claim(2)
+    conn = db.get_db_conn()
+    conn.execute('UPDATE notify_outbox SET lease_until = ? WHERE id = 2', (time.time() - 1,))
+    conn.commit()
+    conn.close()
+    starting._recover_expired()
+    assert query(db, 'SELECT id, status FROM notify_outbox ORDER BY id') == \
+        [(1, 'sending'), (2, 'pending')]
@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+from telethon import errors
+
+from app import pinned_campaign
+from app.pinned_campaign import PinnedCampaignRunner
+
+from conftest import query
+
+LINKS = ['https://t.me/a', 'https://t.me/b']
+
+
+def test_claim_is_exclusive(db):
+    campaign_id, total = db.create_pinned_campaign('hello', LINKS)
+    assert total == 2
+    a, b = PinnedCampaignRunner(), PinnedCampaignRunner()
+    assert a._claim()[0] == campaign_id
+    assert b._claim() is None
+
+
+def test_run_pins_every_group_and_completes(db):
+    db.create_pinned_campaign('hello', LINKS)
+    sent = []
+
+    async def send(group_link, content):
+        sent.append(group_link)
+        return True, len(sent)
+
+    async def main():
+        task = asyncio.create_task(PinnedCampaignRunner().run(send))
+        await asyncio.sleep(0.5)
+        task.cancel()
+
+    asyncio.run(main())
+    assert sorted(sent) == LINKS
+    assert query(db, 'SELECT status FROM pinned_campaigns') == [('completed',)]
+    assert query(db, 'SELECT status FROM pinned_campaign_results') == [('pinned',), ('pinned',)]
+
+
+def test_lease_is_renewed_while_sends_are_in_flight(db, monkeypatch):
+    monkeypatch.setattr(pinned_campaign, 'LEASE_SECONDS', 0.3)
+    db.create_pinned_campaign('hello', LINKS)
+    owner, other = PinnedCampaignRunner(), PinnedCampaignRunner()
+    claimed_by_other = []
+
+    async def slow_send(group_link, content):
+        await asyncio.sleep(1)
+        return True, 1
+
+    async def main():
+        task = asyncio.create_task(owner.run(slow_send))
+        await asyncio.sleep(0.7)
+        claimed_by_other.append(other._claim())
+        await asyncio.sleep(1)
+        task.cancel()
+
+    asyncio.run(main())
+    assert claimed_by_other == [None]
+    assert query(db, 'SELECT status FROM pinned_campaigns') == [('completed',)]
+    assert query(db, 'SELECT status FROM pinned_campaign_results') == [('pinned',), ('pinned',)]
+
+
+def test_temporary_errors_back_off_and_permanent_errors_fail(db):
+    campaign_id, _ = db.create_pinned_campaign('hello', LINKS)
+    runner = PinnedCampaignRunner()
+    before = time.time()
+    runner._record_failure(campaign_id, LINKS[0], 1, errors.FloodWaitError(request=None, capture=120))
+    runner._record_failure(campaign_id, LINKS[1], 1, errors.ChatWriteForbiddenError(request=None))
+    (status, attempts, next_attempt_at), = query(
+        db, 'SELECT status, attempts, next_attempt_at FROM pinned_campaign_results WHERE group_link = ?',
+        (LINKS[0],))
+    assert (status, attempts) == ('pending', 1)
+    assert next_attempt_at >= before + 120
+    assert query(db, 'SELECT status FROM pinned_campaign_results WHERE group_link = ?',
+                 (LINKS[1],)) == [('failed',)]
+
+
+def test_retry_only_reopens_campaigns_with_failed_groups(db):
+    campaign_id, _ = db.create_pinned_campaign('hello', LINKS)
+    conn = db.get_db_conn()
+    conn.execute("UPDATE pinned_campaigns SET status = 'completed'")
+    conn.execute("UPDATE pinned_campaign_results SET status = 'pinned'")
+    conn.commit()
+    assert db.retry_pinned_campaign(campaign_id) == 0
+    assert query(db, 'SELECT status FROM pinned_campaigns') == [('completed',)]
+
+    conn.execute("UPDATE pinned_campaign_results SET status = 'failed' WHERE group_link = ?", (LINKS[0],))
+    conn.commit()
+    conn.close()
+    assert db.retry_pinned_campaign(campaign_id) == 1
+    assert query(db, 'SELECT status FROM pinned_campaigns') == [('running',)]
+
+
+def test_retry_does_not_reopen_cancelled_campaigns(db):
+    campaign_id, _ = db.create_pinned_campaign('hello', LINKS)
+    assert db.cancel_pinned_campaign(campaign_id)
+    conn = db.get_db_conn()
+    conn.execute("UPDATE pinned_campaign_results SET status = 'failed'")
+    conn.commit()
+    conn.close()
+    assert db.retry_pinned_campaign(campaign_id) == 0
+    assert query(db, 'SELECT status FROM pinned_campaigns') == [('cancelled',)]
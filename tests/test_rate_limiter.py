@@ -0,0 +1,172 @@
+import asyncio
+import time
+
+import pytest
+
+from app import rate_limiter
+from app.rate_limiter import SendRateLimiter, ButtonRateLimiter, RateLimitWaitError
+
+
+def _acquire(limiter, bot_id, chat_key, is_group=False, max_wait=None):
+    asyncio.run(limiter.acquire(bot_id, chat_key, is_group, max_wait=max_wait))
+
+
+def _wait_time(limiter, bot_id, chat_key, is_group=False):
+    """机器人、会话两层中需要等待最久的一层"""
+    buckets = (limiter._bot_bucket(bot_id), limiter._chat_bucket(bot_id, chat_key, is_group))
+    now = time.monotonic()
+    return max(bucket.wait_time(now) for bucket in buckets)
+
+
+# ==================== SendRateLimiter ====================
+
+def test_private_chat_allows_a_burst_then_paces(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'CHAT_RATE', 20)
+    monkeypatch.setattr(rate_limiter, 'CHAT_BURST', 2)
+    limiter = SendRateLimiter()
+
+    async def main():
+        start = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire(1, 100)
+        return time.monotonic() - start
+
+    elapsed = asyncio.run(main())
+    # 前两条用掉突发令牌，第三条等待 1 / CHAT_RATE 秒
+    assert 0.04 <= elapsed < 0.5
+    assert limiter.stats['acquired'] == 3
+
+
+def test_chats_are_paced_independently(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'CHAT_BURST', 1)
+    limiter = SendRateLimiter()
+    _acquire(limiter, 1, 100)
+    assert _wait_time(limiter, 1, 100) > 0
+    assert _wait_time(limiter, 1, 200) == 0
+    assert _wait_time(limiter, 2, 100) == 0
+
+
+def test_max_wait_fails_fast_without_taking_tokens(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'GROUP_BURST', 1)
+    limiter = SendRateLimiter()
+    _acquire(limiter, 1, -100, is_group=True, max_wait=0)
+    with pytest.raises(RateLimitWaitError) as info:
+        _acquire(limiter, 1, -100, is_group=True, max_wait=1)
+    # 群组每分钟 20 条：下一个令牌约 3 秒后
+    assert 2 < info.value.seconds <= 3
+    assert limiter.stats['acquired'] == 1
+
+
+def test_bots_do_not_share_a_global_bucket():
+    limiter = SendRateLimiter()
+    for bot_id in (1, 2):
+        for chat_key in range(rate_limiter.BOT_RATE):
+            _acquire(limiter, bot_id, chat_key, max_wait=0)
+    assert limiter.stats['acquired'] == 2 * rate_limiter.BOT_RATE
+
+
+def test_flood_wait_pauses_the_bot_and_the_chat():
+    limiter = SendRateLimiter()
+    limiter.record_flood_wait(1, 100, 30)
+    assert 29 < limiter.bot_pause_remaining(1) <= 30
+    assert limiter.bot_pause_remaining(2) == 0
+    assert _wait_time(limiter, 1, 200) > 29
+    assert _wait_time(limiter, 2, 100) == 0
+
+
+def test_flood_wait_slows_the_bot_down_and_success_recovers_it():
+    limiter = SendRateLimiter()
+    limiter.record_flood_wait(1, 100, 0)
+    bucket = limiter._bots[1]
+    assert bucket.rate == rate_limiter.BOT_RATE * rate_limiter.FLOOD_BACKOFF
+    limiter.record_success(1)
+    assert rate_limiter.BOT_RATE * rate_limiter.FLOOD_BACKOFF < bucket.rate < rate_limiter.BOT_RATE
+    for _ in range(100):
+        limiter.record_success(1)
+    assert bucket.rate == rate_limiter.BOT_RATE
+
+
+def test_repeated_flood_waits_do_not_stop_the_bot():
+    limiter = SendRateLimiter()
+    for _ in range(20):
+        limiter.record_flood_wait(1, 100, 0)
+    assert limiter._bots[1].rate == rate_limiter.BOT_RATE * rate_limiter.MIN_RATE_RATIO
+
+
+def test_slow_mode_pauses_only_that_group():
+    limiter = SendRateLimiter()
+    limiter.record_slow_mode(1, -100, 30)
+    assert limiter.bot_pause_remaining(1) == 0
+    assert _wait_time(limiter, 1, -100, is_group=True) > 29
+    assert _wait_time(limiter, 1, -200, is_group=True) == 0
+
+
+def test_idle_chat_buckets_are_pruned(monkeypatch):
+    monkeypatch.setattr(rate_limiter, 'PRUNE_EVERY', 2)
+    monkeypatch.setattr(rate_limiter, 'PRUNE_IDLE_SECONDS', 0)
+    limiter = SendRateLimiter()
+    _acquire(limiter, 1, 100)
+    limiter._chats[(1, 100)].tokens = rate_limiter.CHAT_BURST
+    limiter._chats[(1, 100)].updated -= 1
+    _acquire(limiter, 1, 200)
+    assert (1, 100) not in limiter._chats
+
+
+# ==================== ButtonRateLimiter ====================
+
+def test_third_click_within_burst_window_is_blocked():
+    limiter = ButtonRateLimiter()
+    assert limiter.check(1, now=1000) is None
+    assert limiter.check(1, now=1002) is None
+    remaining, _ = limiter.check(1, now=1004)
+    assert remaining == rate_limiter.BURST_PENALTY
+    # 惩罚期内的点击返回剩余时间
+    assert limiter.check(1, now=1034)[0] == rate_limiter.BURST_PENALTY - 30
+    # 其他用户不受影响
+    assert limiter.check(2, now=1004) is None
+
+
+def test_clicks_are_allowed_again_after_the_penalty():
+    limiter = ButtonRateLimiter()
+    for now in (1000, 1001, 1002):
+        limiter.check(1, now=now)
+    assert limiter.check(1, now=1002 + rate_limiter.BURST_PENALTY) is None
+    # 惩罚结束后重新计数
+    assert limiter.check(1, now=1003 + rate_limiter.BURST_PENALTY) is None
+
+
+def test_flood_rule_blocks_the_twentieth_click_within_a_minute():
+    limiter = ButtonRateLimiter()
+    # 每 3 秒一次，不触发连点规则
+    for i in range(rate_limiter.FLOOD_CLICKS - 1):
+        assert limiter.check(1, now=1000 + i * 3) is None
+    remaining, _ = limiter.check(1, now=1000 + (rate_limiter.FLOOD_CLICKS - 1) * 3)
+    assert remaining == rate_limiter.FLOOD_PENALTY
+    assert limiter.stats['flood_limited'] == 1
+
+
+def test_clicks_spread_over_more_than_a_minute_are_allowed():
+    limiter = ButtonRateLimiter()
+    for i in range(rate_limiter.FLOOD_CLICKS * 2):
+        assert limiter.check(1, now=1000 + i * 4) is None
+
+
+def test_least_recently_clicked_user_is_evicted():
+    limiter = ButtonRateLimiter(max_users=2)
+    limiter.check(1, now=1000)
+    limiter.check(2, now=1001)
+    limiter.check(1, now=1010)
+    limiter.check(3, now=1011)
+    assert limiter.tracked_users() == 2
+    assert set(limiter._users) == {1, 3}
+    assert limiter.stats['evicted'] == 1
+
+
+def test_sweep_drops_idle_users_but_keeps_restricted_ones():
+    limiter = ButtonRateLimiter()
+    limiter.check(1, now=1000)
+    for now in (1001, 1002, 1003):
+        limiter.check(2, now=now)
+    limiter.check(3, now=1050)
+    limiter._sweep(1061)
+    assert set(limiter._users) == {2, 3}
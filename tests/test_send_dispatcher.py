@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+from app.send_dispatcher import SendDispatcher, NoBotAvailableError
+
+from conftest import query
+
+
+class _Registry:
+    def get_id(self, client):
+        return getattr(client, 'bot_id', None)
+
+
+def _dispatcher(clients):
+    return SendDispatcher(lambda: clients, _Registry())
+
+
+def test_no_clients_raises_no_bot_available(db):
+    with pytest.raises(NoBotAvailableError):
+        asyncio.run(_dispatcher([]).send_message(1, 'hi'))
+
+
+def test_interactive_defers_when_no_bot_available(db):
+    sender = _dispatcher([]).interactive()
+    assert asyncio.run(sender.send_message(1, 'hi')) is None
+    assert query(db, 'SELECT member_id, message FROM notify_outbox') == [(1, 'hi')]
+
+
+def test_interactive_does_not_swallow_unrelated_runtime_errors(db):
+    class BrokenClient:
+        bot_id = 1
+
+        async def send_message(self, *args, **kwargs):
+            raise RuntimeError('bug')
+
+    sender = _dispatcher([BrokenClient()]).interactive()
+    with pytest.raises(RuntimeError, match='bug'):
+        asyncio.run(sender.send_message(1, 'hi'))
+    assert query(db, 'SELECT COUNT(*) FROM notify_outbox') == [(0,)]
@@ -0,0 +1,102 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+from telethon import errors
+
+from app import send_suppression
+from app.send_suppression import SendSuppressions, PeerSuppressedError
+
+from conftest import query
+
+DAY = 86400
+
+
+def _blocked():
+    return errors.UserIsBlockedError(request=None)
+
+
+def _until(suppressions, key):
+    return suppressions._entries[key][0]
+
+
+def test_blocked_user_is_suppressed(db):
+    suppressions = SendSuppressions()
+    assert suppressions.record(1, [_blocked()])
+    with pytest.raises(PeerSuppressedError) as info:
+        suppressions.check(1)
+    assert info.value.reason == 'user_blocked'
+    assert 3 * DAY - 5 < _until(suppressions, 1) - time.time() <= 3 * DAY
+    suppressions.check(2)
+
+
+def test_other_errors_are_not_suppressed(db):
+    suppressions = SendSuppressions()
+    assert not suppressions.record(1, [errors.FloodWaitError(request=None, capture=10)])
+    assert not suppressions.is_suppressed(1)
+    assert query(db, 'SELECT COUNT(*) FROM send_suppressions') == [(0,)]
+
+
+def test_strongest_reason_wins(db):
+    suppressions = SendSuppressions()
+    suppressions.record(1, [errors.PeerIdInvalidError(request=None), _blocked()])
+    assert suppressions._entries[1][1] == 'user_blocked'
+
+
+def test_each_failed_probe_doubles_the_ttl(db):
+    suppressions = SendSuppressions()
+    for strikes in (1, 2, 3):
+        suppressions.record(1, [_blocked()])
+        ttl = _until(suppressions, 1) - time.time()
+        assert 3 * DAY * 2 ** (strikes - 1) - 5 < ttl <= 3 * DAY * 2 ** (strikes - 1)
+    assert query(db, 'SELECT strikes FROM send_suppressions') == [(3,)]
+
+
+def test_ttl_is_capped(db):
+    suppressions = SendSuppressions()
+    for _ in range(10):
+        suppressions.record(1, [errors.UserDeactivatedError(request=None)])
+    assert _until(suppressions, 1) - time.time() <= send_suppression.MAX_TTL
+
+
+def test_expired_entry_lets_one_probe_through(db):
+    suppressions = SendSuppressions()
+    suppressions.record(1, [_blocked()])
+    suppressions._sync()
+    suppressions._entries[1] = (time.time() - 1,) + suppressions._entries[1][1:]
+    suppressions.check(1)
+
+
+def test_success_clears_the_entry(db):
+    suppressions = SendSuppressions()
+    suppressions.record('somegroup', [errors.ChatWriteForbiddenError(request=None)])
+    suppressions.clear('somegroup')
+    assert not suppressions.is_suppressed('somegroup')
+    assert query(db, 'SELECT strikes FROM send_suppressions') == [(0,)]
+    # 重新加入名单时从第一次重新计算
+    suppressions.record('somegroup', [errors.ChatWriteForbiddenError(request=None)])
+    assert suppressions._entries['somegroup'][2] == 1
+
+
+def test_other_processes_pick_up_records_and_clears(db):
+    writer, reader = SendSuppressions(), SendSuppressions()
+    writer.record(1, [_blocked()])
+    writer.record('-100123', [errors.ChannelPrivateError(request=None)])
+    assert reader.is_suppressed(1)
+    assert reader.is_suppressed(-100123)
+    writer.clear(1)
+    reader._sync_checked = 0
+    assert not reader.is_suppressed(1)
+
+
+def test_sync_does_not_depend_on_writer_clocks(db, monkeypatch):
+    writer, reader = SendSuppressions(), SendSuppressions()
+    writer.record(1, [_blocked()])
+    assert reader.is_suppressed(1)
+    # 另一个进程的时钟慢了一分钟
+    real_time = time.time
+    with monkeypatch.context() as m:
+        m.setattr(send_suppression, 'time', SimpleNamespace(time=lambda: real_time() - 60))
+        writer.record(2, [_blocked()])
+    reader._sync_checked = 0
+    assert reader.is_suppressed(2)
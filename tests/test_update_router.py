@@ -0,0 +1,103 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.update_router import UpdateRouter
+
+
+def _message(text):
+    return SimpleNamespace(raw_text=text)
+
+
+def _callback(data):
+    return SimpleNamespace(data=data)
+
+
+@pytest.fixture
+def routed():
+    prepared = []
+    calls = []
+    router = UpdateRouter(prepare=prepared.append,
+                          fallback_filter=lambda event: 'noise' if event.raw_text == 'noise' else None)
+
+    def handler(name):
+        async def handle(event):
+            calls.append(name)
+        handle.__name__ = name
+        return handle
+
+    router.command('/start')(handler('start'))
+    router.text('💰 我的余额')(handler('balance'))
+    router.callback(b'vip')(handler('vip'))
+    router.callback_prefix(b'flv_')(handler('flv'))
+    router.callback_prefix(b'flv_del_')(handler('flv_del'))
+    router.fallback(handler('fallback'))
+    return router, prepared, calls
+
+
+def test_commands_match_first_word_without_bot_name(routed):
+    router, prepared, calls = routed
+    for text in ('/start', '/start 12345', '/start@my_bot 12345'):
+        asyncio.run(router.dispatch_message(_message(text)))
+    assert calls == ['start'] * 3
+    assert len(prepared) == 3
+
+
+def test_menu_text_and_fallback(routed):
+    router, _, calls = routed
+    asyncio.run(router.dispatch_message(_message(' 💰 我的余额 ')))
+    asyncio.run(router.dispatch_message(_message('/unknown')))
+    asyncio.run(router.dispatch_message(_message('hello')))
+    assert calls == ['balance', 'fallback', 'fallback']
+
+
+def test_fallback_filter_drops_without_prepare(routed):
+    router, prepared, calls = routed
+    asyncio.run(router.dispatch_message(_message('noise')))
+    assert calls == [] and prepared == []
+    assert router.dropped == {'noise': 1}
+
+
+def test_fallback_filter_does_not_apply_to_routed_messages(routed):
+    router, _, calls = routed
+    router._fallback_filter = lambda event: 'always'
+    asyncio.run(router.dispatch_message(_message('/start')))
+    assert calls == ['start']
+
+
+def test_callbacks_prefer_exact_then_longest_prefix(routed):
+    router, prepared, calls = routed
+    for data in (b'vip', b'flv_3', b'flv_del_3', b'other', b''):
+        asyncio.run(router.dispatch_callback(_callback(data)))
+    assert calls == ['vip', 'flv', 'flv_del']
+    # 没有匹配的回调仍然执行 prepare
+    assert len(prepared) == 5
+
+
+def test_stats_and_hooks_record_errors(routed):
+    router, _, _ = routed
+    seen = []
+    router.add_hook(lambda route, seconds, error: seen.append((route, type(error).__name__)))
+
+    @router.command('/boom')
+    async def boom(event):
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError):
+        asyncio.run(router.dispatch_message(_message('/boom')))
+    asyncio.run(router.dispatch_message(_message('/start')))
+    assert router.stats['/boom']['calls'] == 1 and router.stats['/boom']['errors'] == 1
+    assert router.stats['/start']['errors'] == 0
+    assert seen == [('/boom', 'ValueError'), ('/start', 'NoneType')]
+
+
+def test_broken_hook_does_not_break_dispatch(routed):
+    router, _, calls = routed
+
+    def hook(route, seconds, error):
+        raise RuntimeError('hook')
+
+    router.add_hook(hook)
+    asyncio.run(router.dispatch_message(_message('/start')))
+    assert calls == ['start']